@@ -19,6 +19,7 @@ from app.models.rifa import Rifa
 from app.models.ticket import Ticket
 from app.models.ganador import Ganador
 from app.models.transaccion import Transaccion
+from app.models.rifa_counter import RifaCounter
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
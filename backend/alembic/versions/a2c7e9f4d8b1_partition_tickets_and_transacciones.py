@@ -0,0 +1,211 @@
+"""partition tickets and transacciones
+
+Revision ID: a2c7e9f4d8b1
+Revises: f1b6d8a2c4e9
+Create Date: 2026-10-18 18:12:09.730154+00:00
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a2c7e9f4d8b1'
+down_revision: Union[str, Sequence[str], None] = 'f1b6d8a2c4e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Both tables are rebuilt and copied in one transaction: on large databases run
+# this in a maintenance window, with purchases and workers stopped
+TICKET_PARTITIONS = 16
+MONTHS_AHEAD = 3
+
+TICKET_COLUMNS = "id, rifa_id, usuario_id, numero, comprado_en, estado, precio, transaccion_id, reservado_hasta"
+TICKETS_DDL = """
+    CREATE TABLE tickets (
+        id UUID NOT NULL DEFAULT gen_random_uuid(),
+        rifa_id UUID NOT NULL,
+        usuario_id UUID,
+        numero INTEGER NOT NULL,
+        comprado_en TIMESTAMP WITH TIME ZONE,
+        estado ticket_states,
+        precio INTEGER,
+        transaccion_id UUID,
+        reservado_hasta TIMESTAMP WITH TIME ZONE
+    ){partition}
+"""
+TICKET_INDEXES = [
+    "CREATE INDEX ix_tickets_rifa_disponible ON tickets (rifa_id, numero) WHERE estado = 'disponible'",
+    "CREATE INDEX ix_tickets_reservado_hasta ON tickets (reservado_hasta) WHERE estado = 'reservado'",
+    "CREATE INDEX ix_tickets_transaccion_id ON tickets (transaccion_id)",
+    "CREATE INDEX ix_tickets_usuario_id ON tickets (usuario_id)",
+    "CREATE INDEX ix_tickets_usuario_numero_id ON tickets (usuario_id, numero, id)",
+]
+
+TRANSACCION_COLUMNS = "id, user_id, amount, currency, provider, provider_ref, idempotency_key, status, created_at"
+TRANSACCIONES_DDL = """
+    CREATE TABLE transacciones (
+        id UUID NOT NULL DEFAULT gen_random_uuid(),
+        user_id UUID NOT NULL,
+        amount INTEGER NOT NULL,
+        currency VARCHAR(8),
+        provider VARCHAR(50),
+        provider_ref VARCHAR(255),
+        idempotency_key VARCHAR(255){key_null},
+        status trans_status,
+        created_at TIMESTAMP WITH TIME ZONE{created_null} DEFAULT now()
+    ){partition}
+"""
+TRANSACCION_INDEXES = [
+    "CREATE INDEX ix_transacciones_user_id ON transacciones (user_id)",
+    "CREATE INDEX ix_transacciones_provider_ref ON transacciones (provider_ref)",
+]
+
+
+def _month_start(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_tickets() -> None:
+    # A reference to a partitioned table must include its partition key
+    op.execute("ALTER TABLE ganadores ADD COLUMN rifa_id UUID")
+    op.execute("UPDATE ganadores g SET rifa_id = t.rifa_id FROM tickets t WHERE t.id = g.ticket_id")
+    op.execute("ALTER TABLE ganadores ALTER COLUMN rifa_id SET NOT NULL")
+    op.execute("ALTER TABLE ganadores DROP CONSTRAINT IF EXISTS ganadores_ticket_id_fkey")
+
+    op.execute("ALTER TABLE tickets RENAME TO tickets_sin_particion")
+    op.execute(TICKETS_DDL.format(partition=" PARTITION BY HASH (rifa_id)"))
+    for remainder in range(TICKET_PARTITIONS):
+        op.execute(
+            f"CREATE TABLE tickets_p{remainder:02d} PARTITION OF tickets "
+            f"FOR VALUES WITH (MODULUS {TICKET_PARTITIONS}, REMAINDER {remainder})"
+        )
+    op.execute(f"INSERT INTO tickets ({TICKET_COLUMNS}) SELECT {TICKET_COLUMNS} FROM tickets_sin_particion")
+    op.execute("DROP TABLE tickets_sin_particion")
+
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT tickets_pkey PRIMARY KEY (id, rifa_id)")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT uq_tickets_rifa_numero UNIQUE (rifa_id, numero)")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT tickets_rifa_id_fkey FOREIGN KEY (rifa_id) REFERENCES rifas (id)")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT tickets_usuario_id_fkey FOREIGN KEY (usuario_id) REFERENCES users (id)")
+    for ddl in TICKET_INDEXES:
+        op.execute(ddl)
+
+    op.execute(
+        "ALTER TABLE ganadores ADD CONSTRAINT ganadores_ticket_id_rifa_id_fkey "
+        "FOREIGN KEY (ticket_id, rifa_id) REFERENCES tickets (id, rifa_id)"
+    )
+    op.execute("CREATE INDEX ix_ganadores_rifa_id ON ganadores (rifa_id)")
+
+
+def _partition_transacciones() -> None:
+    op.execute("ALTER TABLE transacciones RENAME TO transacciones_sin_particion")
+    op.execute(TRANSACCIONES_DDL.format(
+        key_null=" NOT NULL", created_null=" NOT NULL", partition=" PARTITION BY RANGE (created_at)"
+    ))
+
+    # One partition per month from the oldest transaction to a few months ahead
+    now = datetime.utcnow()
+    oldest = op.get_bind().execute(sa.text("SELECT min(created_at) FROM transacciones_sin_particion")).scalar()
+    month = _month_start(oldest or now)
+    last = _add_months(_month_start(now), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE transacciones_{month:%Y_%m} PARTITION OF transacciones "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    op.execute("CREATE TABLE transacciones_default PARTITION OF transacciones DEFAULT")
+
+    op.execute(f"""
+        INSERT INTO transacciones ({TRANSACCION_COLUMNS})
+        SELECT id, user_id, amount, currency, provider, provider_ref,
+               coalesce(idempotency_key, 'legacy-' || id), status, coalesce(created_at, now())
+        FROM transacciones_sin_particion
+    """)
+    op.execute("DROP TABLE transacciones_sin_particion")
+
+    op.execute("ALTER TABLE transacciones ADD CONSTRAINT transacciones_pkey PRIMARY KEY (id, created_at)")
+    op.execute("ALTER TABLE transacciones ADD CONSTRAINT transacciones_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)")
+    for ddl in TRANSACCION_INDEXES:
+        op.execute(ddl)
+    op.execute("CREATE INDEX ix_transacciones_idempotency_key ON transacciones (idempotency_key)")
+
+    # Idempotency keys stay globally unique through an unpartitioned table fed by a trigger
+    op.create_table(
+        'transaccion_claves',
+        sa.Column('idempotency_key', sa.String(length=255), nullable=False),
+        sa.Column('transaccion_id', sa.UUID(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.PrimaryKeyConstraint('idempotency_key')
+    )
+    op.execute("""
+        INSERT INTO transaccion_claves (idempotency_key, transaccion_id, created_at)
+        SELECT idempotency_key, id, created_at FROM transacciones
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION registrar_clave_transaccion() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO transaccion_claves (idempotency_key, transaccion_id, created_at)
+            VALUES (NEW.idempotency_key, NEW.id, NEW.created_at);
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_transacciones_clave AFTER INSERT ON transacciones
+        FOR EACH ROW EXECUTE FUNCTION registrar_clave_transaccion()
+    """)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    _partition_tickets()
+    _partition_transacciones()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Detached monthly partitions are not brought back
+    op.execute("DROP TRIGGER IF EXISTS trg_transacciones_clave ON transacciones")
+    op.execute("DROP FUNCTION IF EXISTS registrar_clave_transaccion()")
+    op.drop_table('transaccion_claves')
+    op.execute("ALTER TABLE transacciones RENAME TO transacciones_particionada")
+    op.execute("ALTER TABLE transacciones_particionada DROP CONSTRAINT transacciones_pkey")
+    for ddl in TRANSACCION_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {ddl.split()[2]}")
+    op.execute("DROP INDEX IF EXISTS ix_transacciones_idempotency_key")
+    op.execute(TRANSACCIONES_DDL.format(key_null="", created_null="", partition=""))
+    op.execute(f"INSERT INTO transacciones ({TRANSACCION_COLUMNS}) SELECT {TRANSACCION_COLUMNS} FROM transacciones_particionada")
+    op.execute("DROP TABLE transacciones_particionada CASCADE")
+    op.execute("ALTER TABLE transacciones ADD CONSTRAINT transacciones_pkey PRIMARY KEY (id)")
+    op.execute("ALTER TABLE transacciones ADD CONSTRAINT transacciones_user_id_fkey FOREIGN KEY (user_id) REFERENCES users (id)")
+    for ddl in TRANSACCION_INDEXES:
+        op.execute(ddl)
+    op.execute("CREATE UNIQUE INDEX uq_transacciones_idempotency_key ON transacciones (idempotency_key)")
+
+    op.execute("DROP INDEX IF EXISTS ix_ganadores_rifa_id")
+    op.execute("ALTER TABLE ganadores DROP CONSTRAINT IF EXISTS ganadores_ticket_id_rifa_id_fkey")
+    op.execute("ALTER TABLE tickets RENAME TO tickets_particionada")
+    op.execute("ALTER TABLE tickets_particionada DROP CONSTRAINT tickets_pkey")
+    op.execute("ALTER TABLE tickets_particionada DROP CONSTRAINT uq_tickets_rifa_numero")
+    for ddl in TICKET_INDEXES:
+        op.execute(f"DROP INDEX IF EXISTS {ddl.split()[2]}")
+    op.execute(TICKETS_DDL.format(partition=""))
+    op.execute(f"INSERT INTO tickets ({TICKET_COLUMNS}) SELECT {TICKET_COLUMNS} FROM tickets_particionada")
+    op.execute("DROP TABLE tickets_particionada CASCADE")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT tickets_pkey PRIMARY KEY (id)")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT uq_tickets_rifa_numero UNIQUE (rifa_id, numero)")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT tickets_rifa_id_fkey FOREIGN KEY (rifa_id) REFERENCES rifas (id)")
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT tickets_usuario_id_fkey FOREIGN KEY (usuario_id) REFERENCES users (id)")
+    for ddl in TICKET_INDEXES:
+        op.execute(ddl)
+    op.execute("ALTER TABLE ganadores ADD CONSTRAINT ganadores_ticket_id_fkey FOREIGN KEY (ticket_id) REFERENCES tickets (id)")
+    op.drop_column('ganadores', 'rifa_id')
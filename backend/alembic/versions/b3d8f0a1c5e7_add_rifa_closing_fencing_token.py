@@ -0,0 +1,28 @@
+"""add rifa closing fencing token
+
+Revision ID: b3d8f0a1c5e7
+Revises: a2c7e9f4d8b1
+Create Date: 2026-10-18 21:05:37.418206+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3d8f0a1c5e7'
+down_revision: Union[str, Sequence[str], None] = 'a2c7e9f4d8b1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('rifas', sa.Column('cierre_fencing', sa.BigInteger(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rifas', 'cierre_fencing')
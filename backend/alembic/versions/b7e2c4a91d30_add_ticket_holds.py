@@ -0,0 +1,33 @@
+"""add ticket holds
+
+Revision ID: b7e2c4a91d30
+Revises: 8cdd12475275
+Create Date: 2026-10-18 09:12:44.318220+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e2c4a91d30'
+down_revision: Union[str, Sequence[str], None] = '8cdd12475275'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # ALTER TYPE ... ADD VALUE cannot run inside a transaction block on older Postgres
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE ticket_states ADD VALUE IF NOT EXISTS 'reservado' AFTER 'disponible'")
+    op.add_column('tickets', sa.Column('reservado_hasta', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("UPDATE tickets SET estado = 'disponible', usuario_id = NULL, transaccion_id = NULL WHERE estado = 'reservado'")
+    op.drop_column('tickets', 'reservado_hasta')
+    # Postgres cannot drop enum values; 'reservado' stays in ticket_states
@@ -0,0 +1,53 @@
+"""add rifa counters
+
+Revision ID: c3f1a8d56e27
+Revises: b7e2c4a91d30
+Create Date: 2026-10-18 11:03:27.514906+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f1a8d56e27'
+down_revision: Union[str, Sequence[str], None] = 'b7e2c4a91d30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'rifa_counters',
+        sa.Column('rifa_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('disponibles', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('reservadas', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('vendidas', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('ganadores', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('recaudo_bruto', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('actualizado_en', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['rifa_id'], ['rifas.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('rifa_id')
+    )
+    # Backfill from the tickets table
+    op.execute("""
+        INSERT INTO rifa_counters (rifa_id, disponibles, reservadas, vendidas, ganadores, recaudo_bruto)
+        SELECT r.id,
+               count(t.id) FILTER (WHERE t.estado = 'disponible'),
+               count(t.id) FILTER (WHERE t.estado = 'reservado'),
+               count(t.id) FILTER (WHERE t.estado = 'vendido'),
+               count(t.id) FILTER (WHERE t.estado = 'ganador'),
+               coalesce(sum(t.precio) FILTER (WHERE t.estado IN ('vendido', 'ganador')), 0)
+        FROM rifas r
+        LEFT JOIN tickets t ON t.rifa_id = r.id
+        GROUP BY r.id
+    """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rifa_counters')
@@ -0,0 +1,57 @@
+"""add hot path indexes
+
+Revision ID: d9e4b27c1f58
+Revises: c3f1a8d56e27
+Create Date: 2026-10-18 12:41:09.273615+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd9e4b27c1f58'
+down_revision: Union[str, Sequence[str], None] = 'c3f1a8d56e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (name, definition) built with CREATE INDEX CONCURRENTLY so live tables are not write-locked
+INDEXES = [
+    # Unique ticket numbers per rifa; also serves lookups by rifa and by chosen numbers
+    ("uq_tickets_rifa_numero", "UNIQUE INDEX {name} ON tickets (rifa_id, numero)"),
+    # Allocation: lowest free numbers of a rifa, free numbers near a chosen one
+    ("ix_tickets_rifa_disponible", "INDEX {name} ON tickets (rifa_id, numero) WHERE estado = 'disponible'"),
+    # Expired holds sweep
+    ("ix_tickets_reservado_hasta", "INDEX {name} ON tickets (reservado_hasta) WHERE estado = 'reservado'"),
+    ("ix_tickets_transaccion_id", "INDEX {name} ON tickets (transaccion_id)"),
+    ("ix_tickets_usuario_id", "INDEX {name} ON tickets (usuario_id)"),
+    # Purchase idempotency check
+    ("uq_transacciones_idempotency_key", "UNIQUE INDEX {name} ON transacciones (idempotency_key)"),
+    # Stripe webhooks look transactions up by payment intent
+    ("ix_transacciones_provider_ref", "INDEX {name} ON transacciones (provider_ref)"),
+    ("ix_transacciones_user_id", "INDEX {name} ON transacciones (user_id)"),
+    # One winner record per ticket
+    ("uq_ganadores_ticket_id", "UNIQUE INDEX {name} ON ganadores (ticket_id)"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The model has always had idempotency_key but no earlier migration created it
+    op.execute("ALTER TABLE transacciones ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255)")
+    # CONCURRENTLY cannot run inside a transaction block. A failed build leaves an
+    # INVALID index behind: drop it before running the migration again
+    with op.get_context().autocommit_block():
+        for name, definition in INDEXES:
+            op.execute("CREATE " + definition.replace("{name}", f"CONCURRENTLY IF NOT EXISTS {name}", 1))
+    # Promote the unique index to a constraint without rebuilding it
+    op.execute("ALTER TABLE tickets ADD CONSTRAINT uq_tickets_rifa_numero UNIQUE USING INDEX uq_tickets_rifa_numero")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("ALTER TABLE tickets DROP CONSTRAINT IF EXISTS uq_tickets_rifa_numero")
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
@@ -0,0 +1,41 @@
+"""add keyset pagination indexes
+
+Revision ID: e5a7c0d9b3f2
+Revises: d9e4b27c1f58
+Create Date: 2026-10-18 15:02:37.518204+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c0d9b3f2'
+down_revision: Union[str, Sequence[str], None] = 'd9e4b27c1f58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# (name, definition) matching the sort key of each paginated list.
+# categoria_rifa pages on its unique nombre, already indexed
+INDEXES = [
+    ("ix_rifas_creado_en_id", "INDEX {name} ON rifas (creado_en, id)"),
+    ("ix_users_creado_en_id", "INDEX {name} ON users (creado_en, id)"),
+    ("ix_loterias_nombre_id", "INDEX {name} ON loterias (nombre, id)"),
+    ("ix_tickets_usuario_numero_id", "INDEX {name} ON tickets (usuario_id, numero, id)"),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # See d9e4b27c1f58: CONCURRENTLY needs autocommit and leaves INVALID indexes on failure
+    with op.get_context().autocommit_block():
+        for name, definition in INDEXES:
+            op.execute("CREATE " + definition.replace("{name}", f"CONCURRENTLY IF NOT EXISTS {name}", 1))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, _ in reversed(INDEXES):
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
@@ -0,0 +1,33 @@
+"""add rifa ticket storage mode
+
+Revision ID: f1b6d8a2c4e9
+Revises: e5a7c0d9b3f2
+Create Date: 2026-10-18 16:20:44.061392+00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f1b6d8a2c4e9'
+down_revision: Union[str, Sequence[str], None] = 'e5a7c0d9b3f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+storage_modes = sa.Enum('filas', 'compacto', name='ticket_storage_modes')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    storage_modes.create(op.get_bind(), checkfirst=True)
+    # Existing rifas keep one row per number
+    op.add_column('rifas', sa.Column('almacenamiento', storage_modes, server_default='filas', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rifas', 'almacenamiento')
+    storage_modes.drop(op.get_bind(), checkfirst=True)
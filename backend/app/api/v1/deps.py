@@ -1,15 +1,17 @@
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 
 from app.core.config import settings
 from app.core.security import verify_token
-from app.db.session import get_db as get_db_session
+from app.db.session import get_db as get_db_session, get_read_db as get_read_db_session
 from app.models.user import User
+from app.repositories.user_repository import UserRepository
 from app.schemas.auth import TokenData
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.api_v1_prefix}/auth/login")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.api_v1_prefix}/auth/login", auto_error=False)
 
 
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -17,6 +19,18 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         yield db
 
 
+async def get_read_db(token: Optional[str] = Depends(optional_oauth2_scheme)) -> AsyncGenerator[AsyncSession, None]:
+    """Session for read-only endpoints: a replica, or the primary right after the caller bought something."""
+    user_id = None
+    if token:
+        try:
+            user_id = verify_token(token, ValueError()).user_id
+        except ValueError:
+            pass
+    async for db in get_read_db_session(user_id):
+        yield db
+
+
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
     db: AsyncSession = Depends(get_db)
@@ -27,24 +41,19 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     token_data = verify_token(token, credentials_exception)
-    user = await db.get(User, token_data.email)  # assuming email is id, but wait, it's filter by email
-    # Actually, db.query(User).filter(User.email == token_data.email).first()
-    # For async, it's (await db.execute(select(User).where(User.email == token_data.email))).scalar_one_or_none()
-    from sqlalchemy import select
-    result = await db.execute(select(User).where(User.email == token_data.email))
-    user = result.scalar_one_or_none()
+    user = await UserRepository().get_by_email(db, token_data.email)
     if user is None:
         raise credentials_exception
     return user
 
 
-def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_active_user(current_user: User = Depends(get_current_user)) -> User:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
 
-def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
+async def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
     if current_user.rol != "admin":
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
@@ -53,7 +62,7 @@ def get_current_admin_user(current_user: User = Depends(get_current_active_user)
     return current_user
 
 
-def get_current_operador_user(current_user: User = Depends(get_current_active_user)) -> User:
+async def get_current_operador_user(current_user: User = Depends(get_current_active_user)) -> User:
     if current_user.rol not in ["admin", "operador"]:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
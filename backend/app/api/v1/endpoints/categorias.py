@@ -1,40 +1,43 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
 
-from app.api.v1.deps import get_db, get_current_operador_user
-from app.models.categoria import Categoria
+from app.api.v1.deps import get_db, get_read_db, get_current_operador_user
+from app.repositories.categoria_repository import CategoriaRepository
 from app.schemas.categoria import CategoriaOut, CategoriaCreate
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[CategoriaOut])
-def read_categorias(
-    db: Session = Depends(get_db),
+async def read_categorias(
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100
 ):
-    categorias = db.query(Categoria).offset(skip).limit(limit).all()
-    return categorias
+    try:
+        page = await CategoriaRepository().get_page(db, cursor, limit, skip=skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
 
 
 @router.post("/", response_model=CategoriaOut)
-def create_categoria(
+async def create_categoria(
     categoria_in: CategoriaCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
     try:
-        db_categoria = Categoria(**categoria_in.dict())
-        db.add(db_categoria)
-        db.commit()
-        db.refresh(db_categoria)
-        return db_categoria
+        return await CategoriaRepository().create(db, categoria_in)
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Categoria with this name already exists"
-        )
\ No newline at end of file
+        )
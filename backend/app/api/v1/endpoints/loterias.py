@@ -1,78 +1,71 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.v1.deps import get_db, get_current_operador_user
-from app.models.loteria import Loteria
+from app.api.v1.deps import get_db, get_read_db, get_current_operador_user
+from app.repositories.loteria_repository import LoteriaRepository
 from app.schemas.loteria import LoteriaOut, LoteriaCreate, LoteriaUpdate
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[LoteriaOut])
-def read_loterias(
-    db: Session = Depends(get_db),
+async def read_loterias(
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100
 ):
-    loterias = db.query(Loteria).offset(skip).limit(limit).all()
-    return loterias
+    try:
+        page = await LoteriaRepository().get_page(db, cursor, limit, skip=skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
 
 
 @router.post("/", response_model=LoteriaOut)
-def create_loteria(
+async def create_loteria(
     loteria_in: LoteriaCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    db_loteria = Loteria(**loteria_in.dict())
-    db.add(db_loteria)
-    db.commit()
-    db.refresh(db_loteria)
-    return db_loteria
+    return await LoteriaRepository().create(db, loteria_in)
 
 
 @router.get("/{loteria_id}", response_model=LoteriaOut)
-def read_loteria(
+async def read_loteria(
     loteria_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    loteria = db.query(Loteria).filter(Loteria.id == loteria_id).first()
+    loteria = await LoteriaRepository().get_by_id(db, loteria_id)
     if loteria is None:
         raise HTTPException(status_code=404, detail="Loteria not found")
     return loteria
 
 
 @router.put("/{loteria_id}", response_model=LoteriaOut)
-def update_loteria(
+async def update_loteria(
     loteria_id: str,
     loteria_in: LoteriaUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    loteria = db.query(Loteria).filter(Loteria.id == loteria_id).first()
+    repo = LoteriaRepository()
+    loteria = await repo.get_by_id(db, loteria_id)
     if loteria is None:
         raise HTTPException(status_code=404, detail="Loteria not found")
-
-    update_data = loteria_in.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(loteria, field, value)
-
-    db.commit()
-    db.refresh(loteria)
-    return loteria
+    return await repo.update(db, loteria, loteria_in)
 
 
 @router.delete("/{loteria_id}")
-def delete_loteria(
+async def delete_loteria(
     loteria_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    loteria = db.query(Loteria).filter(Loteria.id == loteria_id).first()
-    if loteria is None:
+    if await LoteriaRepository().delete(db, loteria_id) is None:
         raise HTTPException(status_code=404, detail="Loteria not found")
-
-    db.delete(loteria)
-    db.commit()
     return {"message": "Loteria deleted successfully"}
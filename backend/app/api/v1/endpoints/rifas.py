@@ -1,17 +1,20 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Request
+import base64
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response, Header
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Session
-import random
 
-from app.api.v1.deps import get_db, get_current_operador_user, get_current_active_user
+from app.api.v1.deps import get_db, get_read_db, get_current_operador_user, get_current_active_user
 from app.models.rifa import Rifa
-from app.models.ticket import Ticket
-from app.models.ganador import Ganador
-from app.schemas.rifa import RifaOut, RifaCreate, RifaUpdate, RifaList
+from app.schemas.rifa import RifaOut, RifaCreate, RifaUpdate, RifaList, RifaAvailability
 from app.schemas.ticket import TicketPurchase, TicketPurchaseResponse
+from app.repositories.rifa_repository import RifaRepository
 from app.services.purchase_service import PurchaseService
-from app.services.rifa_service import RifaService
+from app.services.rifa_service import RifaService, closing_eta, closing_token
+from app.services.inventory_service import TicketInventoryService, NumbersUnavailableError
+from app.services.ticket_materialization_service import TicketMaterializationService
+from app.core.config import settings
+from app.core.celery_app import celery_app
 from app.core.rate_limiting import purchase_limiter
 from app.core.logging import audit_logger
 
@@ -19,112 +22,166 @@ router = APIRouter()
 
 
 @router.get("/", response_model=List[RifaList])
-def read_rifas(
-    db: Session = Depends(get_db),
+async def read_rifas(
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100
 ):
-    rifas = db.query(Rifa).offset(skip).limit(limit).all()
-    return rifas
+    try:
+        page = await RifaRepository().get_rifas_with_counters(db, cursor, limit, skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
+
+
+async def _materialize_tickets(db: AsyncSession, rifa: Rifa) -> None:
+    """Create the rifa's tickets now, or in the background for very large rifas."""
+    if (rifa.total_boletas or 0) > settings.ticket_materialization_inline_limit:
+        celery_app.send_task("app.workers.tasks.materialize_rifa_tickets", args=[str(rifa.id)])
+    else:
+        await TicketMaterializationService().materialize(db, str(rifa.id))
+
+
+async def _schedule_closing(rifa: Rifa) -> None:
+    """Close the rifa at its fecha_fin; closings scheduled for an earlier date go stale."""
+    if rifa.fecha_fin is None:
+        return
+    try:
+        # Publishing blocks on the broker: keep it off the event loop
+        await run_in_threadpool(
+            celery_app.send_task,
+            "app.workers.tasks.close_rifa_at",
+            args=[str(rifa.id), closing_token(rifa.fecha_fin)],
+            eta=closing_eta(rifa.fecha_fin)
+        )
+    except Exception as e:
+        # The rifa is already saved; the periodic close_expired_rifas sweep closes it instead
+        audit_logger.error("rifa_closing_schedule_failed", rifa_id=str(rifa.id), error=str(e))
 
 
 @router.post("/", response_model=RifaOut)
-def create_rifa(
+async def create_rifa(
     rifa_in: RifaCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    db_rifa = Rifa(**rifa_in.dict())
-    db.add(db_rifa)
-    db.commit()
-    db.refresh(db_rifa)
+    db_rifa = await RifaRepository().create(db, rifa_in)
+    await _materialize_tickets(db, db_rifa)
+    await _schedule_closing(db_rifa)
     return db_rifa
 
 
 @router.get("/{rifa_id}", response_model=RifaOut)
-def read_rifa(
+async def read_rifa(
     rifa_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    rifa = db.query(Rifa).filter(Rifa.id == rifa_id).first()
+    rifa = await RifaRepository().get_rifa_with_tickets_count(db, rifa_id)
     if rifa is None:
         raise HTTPException(status_code=404, detail="Rifa not found")
     return rifa
 
 
+@router.get("/{rifa_id}/availability", response_model=RifaAvailability)
+async def read_rifa_availability(
+    rifa_id: str,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+    if_none_match: Optional[str] = Header(None)
+):
+    """Sold/reserved numbers of a rifa as a base64 bitmap; poll with If-None-Match."""
+    rifa = await RifaRepository().get_by_id(db, rifa_id)
+    if rifa is None:
+        raise HTTPException(status_code=404, detail="Rifa not found")
+
+    snapshot = await TicketInventoryService().availability_snapshot(db, rifa)
+    headers = {"ETag": snapshot["etag"], "Cache-Control": "no-cache"}
+    if if_none_match and snapshot["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return RifaAvailability(
+        rifa_id=rifa.id,
+        total_boletas=rifa.total_boletas,
+        version=snapshot["version"],
+        bitmap=base64.b64encode(snapshot["bitmap"]).decode()
+    )
+
+
 @router.put("/{rifa_id}", response_model=RifaOut)
-def update_rifa(
+async def update_rifa(
     rifa_id: str,
     rifa_in: RifaUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    rifa = db.query(Rifa).filter(Rifa.id == rifa_id).first()
+    rifa = await RifaRepository().get_by_id(db, rifa_id)
     if rifa is None:
         raise HTTPException(status_code=404, detail="Rifa not found")
 
     update_data = rifa_in.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(rifa, field, value)
-
-    db.commit()
-    db.refresh(rifa)
+    rifa = await RifaRepository().update(db, rifa, rifa_in)
+    # Activating or growing a rifa creates the tickets it is missing
+    if update_data.get("estado") == "activa" or "total_boletas" in update_data:
+        await _materialize_tickets(db, rifa)
+    if update_data.get("estado") == "activa" or "fecha_fin" in update_data:
+        await _schedule_closing(rifa)
+    # A closed or cancelled rifa stops selling: its Redis inventory goes away
+    if update_data.get("estado") in ("cerrada", "cancelada"):
+        await RifaService().drop_inventory(rifa_id)
     return rifa
 
 
 @router.delete("/{rifa_id}")
-def delete_rifa(
+async def delete_rifa(
     rifa_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    rifa = db.query(Rifa).filter(Rifa.id == rifa_id).first()
-    if rifa is None:
+    if await RifaRepository().delete(db, rifa_id) is None:
         raise HTTPException(status_code=404, detail="Rifa not found")
-
-    db.delete(rifa)
-    db.commit()
+    await RifaService().drop_inventory(rifa_id)
     return {"message": "Rifa deleted successfully"}
 
 
 @router.post("/{rifa_id}/close")
-def close_rifa(
+async def close_rifa(
     rifa_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    rifa_service = RifaService(db)
-    return rifa_service.close_rifa(rifa_id)
+    return await RifaService().close_rifa(db, rifa_id)
 
 
 @router.post("/{rifa_id}/recalculate")
-def recalculate_rifa(
+async def recalculate_rifa(
     rifa_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    rifa_service = RifaService(db)
-    return rifa_service.recalculate_rifa(rifa_id)
+    return await RifaService().recalculate_rifa(db, rifa_id)
 
 
 @router.post("/{rifa_id}/cerrar")
-def cerrar_rifa(
+async def cerrar_rifa(
     rifa_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    rifa_service = RifaService(db)
-    return rifa_service.close_rifa(rifa_id)
+    return await RifaService().close_rifa(db, rifa_id)
 
 
 @router.post("/{rifa_id}/recalcular")
-def recalcular_rifa(
+async def recalcular_rifa(
     rifa_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user = Depends(get_current_operador_user)
 ):
-    rifa_service = RifaService(db)
-    return rifa_service.recalculate_rifa(rifa_id)
+    return await RifaService().recalculate_rifa(db, rifa_id)
 
 
 @router.post("/{rifa_id}/tickets", response_model=TicketPurchaseResponse)
@@ -169,6 +226,18 @@ async def purchase_tickets_for_rifa(
         )
 
         return result
+    except NumbersUnavailableError as e:
+        audit_logger.warning(
+            "rifa_purchase_failed",
+            user_id=str(current_user.id),
+            rifa_id=rifa_id,
+            quantity=purchase.quantity,
+            error=str(e)
+        )
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "unavailable": e.unavailable, "suggestions": e.suggestions}
+        )
     except ValueError as e:
         # Audit log failed purchase
         audit_logger.warning(
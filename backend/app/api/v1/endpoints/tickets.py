@@ -1,11 +1,13 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.v1.deps import get_db, get_current_active_user
+from app.api.v1.deps import get_db, get_read_db, get_current_active_user
 from app.models.ticket import Ticket
+from app.repositories.ticket_repository import TicketRepository
 from app.services.purchase_service import PurchaseService
-from app.schemas.ticket import TicketOut, TicketPurchase, TicketPurchaseResponse
+from app.services.inventory_service import NumbersUnavailableError
+from app.schemas.ticket import TicketOut, TicketPurchase, TicketPurchaseResponse, CartCheckout
 from app.core.rate_limiting import purchase_limiter
 from app.core.logging import audit_logger
 
@@ -13,14 +15,21 @@ router = APIRouter()
 
 
 @router.get("/", response_model=List[TicketOut])
-def read_tickets(
-    db: Session = Depends(get_db),
+async def read_tickets(
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
     current_user = Depends(get_current_active_user),
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100
 ):
-    tickets = db.query(Ticket).filter(Ticket.usuario_id == current_user.id).offset(skip).limit(limit).all()
-    return tickets
+    try:
+        page = await TicketRepository().get_user_tickets_page(db, current_user.id, cursor, limit, skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
 
 
 @router.post("/purchase", response_model=TicketPurchaseResponse)
@@ -60,6 +69,18 @@ async def purchase_tickets(
         )
 
         return result
+    except NumbersUnavailableError as e:
+        audit_logger.warning(
+            "purchase_failed",
+            user_id=str(current_user.id),
+            rifa_id=str(purchase.rifa_id),
+            quantity=purchase.quantity,
+            error=str(e)
+        )
+        raise HTTPException(
+            status_code=409,
+            detail={"message": str(e), "unavailable": e.unavailable, "suggestions": e.suggestions}
+        )
     except ValueError as e:
         # Audit log failed purchase
         audit_logger.warning(
@@ -80,3 +101,61 @@ async def purchase_tickets(
             error=str(e)
         )
         raise HTTPException(status_code=500, detail="Internal server error")
+
+
+@router.post("/checkout", response_model=TicketPurchaseResponse)
+@purchase_limiter.limit("10 per minute")
+async def checkout_cart(
+    request: Request,
+    cart: CartCheckout,
+    db = Depends(get_db),
+    current_user = Depends(get_current_active_user)
+):
+    """Buy tickets from several rifas with one payment."""
+    # Verify user
+    if str(cart.user_id) != str(current_user.id):
+        raise HTTPException(status_code=403, detail="Cannot purchase for other users")
+
+    items = [{"rifa_id": str(item.rifa_id), "quantity": item.quantity} for item in cart.items]
+
+    # Audit log the checkout attempt
+    audit_logger.info(
+        "checkout_attempt",
+        user_id=str(current_user.id),
+        items=items,
+        idempotency_key=cart.idempotency_key,
+        ip_address=request.client.host if request.client else None
+    )
+
+    try:
+        purchase_service = PurchaseService()
+        result = await purchase_service.checkout_cart(db, cart, str(current_user.id))
+
+        # Audit log successful checkout
+        audit_logger.info(
+            "checkout_success",
+            user_id=str(current_user.id),
+            items=items,
+            transaction_id=result.transaccion_id,
+            ticket_count=len(result.tickets)
+        )
+
+        return result
+    except ValueError as e:
+        # Audit log failed checkout
+        audit_logger.warning(
+            "checkout_failed",
+            user_id=str(current_user.id),
+            items=items,
+            error=str(e)
+        )
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        # Audit log system error
+        audit_logger.error(
+            "checkout_error",
+            user_id=str(current_user.id),
+            items=items,
+            error=str(e)
+        )
+        raise HTTPException(status_code=500, detail="Internal server error")
@@ -1,67 +1,65 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.api.v1.deps import get_db, get_current_admin_user
 from app.models.user import User
+from app.repositories.user_repository import UserRepository
 from app.schemas.user import UserOut, UserUpdate
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[UserOut])
-def read_users(
-    db: Session = Depends(get_db),
+async def read_users(
+    response: Response,
+    db: AsyncSession = Depends(get_db),
+    cursor: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
     current_user: User = Depends(get_current_admin_user)
 ):
-    users = db.query(User).offset(skip).limit(limit).all()
-    return users
+    try:
+        page = await UserRepository().get_page(db, cursor, limit, skip=skip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    return page.items
 
 
 @router.get("/{user_id}", response_model=UserOut)
-def read_user(
+async def read_user(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await UserRepository().get_by_id(db, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
 @router.put("/{user_id}", response_model=UserOut)
-def update_user(
+async def update_user(
     user_id: str,
     user_in: UserUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
+    repo = UserRepository()
+    user = await repo.get_by_id(db, user_id)
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
-
-    update_data = user_in.dict(exclude_unset=True)
-    for field, value in update_data.items():
-        setattr(user, field, value)
-
-    db.commit()
-    db.refresh(user)
-    return user
+    return await repo.update(db, user, user_in)
 
 
 @router.delete("/{user_id}")
-def delete_user(
+async def delete_user(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_admin_user)
 ):
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    if await UserRepository().delete(db, user_id) is None:
         raise HTTPException(status_code=404, detail="User not found")
-
-    db.delete(user)
-    db.commit()
     return {"message": "User deleted successfully"}
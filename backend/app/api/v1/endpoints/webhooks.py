@@ -4,7 +4,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from stripe import Event
 
 from app.core.config import settings
-from app.db.session import get_db
+from app.db.session import get_db, mark_recent_write
 from app.services.stripe_service import StripeService
 from app.repositories.transaccion_repository import TransaccionRepository
 
@@ -64,6 +64,8 @@ async def handle_payment_succeeded(payment_intent: dict, db: AsyncSession):
     if not transaction:
         # Log error - transaction not found
         pass
+    else:
+        await mark_recent_write(transaction.user_id)
 
 
 async def handle_payment_failed(payment_intent: dict, db: AsyncSession):
@@ -77,4 +79,6 @@ async def handle_payment_failed(payment_intent: dict, db: AsyncSession):
 
     if not transaction:
         # Log error - transaction not found
-        pass
\ No newline at end of file
+        pass
+    else:
+        await mark_recent_write(transaction.user_id)
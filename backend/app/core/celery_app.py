@@ -17,18 +17,47 @@ celery_app.conf.update(
     enable_utc=True,
     task_routes={
         "app.workers.tasks.close_rifa": {"queue": "rifa_operations"},
+        "app.workers.tasks.close_rifa_at": {"queue": "rifa_operations"},
+        "app.workers.tasks.close_expired_rifas": {"queue": "rifa_operations"},
+        "app.workers.tasks.summarize_rifa_closing": {"queue": "rifa_operations"},
         "app.workers.tasks.process_payouts": {"queue": "payments"},
         "app.workers.tasks.reconcile_loteria": {"queue": "loteria_sync"},
+        "app.workers.tasks.check_ticket_inventory": {"queue": "rifa_operations"},
+        "app.workers.tasks.release_expired_holds": {"queue": "rifa_operations"},
+        "app.workers.tasks.repair_rifa_counters": {"queue": "rifa_operations"},
+        "app.workers.tasks.materialize_rifa_tickets": {"queue": "rifa_operations"},
+        "app.workers.tasks.maintain_partitions": {"queue": "rifa_operations"},
     },
     beat_schedule={
+        # Safety nets: rifas are closed by close_rifa_at, scheduled at their fecha_fin
         "close-expired-rifas": {
-            "task": "app.workers.tasks.close_rifa",
-            "schedule": 3600.0,  # Every hour
+            "task": "app.workers.tasks.close_expired_rifas",
+            "schedule": 21600.0,  # Every 6 hours
             "args": (),
         },
         "reconcile-loteria-results": {
             "task": "app.workers.tasks.reconcile_loteria",
-            "schedule": 1800.0,  # Every 30 minutes
+            "schedule": 7200.0,  # Every 2 hours
+            "args": (),
+        },
+        "release-expired-holds": {
+            "task": "app.workers.tasks.release_expired_holds",
+            "schedule": 60.0,  # Every minute
+            "args": (),
+        },
+        "check-ticket-inventory": {
+            "task": "app.workers.tasks.check_ticket_inventory",
+            "schedule": 900.0,  # Every 15 minutes
+            "args": (),
+        },
+        "repair-rifa-counters": {
+            "task": "app.workers.tasks.repair_rifa_counters",
+            "schedule": 3600.0,  # Every hour
+            "args": (),
+        },
+        "maintain-partitions": {
+            "task": "app.workers.tasks.maintain_partitions",
+            "schedule": 86400.0,  # Daily
             "args": (),
         },
     },
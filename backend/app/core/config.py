@@ -1,4 +1,5 @@
 import os
+from typing import List, Literal
 from pydantic import BaseModel, validator
 
 
@@ -10,6 +11,19 @@ class Settings(BaseModel):
 
     # Database
     database_url: str
+    database_replica_urls: List[str] = []  # read-only requests are spread over these
+    read_your_writes_seconds: int = 5  # a user's reads stay on the primary this long after a purchase
+
+    # Connection pool, per engine and per worker process: size it so that
+    # workers x (db_pool_size + db_max_overflow) stays under Postgres max_connections
+    db_pool_size: int = 10
+    db_max_overflow: int = 10
+    db_pool_timeout_seconds: float = 5.0  # give up waiting for a free connection after this long
+    db_pool_recycle_seconds: int = 1800
+    db_statement_cache_size: int = 100  # prepared statements per connection; 0 behind PgBouncer transaction pooling
+    # Celery worker processes run one task at a time and get a small engine of their own
+    worker_db_pool_size: int = 2
+    worker_db_max_overflow: int = 2
 
     # JWT
     secret_key: str
@@ -20,18 +34,66 @@ class Settings(BaseModel):
     stripe_secret_key: str
     stripe_publishable_key: str
     stripe_webhook_secret: str
+    stripe_api_base: str = "https://api.stripe.com"
+    stripe_timeout_seconds: float = 10.0
+    stripe_connect_timeout_seconds: float = 3.0
+    stripe_max_retries: int = 2
+    stripe_max_connections: int = 100
+    stripe_max_concurrency: int = 50  # in-flight Stripe calls per worker
 
     # Redis
     redis_host: str = "localhost"
     redis_port: int = 6379
     redis_db: int = 0
 
+    # Ticket inventory (Redis-backed allocation of free ticket numbers)
+    ticket_inventory_enabled: bool = True
+    ticket_hold_ttl_seconds: int = 600  # how long reserved tickets wait for payment
+
+    # Rifas with more tickets than this are materialized by a background task
+    ticket_materialization_inline_limit: int = 200000
+
+    # Batched allocation: "off", "local" (one actor per rifa per worker) or "redis" (one leader per rifa cluster-wide)
+    allocation_mode: Literal["off", "local", "redis"] = "off"
+    allocation_max_batch: int = 50
+    allocation_leader_lease_ms: int = 5000
+    allocation_timeout_seconds: float = 10.0
+
+    # Idempotency of purchases
+    idempotency_ttl_seconds: int = 86400  # cached purchase responses
+    idempotency_lock_ttl_seconds: int = 60  # in-flight marker, must outlive a purchase
+    idempotency_wait_seconds: float = 30.0  # how long a duplicate waits for the first request
+
+    # Lottery results cache: published draws are kept for good, pending ones briefly
+    loteria_cache_local_size: int = 256  # draws kept in memory per process
+    loteria_pending_ttl_seconds: int = 300
+    loteria_fetch_lock_ttl_seconds: int = 30  # one process asks the provider per draw
+    loteria_fetch_wait_seconds: float = 10.0  # how long the others wait for its answer
+
+    # Rifas are closed by a task scheduled at their fecha_fin
+    rifa_closing_max_eta_seconds: int = 3000  # under the Redis broker visibility timeout (1h); later closings hop
+    rifa_closing_retry_delays_seconds: List[int] = [60, 300, 900, 1800, 3600]  # while lottery results are not out
+
+    # Lease serializing close/recalculate of a rifa; outlives the slowest closing
+    rifa_lock_ttl_seconds: int = 300
+
+    # Winners paid per batch (one query, one insert and one update each)
+    payout_batch_size: int = 1000
+
+    # Monthly transacciones partitions
+    transacciones_partitions_ahead_months: int = 3
+    transacciones_retention_months: int = 0  # detach months older than this; 0 keeps them all attached
+
     # Environment
     environment: str = "development"
 
     # Sentry
     sentry_dsn: str = ""
 
+    @property
+    def redis_url(self) -> str:
+        return f"redis://{self.redis_host}:{self.redis_port}/{self.redis_db}"
+
     # Celery
     @property
     def celery_broker_url(self) -> str:
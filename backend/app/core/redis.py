@@ -0,0 +1,14 @@
+from redis import asyncio as aioredis
+
+from app.core.config import settings
+
+redis_client = aioredis.from_url(settings.redis_url)
+
+
+def get_redis() -> aioredis.Redis:
+    """Shared asyncio Redis client (connection pool is created lazily)."""
+    return redis_client
+
+
+async def close_redis() -> None:
+    await redis_client.close()
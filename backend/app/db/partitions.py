@@ -0,0 +1,69 @@
+"""
+Declarative partitioning of the tables that grow without bound.
+
+tickets is hash-partitioned by rifa_id: every hot query filters on one rifa,
+so it is planned against a single partition and its small indexes.
+transacciones is range-partitioned by created_at, one partition per month
+plus a default one as a safety net. New months are created ahead of time by
+the `maintain_partitions` beat task, which can also detach months older than
+the retention period so they can be archived or dropped without touching
+live data (see PartitionMaintenanceService).
+"""
+from datetime import date, datetime
+from typing import List
+
+TICKET_PARTITIONS = 16
+TRANSACCIONES_DEFAULT_PARTITION = "transacciones_default"
+# Months created past the current one when the table is set up
+INITIAL_MONTHS_AHEAD = 3
+
+# Idempotency keys must be unique across every month, which a unique index on
+# the partitioned table cannot enforce (it would have to include created_at).
+# Each new transaction registers its key in the unpartitioned transaccion_claves
+CLAVE_TRIGGER_DDL = [
+    """
+    CREATE OR REPLACE FUNCTION registrar_clave_transaccion() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO transaccion_claves (idempotency_key, transaccion_id, created_at)
+        VALUES (NEW.idempotency_key, NEW.id, NEW.created_at);
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER trg_transacciones_clave AFTER INSERT ON transacciones
+    FOR EACH ROW EXECUTE FUNCTION registrar_clave_transaccion()
+    """,
+]
+
+
+def ticket_partitions_ddl(modulus: int = TICKET_PARTITIONS) -> List[str]:
+    return [
+        f"CREATE TABLE IF NOT EXISTS tickets_p{remainder:02d} PARTITION OF tickets "
+        f"FOR VALUES WITH (MODULUS {modulus}, REMAINDER {remainder})"
+        for remainder in range(modulus)
+    ]
+
+
+def month_start(moment: datetime) -> date:
+    return date(moment.year, moment.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def transacciones_partition_name(month: date) -> str:
+    return f"transacciones_{month:%Y_%m}"
+
+
+def transacciones_partition_ddl(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {transacciones_partition_name(month)} PARTITION OF transacciones "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def transacciones_default_partition_ddl() -> str:
+    return f"CREATE TABLE IF NOT EXISTS {TRANSACCIONES_DEFAULT_PARTITION} PARTITION OF transacciones DEFAULT"
@@ -0,0 +1,66 @@
+import time
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import event, exc
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+# Exported on the app's /metrics endpoint (default Prometheus registry)
+POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_seconds",
+    "Time a request waited to get a database connection from the pool",
+    ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    "db_pool_checkout_timeouts_total",
+    "Checkouts that gave up after pool_timeout with every connection in use",
+    ["pool"]
+)
+POOL_OVERFLOW_CONNECTIONS = Counter(
+    "db_pool_overflow_connections_total",
+    "Connections opened beyond pool_size",
+    ["pool"]
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Pooled database connections by state",
+    ["pool", "state"]
+)
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """Async queue pool that times every checkout, including the wait for a free connection."""
+
+    metrics_name = "primary"
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(pool=self.metrics_name).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_SECONDS.labels(pool=self.metrics_name).observe(time.perf_counter() - start)
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool: keep reporting under the same name
+        pool = super().recreate()
+        pool.metrics_name = self.metrics_name
+        return pool
+
+
+def instrument_engine(engine: AsyncEngine, name: str) -> None:
+    """Report the pool of `engine` as `name`: checkout latency, in-use/idle counts and overflow."""
+    engine.pool.metrics_name = name
+
+    # Read through the engine so the gauges follow the pool across dispose()
+    POOL_CONNECTIONS.labels(pool=name, state="in_use").set_function(lambda: engine.pool.checkedout())
+    POOL_CONNECTIONS.labels(pool=name, state="idle").set_function(lambda: engine.pool.checkedin())
+    POOL_CONNECTIONS.labels(pool=name, state="overflow").set_function(lambda: max(engine.pool.overflow(), 0))
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _count_overflow(dbapi_connection, connection_record):
+        if engine.pool.overflow() > 0:
+            POOL_OVERFLOW_CONNECTIONS.labels(pool=name).inc()
@@ -1,10 +1,96 @@
+import itertools
+from typing import Optional
+
+from redis.exceptions import RedisError
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
+from app.core.redis import get_redis
+from app.db.pool_metrics import InstrumentedQueuePool, instrument_engine
+
+
+def _async_url(url: str) -> str:
+    return url.replace("postgresql://", "postgresql+asyncpg://")
+
+
+def _create_engine(url: str, name: str, pool_size: Optional[int] = None, max_overflow: Optional[int] = None):
+    db_engine = create_async_engine(
+        _async_url(url),
+        poolclass=InstrumentedQueuePool,
+        pool_pre_ping=True,
+        pool_size=settings.db_pool_size if pool_size is None else pool_size,
+        max_overflow=settings.db_max_overflow if max_overflow is None else max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        connect_args={
+            # asyncpg's own cache and SQLAlchemy's cache of prepared statements per connection
+            "statement_cache_size": settings.db_statement_cache_size,
+            "prepared_statement_cache_size": settings.db_statement_cache_size,
+        }
+    )
+    instrument_engine(db_engine, name)
+    return db_engine
+
+
+def _sessionmaker(bind):
+    # expire_on_commit=False: purchases commit between phases and keep using the loaded rows
+    return sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=bind, class_=AsyncSession)
+
+
+engine = _create_engine(settings.database_url, "primary")
+AsyncSessionLocal = _sessionmaker(engine)
+
+# Read replicas, used round-robin by read-only requests. Without any, reads go to the primary
+replica_engines = [_create_engine(url, f"replica-{i}") for i, url in enumerate(settings.database_replica_urls)]
+_replica_sessions = itertools.cycle([_sessionmaker(replica) for replica in replica_engines] or [AsyncSessionLocal])
+
+
+def create_session_factory(name: str, pool_size: int, max_overflow: int):
+    """A primary engine of its own and its session factory, for processes other than the API."""
+    db_engine = _create_engine(settings.database_url, name, pool_size, max_overflow)
+    return db_engine, _sessionmaker(db_engine)
+
+
+def ReadSessionLocal() -> AsyncSession:
+    """Session on the next read replica (or the primary when none is configured)."""
+    return next(_replica_sessions)()
+
 
-engine = create_async_engine(settings.database_url.replace("postgresql://", "postgresql+asyncpg://"), pool_pre_ping=True)
-AsyncSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AsyncSession)
+def _recent_write_key(user_id: str) -> str:
+    return f"lecturas:primario:{user_id}"
+
+
+async def mark_recent_write(user_id: Optional[str]) -> None:
+    """Send the user's reads to the primary for a while, until replicas have caught up with their write."""
+    if user_id and replica_engines and settings.read_your_writes_seconds > 0:
+        try:
+            await get_redis().set(_recent_write_key(str(user_id)), 1, ex=settings.read_your_writes_seconds)
+        except RedisError:
+            pass  # has_recent_write falls back to the primary while Redis is down
+
+
+async def has_recent_write(user_id: Optional[str]) -> bool:
+    if not user_id or not replica_engines:
+        return False
+    try:
+        return bool(await get_redis().exists(_recent_write_key(str(user_id))))
+    except RedisError:
+        # Without the marker we cannot tell: the primary is always up to date
+        return True
+
+
+async def init_db() -> None:
+    # Fail at startup rather than on the first request if a database is unreachable
+    for db_engine in [engine, *replica_engines]:
+        async with db_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+
+async def close_db() -> None:
+    for db_engine in [engine, *replica_engines]:
+        await db_engine.dispose()
 
 
 async def get_db():
@@ -12,4 +98,14 @@ async def get_db():
         try:
             yield session
         finally:
-            await session.close()
\ No newline at end of file
+            await session.close()
+
+
+async def get_read_db(user_id: Optional[str] = None):
+    """Session for read-only work: a replica, unless `user_id` wrote something moments ago."""
+    session_factory = AsyncSessionLocal if await has_recent_write(user_id) else ReadSessionLocal
+    async with session_factory() as session:
+        try:
+            yield session
+        finally:
+            await session.close()
@@ -0,0 +1,136 @@
+import asyncio
+import json
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from .base import BaseLoteriaService
+from .mock_loteria_service import MockLoteriaService
+
+# Deletes the fetch lock only if this process still owns it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+POLL_INITIAL_SECONDS = 0.05
+POLL_MAX_SECONDS = 0.5
+
+# Cached in Redis for a draw that has not been published yet
+PENDING = "null"
+
+
+class CachedLoteriaService:
+    """
+    Lottery results of a BaseLoteriaService, cached in Redis with an
+    in-process LRU in front.
+
+    Every rifa on the same lottery and date shares one draw, and a published
+    draw never changes: results are cached permanently, in Redis for the
+    whole cluster and in memory for this process. A draw that is not out yet
+    is cached in Redis for `loteria_pending_ttl_seconds` only. On a miss, one
+    process fetches the draw under a Redis lock while the others wait for
+    its result, so the provider sees one request per (loteria, date).
+    Without Redis, results are fetched from the provider directly.
+    """
+
+    def __init__(self, loteria: BaseLoteriaService, redis=None, local_size: int = None):
+        self.loteria = loteria
+        self.redis = redis or get_redis()
+        self.local_size = settings.loteria_cache_local_size if local_size is None else local_size
+        self._local: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def results_key(self, date: str, loteria_id: str) -> str:
+        return f"loteria:{loteria_id}:{date}:resultados"
+
+    def lock_key(self, date: str, loteria_id: str) -> str:
+        return f"loteria:{loteria_id}:{date}:consultando"
+
+    def validate_loteria(self, loteria_id: str) -> bool:
+        return self.loteria.validate_loteria(loteria_id)
+
+    async def get_results(self, date: str, loteria_id: str) -> Optional[Dict[str, Any]]:
+        """Results of a draw, or None while it is not published."""
+        local = self._local.get((loteria_id, date))
+        if local is not None:
+            self._local.move_to_end((loteria_id, date))
+            return local
+
+        try:
+            found, results = await self._cached(date, loteria_id)
+            if not found:
+                found, results = await self._fetch_once(date, loteria_id)
+        except RedisError:
+            found, results = True, await self._fetch(date, loteria_id)
+
+        if not found:
+            # The fetching process failed or took too long: ask the provider ourselves
+            results = await self._fetch(date, loteria_id)
+        if results is not None:
+            self._remember(date, loteria_id, results)
+        return results
+
+    async def _cached(self, date: str, loteria_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        cached = await self.redis.get(self.results_key(date, loteria_id))
+        return (False, None) if cached is None else (True, json.loads(cached))
+
+    async def _fetch(self, date: str, loteria_id: str) -> Optional[Dict[str, Any]]:
+        # Providers are blocking clients
+        return await asyncio.to_thread(self.loteria.get_results, date, loteria_id)
+
+    async def _fetch_once(self, date: str, loteria_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        """Fetch the draw if no other process is fetching it, otherwise wait for theirs."""
+        token = str(uuid4())
+        lock_key = self.lock_key(date, loteria_id)
+        if not await self.redis.set(lock_key, token, nx=True, ex=settings.loteria_fetch_lock_ttl_seconds):
+            return await self._wait_for_results(date, loteria_id)
+
+        try:
+            results = await self._fetch(date, loteria_id)
+            if results is None:
+                await self.redis.set(self.results_key(date, loteria_id), PENDING, ex=settings.loteria_pending_ttl_seconds)
+            else:
+                await self.redis.set(self.results_key(date, loteria_id), json.dumps(results))
+            return True, results
+        finally:
+            await self._release(keys=[lock_key], args=[token])
+
+    async def _wait_for_results(self, date: str, loteria_id: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.loteria_fetch_wait_seconds
+        delay = POLL_INITIAL_SECONDS
+        while True:
+            found, results = await self._cached(date, loteria_id)
+            if found:
+                return found, results
+            if not await self.redis.exists(self.lock_key(date, loteria_id)):
+                # The results are written before the lock is dropped
+                return await self._cached(date, loteria_id)
+            if loop.time() >= deadline:
+                return False, None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_SECONDS)
+
+    def _remember(self, date: str, loteria_id: str, results: Dict[str, Any]) -> None:
+        self._local[(loteria_id, date)] = results
+        self._local.move_to_end((loteria_id, date))
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+
+_loteria_service: Optional[CachedLoteriaService] = None
+
+
+def get_loteria_service() -> CachedLoteriaService:
+    """Process-wide cached lottery service, so every caller shares its in-memory results."""
+    global _loteria_service
+    if _loteria_service is None:
+        _loteria_service = CachedLoteriaService(MockLoteriaService())
+    return _loteria_service
@@ -0,0 +1,155 @@
+import asyncio
+import random
+from typing import Dict, Any, Optional
+from uuid import uuid4
+
+import httpx
+
+from app.core.config import settings
+
+RETRYABLE_STATUS_CODES = {409, 429, 500, 502, 503, 504}
+BACKOFF_BASE_SECONDS = 0.25
+BACKOFF_MAX_SECONDS = 4.0
+
+
+class PaymentError(Exception):
+    """Error returned by the payment provider (declines, invalid requests, exhausted retries)."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, code: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+
+
+class PaymentUnreachableError(PaymentError):
+    """The provider could not be reached; a POST may still have taken effect."""
+
+
+def backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+
+def encode_params(params: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Flatten nested dicts into Stripe's form encoding (metadata[key]=value)."""
+    encoded = {}
+    for key, value in params.items():
+        name = f"{prefix}[{key}]" if prefix else key
+        if isinstance(value, dict):
+            encoded.update(encode_params(value, name))
+        elif isinstance(value, bool):
+            encoded[name] = "true" if value else "false"
+        elif value is not None:
+            encoded[name] = str(value)
+    return encoded
+
+
+class StripeClient:
+    """
+    Async Stripe client over a persistent httpx connection pool.
+
+    Every call has a timeout, is retried with jittered backoff on network
+    errors and retryable statuses, and waits on a per-worker semaphore so a
+    Stripe slowdown cannot pile up unbounded requests. POSTs always carry an
+    idempotency key, so retries never charge twice.
+    """
+
+    def __init__(
+        self,
+        api_key: str = None,
+        base_url: str = None,
+        timeout: float = None,
+        connect_timeout: float = None,
+        max_retries: int = None,
+        max_connections: int = None,
+        max_concurrency: int = None,
+        transport: httpx.AsyncBaseTransport = None,
+    ):
+        max_connections = max_connections or settings.stripe_max_connections
+        self.max_retries = settings.stripe_max_retries if max_retries is None else max_retries
+        self._semaphore = asyncio.Semaphore(max_concurrency or settings.stripe_max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=base_url or settings.stripe_api_base,
+            auth=(api_key or settings.stripe_secret_key, ""),
+            timeout=httpx.Timeout(
+                timeout or settings.stripe_timeout_seconds,
+                connect=connect_timeout or settings.stripe_connect_timeout_seconds,
+            ),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            transport=transport,
+        )
+
+    async def _request(self, method: str, path: str, params: Dict[str, Any] = None, idempotency_key: str = None) -> Dict[str, Any]:
+        headers = {}
+        if method == "POST":
+            headers["Idempotency-Key"] = idempotency_key or str(uuid4())
+        data = encode_params(params or {})
+
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                last_attempt = attempt == self.max_retries
+                try:
+                    if method == "GET":
+                        response = await self._client.get(path, params=data, headers=headers)
+                    else:
+                        response = await self._client.request(method, path, data=data, headers=headers)
+                except httpx.TransportError as e:
+                    if last_attempt:
+                        raise PaymentUnreachableError(f"Payment provider unreachable: {e!r}")
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+
+                should_retry = response.headers.get("Stripe-Should-Retry")
+                retryable = should_retry == "true" or (
+                    should_retry is None and response.status_code in RETRYABLE_STATUS_CODES
+                )
+                if retryable and not last_attempt:
+                    await asyncio.sleep(backoff_delay(attempt))
+                    continue
+
+                if response.status_code >= 400:
+                    try:
+                        error = response.json().get("error", {}) if response.content else {}
+                    except ValueError:
+                        # Not a Stripe error body, e.g. a proxy's HTML error page
+                        error = {}
+                    raise PaymentError(
+                        error.get("message", f"Payment provider returned {response.status_code}"),
+                        status_code=response.status_code,
+                        code=error.get("code"),
+                    )
+                return response.json()
+
+    async def create_payment_intent(self, amount: int, currency: str = "cop", metadata: Dict[str, Any] = None, idempotency_key: str = None) -> Dict[str, Any]:
+        params = {"amount": amount, "currency": currency, "metadata": metadata or {}}
+        return await self._request("POST", "/v1/payment_intents", params, idempotency_key)
+
+    async def confirm_payment_intent(self, payment_intent_id: str, idempotency_key: str = None) -> Dict[str, Any]:
+        return await self._request("POST", f"/v1/payment_intents/{payment_intent_id}/confirm", idempotency_key=idempotency_key)
+
+    async def retrieve_payment_intent(self, payment_intent_id: str) -> Dict[str, Any]:
+        return await self._request("GET", f"/v1/payment_intents/{payment_intent_id}")
+
+    async def create_refund(self, payment_intent_id: str, idempotency_key: str = None) -> Dict[str, Any]:
+        return await self._request("POST", "/v1/refunds", {"payment_intent": payment_intent_id}, idempotency_key)
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_client: Optional[StripeClient] = None
+
+
+def get_stripe_client() -> StripeClient:
+    """Per-process client so all requests share one connection pool."""
+    global _client
+    if _client is None:
+        _client = StripeClient()
+    return _client
+
+
+async def close_stripe_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -7,7 +7,10 @@ from app.api.v1.api import api_router
 from app.core.config import settings
 from app.core.logging import configure_structlog
 from app.core.rate_limiting import limiter
-from app.db.session import init_db, close_db
+from app.core.redis import close_redis
+from app.integrations.payments.stripe_client import close_stripe_client
+from app.db.session import init_db, close_db, AsyncSessionLocal
+from app.services.inventory_service import TicketInventoryService
 from slowapi.middleware import SlowAPIMiddleware
 
 # Configure structlog
@@ -53,12 +56,13 @@ async def health_check():
 @app.on_event("startup")
 async def startup():
     await init_db()       # conecta motor/async session pool
-    global redis_client
-    redis_client = aioredis.from_url(f"redis://{settings.redis_host}:{settings.redis_port}/{settings.redis_db}")
+    if settings.ticket_inventory_enabled:
+        # carga el inventario de boletas libres de las rifas activas en Redis
+        async with AsyncSessionLocal() as db:
+            await TicketInventoryService().rebuild_active(db)
 
 @app.on_event("shutdown")
 async def shutdown():
     await close_db()
-    global redis_client
-    if redis_client:
-        await redis_client.close()
+    await close_redis()
+    await close_stripe_client()
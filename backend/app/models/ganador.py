@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, DateTime, String, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, String, ForeignKeyConstraint, Index
 from sqlalchemy.sql import text
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -7,8 +7,15 @@ from .base import Base
 
 class Ganador(Base):
     __tablename__ = "ganadores"
+    __table_args__ = (
+        Index("uq_ganadores_ticket_id", "ticket_id", unique=True),
+        Index("ix_ganadores_rifa_id", "rifa_id"),
+        # tickets is partitioned by rifa_id, so its key (and any reference to it) includes it
+        ForeignKeyConstraint(["ticket_id", "rifa_id"], ["tickets.id", "tickets.rifa_id"]),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
-    ticket_id = Column(UUID(as_uuid=True), ForeignKey("tickets.id"), nullable=False)
+    ticket_id = Column(UUID(as_uuid=True), nullable=False)
+    rifa_id = Column(UUID(as_uuid=True), nullable=False)
     monto_ganado = Column(Integer, nullable=False)
     fecha_pago = Column(DateTime(timezone=True), nullable=True)
-    referencia_pago = Column(String(255))
\ No newline at end of file
+    referencia_pago = Column(String(255))
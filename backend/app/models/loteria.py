@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Text
+from sqlalchemy import Column, String, Text, Index
 from sqlalchemy.sql import text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 
@@ -7,6 +7,10 @@ from .base import Base
 
 class Loteria(Base):
     __tablename__ = "loterias"
+    __table_args__ = (
+        # Keyset pagination of the loteria list
+        Index("ix_loterias_nombre_id", "nombre", "id"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     nombre = Column(String, nullable=False)
     descripcion = Column(Text)
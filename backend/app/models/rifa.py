@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Integer, Enum, ForeignKey
+from sqlalchemy import Column, String, DateTime, Integer, BigInteger, Enum, ForeignKey, Index
 from sqlalchemy.sql import func, text
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 
@@ -7,6 +7,10 @@ from .base import Base
 
 class Rifa(Base):
     __tablename__ = "rifas"
+    __table_args__ = (
+        # Keyset pagination of the rifa list
+        Index("ix_rifas_creado_en_id", "creado_en", "id"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     nombre = Column(String(255), nullable=False)
     categoria_id = Column(UUID(as_uuid=True), ForeignKey("categoria_rifa.id"))
@@ -17,4 +21,9 @@ class Rifa(Base):
     estado = Column(Enum("pendiente", "activa", "cerrada", "cancelada", name="rifa_states"), default="pendiente")
     reglas = Column(JSONB, default={})  # reglas paramétricas: ganar_dos_primeros, reparto, ...
     total_boletas = Column(Integer, default=100)
+    # "filas": one ticket row per number, created up front. "compacto": rows only
+    # for numbers taken (reserved, sold, ...); any number without a row is free
+    almacenamiento = Column(Enum("filas", "compacto", name="ticket_storage_modes"), nullable=False, server_default="filas", default="filas")
+    # Fencing token of the latest close/recalculate lock holder (see RifaLock)
+    cierre_fencing = Column(BigInteger)
     creado_en = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
@@ -0,0 +1,16 @@
+from sqlalchemy import Column, Integer, BigInteger, DateTime, ForeignKey
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import UUID
+
+from .base import Base
+
+
+class RifaCounter(Base):
+    __tablename__ = "rifa_counters"
+    rifa_id = Column(UUID(as_uuid=True), ForeignKey("rifas.id", ondelete="CASCADE"), primary_key=True)
+    disponibles = Column(Integer, nullable=False, default=0, server_default="0")
+    reservadas = Column(Integer, nullable=False, default=0, server_default="0")
+    vendidas = Column(Integer, nullable=False, default=0, server_default="0")
+    ganadores = Column(Integer, nullable=False, default=0, server_default="0")
+    recaudo_bruto = Column(BigInteger, nullable=False, default=0, server_default="0")  # suma de precios vendidos, en COP
+    actualizado_en = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -1,17 +1,37 @@
-from sqlalchemy import Column, Integer, DateTime, Enum, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, Enum, ForeignKey, Index, UniqueConstraint, event
 from sqlalchemy.sql import text
 from sqlalchemy.dialects.postgresql import UUID
 
+from app.db.partitions import ticket_partitions_ddl
 from .base import Base
 
 
 class Ticket(Base):
     __tablename__ = "tickets"
+    __table_args__ = (
+        UniqueConstraint("rifa_id", "numero", name="uq_tickets_rifa_numero"),
+        Index("ix_tickets_rifa_disponible", "rifa_id", "numero", postgresql_where=text("estado = 'disponible'")),
+        Index("ix_tickets_reservado_hasta", "reservado_hasta", postgresql_where=text("estado = 'reservado'")),
+        # Keyset pagination of a user's tickets
+        Index("ix_tickets_usuario_numero_id", "usuario_id", "numero", "id"),
+        {"postgresql_partition_by": "HASH (rifa_id)"},
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
-    rifa_id = Column(UUID(as_uuid=True), ForeignKey("rifas.id"), nullable=False)
-    usuario_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True)
+    # In the table's primary key because it is the partition key; the ORM still identifies tickets by id
+    rifa_id = Column(UUID(as_uuid=True), ForeignKey("rifas.id"), primary_key=True)
+    usuario_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=True, index=True)
     numero = Column(Integer, nullable=False)
     comprado_en = Column(DateTime(timezone=True))
-    estado = Column(Enum("disponible", "vendido", "ganador", "anulado", name="ticket_states"), default="disponible")
+    estado = Column(Enum("disponible", "reservado", "vendido", "ganador", "anulado", name="ticket_states"), default="disponible")
     precio = Column(Integer)
-    transaccion_id = Column(UUID(as_uuid=True), nullable=True)
\ No newline at end of file
+    transaccion_id = Column(UUID(as_uuid=True), nullable=True, index=True)
+    reservado_hasta = Column(DateTime(timezone=True), nullable=True)  # fin del hold mientras se procesa el pago
+
+    __mapper_args__ = {"primary_key": [id]}
+
+
+@event.listens_for(Ticket.__table__, "after_create")
+def _create_ticket_partitions(target, connection, **kw):
+    if connection.dialect.name == "postgresql":
+        for ddl in ticket_partitions_ddl():
+            connection.execute(text(ddl))
@@ -1,18 +1,53 @@
-from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Enum, DateTime, ForeignKey, event
 from sqlalchemy.sql import func, text
 from sqlalchemy.dialects.postgresql import UUID
 
+from app.db.partitions import (
+    CLAVE_TRIGGER_DDL, INITIAL_MONTHS_AHEAD, add_months, month_start, transacciones_default_partition_ddl, transacciones_partition_ddl
+)
 from .base import Base
 
 
 class Transaccion(Base):
     __tablename__ = "transacciones"
+    __table_args__ = (
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
-    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
+    user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), nullable=False, index=True)
     amount = Column(Integer, nullable=False)
     currency = Column(String(8), default="COP")
     provider = Column(String(50))  # stripe, sandbox...
-    provider_ref = Column(String(255))
-    idempotency_key = Column(String(255), unique=True, nullable=False)
+    provider_ref = Column(String(255), index=True)
+    # Unique through transaccion_claves: a unique index here would have to include created_at
+    idempotency_key = Column(String(255), nullable=False, index=True)
     status = Column(Enum("pending", "succeeded", "failed", "refunded", name="trans_status"), default="pending")
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    # Partition key, hence part of the table's primary key; the ORM still identifies transactions by id
+    created_at = Column(DateTime(timezone=True), primary_key=True, server_default=func.now())
+
+    __mapper_args__ = {"primary_key": [id]}
+
+
+class TransaccionClave(Base):
+    """Idempotency key of every transaction, filled by a trigger on transacciones."""
+    __tablename__ = "transaccion_claves"
+    idempotency_key = Column(String(255), primary_key=True)
+    transaccion_id = Column(UUID(as_uuid=True), nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+
+
+# The trigger on transacciones writes to transaccion_claves: have create_all make it last
+TransaccionClave.__table__.add_is_dependent_on(Transaccion.__table__)
+
+
+@event.listens_for(TransaccionClave.__table__, "after_create")
+def _create_transacciones_partitions(target, connection, **kw):
+    if connection.dialect.name == "postgresql":
+        current = month_start(datetime.utcnow())
+        connection.execute(text(transacciones_default_partition_ddl()))
+        for offset in range(INITIAL_MONTHS_AHEAD + 1):
+            connection.execute(text(transacciones_partition_ddl(add_months(current, offset))))
+        for ddl in CLAVE_TRIGGER_DDL:
+            connection.execute(text(ddl))
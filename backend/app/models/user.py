@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, DateTime, Boolean, Enum
+from sqlalchemy import Column, String, DateTime, Boolean, Enum, Index
 from sqlalchemy.sql import func, text
 from sqlalchemy.dialects.postgresql import UUID
 
@@ -7,6 +7,10 @@ from .base import Base
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Keyset pagination of the user list
+        Index("ix_users_creado_en_id", "creado_en", "id"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, server_default=text("gen_random_uuid()"))
     nombre = Column(String(120), nullable=False)
     email = Column(String(255), unique=True, nullable=False, index=True)
@@ -1,11 +1,88 @@
-from typing import Generic, TypeVar, List, Optional
+import base64
+import json
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Generic, TypeVar, List, Optional, Sequence, Any
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 
 T = TypeVar('T')
 
 
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Opaque cursor for the sort key of the last row of a page."""
+    payload = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    raw = json.dumps(payload, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> List[Any]:
+    """Sort key values of a cursor, converted back to the Python types of `columns`."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        decoded = []
+        for value, column in zip(values, columns):
+            python_type = column.type.python_type
+            if python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is uuid.UUID:
+                value = uuid.UUID(value)
+            elif not isinstance(value, python_type):
+                raise ValueError
+            decoded.append(value)
+        return decoded
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("Invalid cursor")
+
+
+@dataclass
+class Page(Generic[T]):
+    items: List[T] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+
+async def paginate(
+    db: AsyncSession,
+    query,
+    order_by: Sequence,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    skip: int = 0,
+    scalars: bool = True
+) -> Page:
+    """
+    Keyset pagination: rows are sorted by `order_by` (which must end in a
+    unique column, and should match an index) and a page starts right after
+    the cursor's key, so every page costs the same as the first one and rows
+    inserted meanwhile do not shift later pages. `skip` is only honoured
+    without a cursor, for clients still paging with offsets.
+
+    With `scalars=False` the query returns tuples whose first element is the
+    entity the sort key is read from.
+    """
+    if cursor:
+        query = query.where(tuple_(*order_by) > tuple_(*decode_cursor(cursor, order_by)))
+    elif skip:
+        query = query.offset(skip)
+    # One extra row tells whether there is a next page
+    result = await db.execute(query.order_by(*order_by).limit(limit + 1))
+    rows = result.scalars().all() if scalars else result.all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1] if scalars else rows[-1][0]
+        next_cursor = encode_cursor([getattr(last, column.key) for column in order_by])
+    return Page(items=list(rows), next_cursor=next_cursor)
+
+
 class BaseRepository(Generic[T]):
+    # Sort key of get_page; should end in a unique column and match an index
+    page_order: Optional[Sequence] = None
+
     def __init__(self, model: T):
         self.model = model
 
@@ -14,9 +91,21 @@ class BaseRepository(Generic[T]):
         return result.scalar_one_or_none()
 
     async def get_all(self, db: AsyncSession, skip: int = 0, limit: int = 100) -> List[T]:
-        result = await db.execute(select(self.model).offset(skip).limit(limit))
+        result = await db.execute(select(self.model).order_by(self.model.id).offset(skip).limit(limit))
         return result.scalars().all()
 
+    async def get_page(
+        self,
+        db: AsyncSession,
+        cursor: Optional[str] = None,
+        limit: int = 100,
+        order_by: Sequence = None,
+        skip: int = 0
+    ) -> Page[T]:
+        """A page of rows sorted by `order_by`, `page_order` or id, see `paginate`."""
+        order_by = order_by or self.page_order or [self.model.id]
+        return await paginate(db, select(self.model), order_by, cursor, limit, skip)
+
     async def create(self, db: AsyncSession, obj_in) -> T:
         db_obj = self.model(**obj_in.dict())
         db.add(db_obj)
@@ -31,9 +120,10 @@ class BaseRepository(Generic[T]):
         await db.refresh(db_obj)
         return db_obj
 
-    async def delete(self, db: AsyncSession, id: str) -> None:
+    async def delete(self, db: AsyncSession, id: str) -> Optional[T]:
         result = await db.execute(select(self.model).where(self.model.id == id))
         obj = result.scalar_one_or_none()
         if obj:
             await db.delete(obj)
-            await db.commit()
\ No newline at end of file
+            await db.commit()
+        return obj
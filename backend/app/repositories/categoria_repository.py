@@ -0,0 +1,10 @@
+from app.models.categoria import Categoria
+from app.repositories.base import BaseRepository
+
+
+class CategoriaRepository(BaseRepository[Categoria]):
+    # nombre is unique, so it is a complete keyset on its own
+    page_order = [Categoria.nombre]
+
+    def __init__(self):
+        super().__init__(Categoria)
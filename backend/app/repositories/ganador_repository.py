@@ -0,0 +1,64 @@
+from typing import List, Iterable, Dict, Any, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, delete, and_, Row
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.ganador import Ganador
+from app.models.ticket import Ticket
+from app.models.transaccion import Transaccion
+from app.repositories.base import BaseRepository
+
+
+class GanadorRepository(BaseRepository[Ganador]):
+    def __init__(self):
+        super().__init__(Ganador)
+
+    def add_winners(self, db: AsyncSession, tickets: Iterable[Ticket], monto_ganado: int) -> List[Ganador]:
+        """Stage one winner record per ticket. The caller commits."""
+        ganadores = [Ganador(ticket_id=ticket.id, rifa_id=ticket.rifa_id, monto_ganado=monto_ganado) for ticket in tickets]
+        db.add_all(ganadores)
+        return ganadores
+
+    async def insert_winners(self, db: AsyncSession, rows: List[Dict[str, Any]]) -> int:
+        """
+        Insert winner records (ticket_id, rifa_id, monto_ganado) with one
+        statement. Tickets that already have one are skipped, so closing can
+        be retried. Returns how many were created; the caller commits.
+        """
+        if not rows:
+            return 0
+        query = insert(Ganador).values(rows).on_conflict_do_nothing(index_elements=["ticket_id"])
+        result = await db.execute(query)
+        return result.rowcount
+
+    async def get_unpaid_batch(
+        self, db: AsyncSession, limit: int, after_id: Optional[str] = None, rifa_id: Optional[str] = None
+    ) -> List[Row]:
+        """
+        Next unpaid winners in id order, with the user to pay: (id, monto_ganado,
+        usuario_id) rows. Winners whose ticket has no buyer or purchase
+        transaction are left out. The rows stay locked until the caller
+        commits, and concurrent runs skip them.
+        """
+        query = select(Ganador.id, Ganador.monto_ganado, Ticket.usuario_id).join(
+            Ticket, and_(Ticket.id == Ganador.ticket_id, Ticket.rifa_id == Ganador.rifa_id)
+        ).join(
+            Transaccion, Transaccion.id == Ticket.transaccion_id
+        ).where(
+            and_(Ganador.fecha_pago.is_(None), Ticket.usuario_id.isnot(None))
+        ).order_by(Ganador.id).limit(limit).with_for_update(of=Ganador, skip_locked=True)
+        if after_id is not None:
+            query = query.where(Ganador.id > after_id)
+        if rifa_id is not None:
+            query = query.where(Ganador.rifa_id == rifa_id)
+        result = await db.execute(query)
+        return result.all()
+
+    async def mark_paid(self, db: AsyncSession, payments: List[Dict[str, Any]]) -> None:
+        """Stamp fecha_pago and referencia_pago; one executemany UPDATE by id. The caller commits."""
+        if payments:
+            await db.execute(update(Ganador), payments)
+
+    async def delete_by_rifa(self, db: AsyncSession, rifa_id: str) -> None:
+        """Delete the winner records of a rifa. The caller commits."""
+        await db.execute(delete(Ganador).where(Ganador.rifa_id == rifa_id))
@@ -0,0 +1,10 @@
+from app.models.loteria import Loteria
+from app.repositories.base import BaseRepository
+
+
+class LoteriaRepository(BaseRepository[Loteria]):
+    # Keyset of the loteria list, backed by ix_loterias_nombre_id
+    page_order = [Loteria.nombre, Loteria.id]
+
+    def __init__(self):
+        super().__init__(Loteria)
@@ -0,0 +1,135 @@
+from collections import defaultdict
+from typing import List, Optional, Dict, Iterable, Any
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, literal_column, case
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models.rifa import Rifa
+from app.models.rifa_counter import RifaCounter
+from app.models.ticket import Ticket
+from app.repositories.base import BaseRepository
+
+# Counter column of each ticket state ("anulado" tickets are not counted)
+STATE_COLUMNS = {
+    "disponible": "disponibles",
+    "reservado": "reservadas",
+    "vendido": "vendidas",
+    "ganador": "ganadores",
+}
+# States whose ticket price counts as gross revenue
+REVENUE_STATES = {"vendido", "ganador"}
+COUNTER_COLUMNS = list(STATE_COLUMNS.values()) + ["recaudo_bruto"]
+
+
+def transition_deltas(tickets: Iterable, from_estado: str, to_estado: str) -> Dict[str, Dict[str, int]]:
+    """Per-rifa counter deltas for moving `tickets` (with rifa_id and precio) between two states."""
+    deltas: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    revenue_sign = (to_estado in REVENUE_STATES) - (from_estado in REVENUE_STATES)
+    for ticket in tickets:
+        rifa_deltas = deltas[str(ticket.rifa_id)]
+        if from_estado in STATE_COLUMNS:
+            rifa_deltas[STATE_COLUMNS[from_estado]] -= 1
+        if to_estado in STATE_COLUMNS:
+            rifa_deltas[STATE_COLUMNS[to_estado]] += 1
+        if revenue_sign:
+            rifa_deltas["recaudo_bruto"] += revenue_sign * (getattr(ticket, "precio", None) or 0)
+    return deltas
+
+
+def increment_statement(rifa_id: str, deltas: Dict[str, int]):
+    """Upsert adding `deltas` to the counters of a rifa (usable from sync and async sessions)."""
+    stmt = insert(RifaCounter).values(rifa_id=rifa_id, **deltas)
+    return stmt.on_conflict_do_update(
+        index_elements=[RifaCounter.rifa_id],
+        set_={
+            **{column: RifaCounter.__table__.c[column] + stmt.excluded[column] for column in deltas},
+            "actualizado_en": func.now()
+        }
+    )
+
+
+def recompute_statement(rifa_ids: List[str]):
+    """Upsert recomputing the counters of the given rifas from the tickets table."""
+    def count_in(*estados):
+        return func.count(Ticket.id).filter(Ticket.estado.in_(estados))
+
+    # Compact rifas have no rows for free numbers: every number without a taken row is free
+    disponibles = case(
+        (Rifa.almacenamiento == "compacto", func.coalesce(Rifa.total_boletas, 0) - func.count(Ticket.id).filter(Ticket.estado != "disponible")),
+        else_=count_in("disponible")
+    )
+    source = select(
+        Rifa.id,
+        disponibles,
+        count_in("reservado"),
+        count_in("vendido"),
+        count_in("ganador"),
+        func.coalesce(func.sum(Ticket.precio).filter(Ticket.estado.in_(REVENUE_STATES)), 0),
+        func.now()
+    ).select_from(Rifa).outerjoin(Ticket, Ticket.rifa_id == Rifa.id).where(
+        Rifa.id.in_(rifa_ids)
+    ).group_by(Rifa.id)
+
+    stmt = insert(RifaCounter).from_select(["rifa_id"] + COUNTER_COLUMNS + ["actualizado_en"], source)
+    return stmt.on_conflict_do_update(
+        index_elements=[RifaCounter.rifa_id],
+        set_={column: stmt.excluded[column] for column in COUNTER_COLUMNS + ["actualizado_en"]}
+    )
+
+
+def lock_statement(rifa_ids: List[str]):
+    """Row locks on the counters so deltas committed meanwhile are not overwritten by a recompute."""
+    return select(literal_column("1")).select_from(RifaCounter).where(
+        RifaCounter.rifa_id.in_(rifa_ids)
+    ).order_by(RifaCounter.rifa_id).with_for_update()
+
+
+class RifaCounterRepository(BaseRepository[RifaCounter]):
+    """
+    Per-rifa ticket counts and gross revenue, kept up to date in the same
+    transaction as every ticket state change so reads are O(1). Deltas are
+    applied last, right before the caller commits, to keep the counter row
+    lock short; rifas are always locked in id order.
+    """
+
+    def __init__(self):
+        super().__init__(RifaCounter)
+
+    async def get_by_rifa(self, db: AsyncSession, rifa_id: str) -> Optional[RifaCounter]:
+        result = await db.execute(select(RifaCounter).where(RifaCounter.rifa_id == rifa_id))
+        return result.scalar_one_or_none()
+
+    async def apply_deltas(self, db: AsyncSession, rifa_id: str, deltas: Dict[str, int]) -> None:
+        deltas = {column: delta for column, delta in deltas.items() if delta}
+        if deltas:
+            await db.execute(increment_statement(rifa_id, deltas))
+
+    async def apply_transition(self, db: AsyncSession, tickets: Iterable, from_estado: str, to_estado: str) -> None:
+        """Record that `tickets` moved from one state to another. The caller commits."""
+        deltas = transition_deltas(tickets, from_estado, to_estado)
+        for rifa_id in sorted(deltas):
+            await self.apply_deltas(db, rifa_id, deltas[rifa_id])
+
+    async def _values(self, db: AsyncSession, rifa_id: str) -> Dict[str, int]:
+        columns = [RifaCounter.__table__.c[column] for column in COUNTER_COLUMNS]
+        row = (await db.execute(select(*columns).where(RifaCounter.rifa_id == rifa_id))).first()
+        return dict(zip(COUNTER_COLUMNS, row or [0] * len(COUNTER_COLUMNS)))
+
+    async def recompute(self, db: AsyncSession, rifa_id: str) -> Dict[str, int]:
+        """Recompute the counters of a rifa from scratch and return the drift corrected. The caller commits."""
+        await db.execute(lock_statement([rifa_id]))
+        before = await self._values(db, rifa_id)
+        await db.execute(recompute_statement([rifa_id]))
+        after = await self._values(db, rifa_id)
+        return {column: after[column] - before[column] for column in COUNTER_COLUMNS if after[column] != before[column]}
+
+    async def repair_all(self, db: AsyncSession) -> List[Dict[str, Any]]:
+        """Recompute every rifa, one short transaction each, and report the ones that had drifted."""
+        rifa_ids = [str(rifa_id) for rifa_id in (await db.execute(select(Rifa.id))).scalars().all()]
+        drifted = []
+        for rifa_id in rifa_ids:
+            drift = await self.recompute(db, rifa_id)
+            await db.commit()
+            if drift:
+                drifted.append({"rifa_id": rifa_id, "drift": drift})
+        return drifted
@@ -1,16 +1,34 @@
-from typing import Optional
+from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
+from sqlalchemy import select, update, or_
 
 from app.models.rifa import Rifa
-from app.models.ticket import Ticket
-from app.repositories.base import BaseRepository
+from app.models.rifa_counter import RifaCounter
+from app.repositories.base import BaseRepository, Page, paginate
+
+# Keyset of the rifa list, backed by ix_rifas_creado_en_id
+RIFA_LIST_ORDER = [Rifa.creado_en, Rifa.id]
 
 
 class RifaRepository(BaseRepository[Rifa]):
     def __init__(self):
         super().__init__(Rifa)
 
+    async def fence_closing(self, db: AsyncSession, rifa_id: str, fencing_token: int) -> bool:
+        """
+        Record `fencing_token` as the rifa's latest closing lock holder, unless
+        a newer one is recorded already. The rifa row stays locked until the
+        caller commits, so a holder whose lease expired cannot write after the
+        next one. Returns False when the token is stale.
+        """
+        result = await db.execute(
+            update(Rifa).where(
+                Rifa.id == rifa_id,
+                or_(Rifa.cierre_fencing.is_(None), Rifa.cierre_fencing < fencing_token)
+            ).values(cierre_fencing=fencing_token).execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
     async def get_active_rifa(self, db: AsyncSession, rifa_id: str) -> Optional[Rifa]:
         query = select(Rifa).where(
             Rifa.id == rifa_id,
@@ -19,16 +37,34 @@ class RifaRepository(BaseRepository[Rifa]):
         result = await db.execute(query)
         return result.scalar_one_or_none()
 
+    async def get_active_rifas(self, db: AsyncSession, rifa_ids: List[str]) -> List[Rifa]:
+        query = select(Rifa).where(
+            Rifa.id.in_(rifa_ids),
+            Rifa.estado == "activa"
+        )
+        result = await db.execute(query)
+        return result.scalars().all()
+
     async def get_rifa_with_tickets_count(self, db: AsyncSession, rifa_id: str) -> Optional[Rifa]:
-        rifa_query = select(Rifa).where(Rifa.id == rifa_id)
-        rifa_result = await db.execute(rifa_query)
-        rifa = rifa_result.scalar_one_or_none()
-        if rifa:
-            count_query = select(func.count(Ticket.id)).where(
-                Ticket.rifa_id == rifa_id,
-                Ticket.estado == "disponible"
-            )
-            count_result = await db.execute(count_query)
-            available_count = count_result.scalar()
-            rifa.available_tickets = available_count
-        return rifa
\ No newline at end of file
+        # Counts come from rifa_counters (one row) instead of scanning tickets
+        query = select(Rifa, RifaCounter).outerjoin(RifaCounter, RifaCounter.rifa_id == Rifa.id).where(Rifa.id == rifa_id)
+        row = (await db.execute(query)).first()
+        if row is None:
+            return None
+        rifa, counter = row
+        rifa.available_tickets = counter.disponibles if counter else 0
+        rifa.contadores = counter
+        return rifa
+
+    async def get_rifas_with_counters(
+        self, db: AsyncSession, cursor: Optional[str] = None, limit: int = 100, skip: int = 0
+    ) -> Page[Rifa]:
+        """A page of rifas, oldest first, each with its counters in `contadores`."""
+        query = select(Rifa, RifaCounter).outerjoin(RifaCounter, RifaCounter.rifa_id == Rifa.id)
+        page = await paginate(db, query, RIFA_LIST_ORDER, cursor, limit, skip, scalars=False)
+        rifas = []
+        for rifa, counter in page.items:
+            rifa.contadores = counter
+            rifas.append(rifa)
+        page.items = rifas
+        return page
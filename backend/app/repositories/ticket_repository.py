@@ -1,16 +1,95 @@
-from typing import List, Optional
+from datetime import datetime
+from typing import List, Optional, Sequence
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc, update
+from sqlalchemy import select, and_, desc, update, delete, Row, Integer, func, literal, cast
+from sqlalchemy.dialects.postgresql import insert, array
 
+from app.models.categoria import Categoria
+from app.models.rifa import Rifa
 from app.models.ticket import Ticket
-from app.repositories.base import BaseRepository
+from app.repositories.base import BaseRepository, Page, paginate
+from app.repositories.rifa_counter_repository import RifaCounterRepository, STATE_COLUMNS, REVENUE_STATES
+
+
+HOLD_RELEASE_VALUES = {
+    "estado": "disponible",
+    "usuario_id": None,
+    "transaccion_id": None,
+    "reservado_hasta": None,
+}
+# Rounds of "pick free numbers, insert them" when concurrent buyers keep taking the same ones
+COMPACT_CLAIM_ATTEMPTS = 5
+
+# Rifas whose free numbers have no rows: releasing a hold deletes its row
+COMPACT_RIFAS = select(Rifa.id).where(Rifa.almacenamiento == "compacto")
+
+
+class TicketsTakenError(ValueError):
+    """Numbers of a compact rifa read as free were inserted by another purchase first."""
+
+
+def _typed(column: str, value):
+    """Literal bound with the column's type, as INSERT ... SELECT needs for enums and UUIDs."""
+    column_type = Ticket.__table__.c[column].type
+    return cast(literal(value, column_type), column_type)
+
+
+def free_numbers(rifa_id: str, first: int, last: int, step: int = 1):
+    """
+    Numbers of a compact rifa from `first` to `last` (downwards with step -1)
+    without a ticket row, in that order. generate_series runs in the select
+    list so it streams: a LIMIT on the result stops it early, and each number
+    costs one probe of uq_tickets_rifa_numero.
+    """
+    serie = select(func.generate_series(first, last, step).label("numero")).subquery("serie")
+    taken = select(Ticket.id).where(Ticket.rifa_id == rifa_id, Ticket.numero == serie.c.numero)
+    return select(serie.c.numero).where(~taken.exists())
 
 
 class TicketRepository(BaseRepository[Ticket]):
+    """
+    Tickets of both storage modes behind one interface. A "filas" rifa has a
+    row per number and taking one is an UPDATE of its row; a "compacto" rifa
+    only has rows for numbers that are held or sold, so taking one is an
+    INSERT (uq_tickets_rifa_numero stops two buyers getting it) and freeing
+    it a DELETE. Free tickets of a compact rifa come back as transient
+    Ticket objects without an id.
+    """
+
     def __init__(self):
         super().__init__(Ticket)
 
+    async def _compact_rifa(self, db: AsyncSession, rifa_id: str) -> Optional[Row]:
+        """(total_boletas, valor_boleta) of a compact rifa; None when it has a row per number."""
+        query = select(func.coalesce(Rifa.total_boletas, 0), Categoria.valor_boleta).select_from(Rifa).outerjoin(
+            Categoria, Categoria.id == Rifa.categoria_id
+        ).where(and_(Rifa.id == rifa_id, Rifa.almacenamiento == "compacto"))
+        return (await db.execute(query)).first()
+
+    async def get_available_numbers(self, db: AsyncSession, rifa_id: str, limit: Optional[int] = None) -> List[int]:
+        """Free numbers of a rifa, lowest first."""
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is not None:
+            query = free_numbers(rifa_id, 1, compact[0])
+        else:
+            query = select(Ticket.numero).where(
+                and_(Ticket.rifa_id == rifa_id, Ticket.estado == "disponible")
+            ).order_by(Ticket.numero)
+
+        if limit:
+            query = query.limit(limit)
+
+        result = await db.execute(query)
+        return list(result.scalars().all())
+
+    def _free_tickets(self, rifa_id: str, compact: Row, numeros: List[int]) -> List[Ticket]:
+        return [Ticket(rifa_id=rifa_id, numero=numero, estado="disponible", precio=compact[1]) for numero in numeros]
+
     async def get_available_tickets(self, db: AsyncSession, rifa_id: str, limit: Optional[int] = None) -> List[Ticket]:
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is not None:
+            return self._free_tickets(rifa_id, compact, await self.get_available_numbers(db, rifa_id, limit))
+
         query = select(Ticket).where(
             and_(Ticket.rifa_id == rifa_id, Ticket.estado == "disponible")
         ).order_by(Ticket.numero)
@@ -21,10 +100,16 @@ class TicketRepository(BaseRepository[Ticket]):
         result = await db.execute(query)
         return result.scalars().all()
 
-    async def get_available_tickets_with_lock(self, db: AsyncSession, rifa_id: str, limit: Optional[int] = None) -> List[Ticket]:
+    async def get_available_tickets_with_lock(self, db: AsyncSession, rifa_id: str, limit: Optional[int] = None, skip_locked: bool = False) -> List[Ticket]:
+        # Free numbers of a compact rifa have no row to lock: the INSERT that takes them is what conflicts
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is not None:
+            return self._free_tickets(rifa_id, compact, await self.get_available_numbers(db, rifa_id, limit))
+
+        # With skip_locked, concurrent buyers get disjoint rows instead of queueing on the same ones
         query = select(Ticket).where(
             and_(Ticket.rifa_id == rifa_id, Ticket.estado == "disponible")
-        ).order_by(Ticket.numero).with_for_update()
+        ).order_by(Ticket.numero).with_for_update(skip_locked=skip_locked)
 
         if limit:
             query = query.limit(limit)
@@ -32,8 +117,173 @@ class TicketRepository(BaseRepository[Ticket]):
         result = await db.execute(query)
         return result.scalars().all()
 
+    async def _insert_taken(self, db: AsyncSession, rifa_id: str, compact: Row, numeros: List[int], updates: dict) -> List[Ticket]:
+        """Create rows for the numbers of a compact rifa nobody has taken yet, with `updates` applied."""
+        numeros = [numero for numero in numeros if 1 <= numero <= compact[0]]
+        if not numeros:
+            return []
+        serie = func.unnest(array(numeros, type_=Integer)).table_valued("numero").render_derived(name="serie")
+        values = {"precio": compact[1], **updates}
+        source = select(
+            _typed("rifa_id", rifa_id), serie.c.numero, *[_typed(column, value) for column, value in values.items()]
+        ).select_from(serie)
+        query = insert(Ticket).from_select(["rifa_id", "numero", *values], source).on_conflict_do_nothing(
+            index_elements=["rifa_id", "numero"]
+        ).returning(Ticket)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def claim_available_tickets(self, db: AsyncSession, rifa_id: str, numeros: List[int], updates: dict) -> List[Ticket]:
+        # Only numbers still free are claimed; the caller commits
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is not None:
+            return await self._insert_taken(db, rifa_id, compact, numeros, updates)
+
+        query = update(Ticket).where(
+            and_(
+                Ticket.rifa_id == rifa_id,
+                Ticket.numero.in_(numeros),
+                Ticket.estado == "disponible"
+            )
+        ).values(updates).returning(Ticket).execution_options(synchronize_session=False)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def claim_next_available(self, db: AsyncSession, rifa_id: str, quantity: int, updates: dict) -> List[Ticket]:
+        """
+        Claim the lowest `quantity` free tickets of a rifa without the Redis
+        inventory. Returns fewer when the rifa runs out; the caller commits,
+        or rolls back to give back a partial claim.
+        """
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is None:
+            # Skip rows other buyers hold rather than queueing behind them
+            available_tickets = await self.get_available_tickets_with_lock(db, rifa_id, quantity, skip_locked=True)
+            if len(available_tickets) < quantity:
+                # Skipped rows may still be released by a failed purchase; wait for them
+                available_tickets = await self.get_available_tickets_with_lock(db, rifa_id, quantity)
+            if len(available_tickets) < quantity:
+                return []
+            return await self.claim_available_tickets(db, rifa_id, [ticket.numero for ticket in available_tickets], updates)
+
+        # Numbers read as free may be inserted by another buyer first: take what is left and try again
+        claimed: List[Ticket] = []
+        for _ in range(COMPACT_CLAIM_ATTEMPTS):
+            numeros = await db.execute(free_numbers(rifa_id, 1, compact[0]).limit(quantity - len(claimed)))
+            numeros = list(numeros.scalars().all())
+            if not numeros:
+                break
+            claimed.extend(await self._insert_taken(db, rifa_id, compact, numeros, updates))
+            if len(claimed) == quantity:
+                break
+        return claimed
+
+    async def get_nearest_available_numbers(self, db: AsyncSession, rifa_id: str, numero: int, limit: int, exclude: List[int] = ()) -> List[int]:
+        """Free numbers closest to `numero`: `limit` above and `limit` below it, nearest first."""
+        exclude = list(exclude) or [numero]
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is not None:
+            base = free_numbers(rifa_id, numero, compact[0])
+            above = await db.execute(base.where(base.selected_columns.numero.notin_(exclude)).limit(limit))
+            base = free_numbers(rifa_id, numero - 1, 1, -1)
+            below = await db.execute(base.where(base.selected_columns.numero.notin_(exclude)).limit(limit))
+        else:
+            base = select(Ticket.numero).where(
+                and_(
+                    Ticket.rifa_id == rifa_id,
+                    Ticket.estado == "disponible",
+                    Ticket.numero.notin_(exclude)
+                )
+            )
+            above = await db.execute(base.where(Ticket.numero >= numero).order_by(Ticket.numero).limit(limit))
+            below = await db.execute(base.where(Ticket.numero < numero).order_by(desc(Ticket.numero)).limit(limit))
+        candidates = list(above.scalars().all()) + list(below.scalars().all())
+        return sorted(candidates, key=lambda candidate: (abs(candidate - numero), candidate))[:limit]
+
+    async def bulk_hold_tickets(self, db: AsyncSession, rifa_id: str, assignments: List[dict]) -> None:
+        """
+        Hold tickets of a rifa, each dict carrying "id" (or "numero" for a
+        compact rifa) plus the values to set. Raises TicketsTakenError when a
+        number of a compact rifa was taken meanwhile. The caller commits.
+        """
+        if not assignments:
+            return
+        compact = await self._compact_rifa(db, rifa_id)
+        if compact is None:
+            # One executemany UPDATE by primary key, which includes the partition key rifa_id
+            await db.execute(update(Ticket), [
+                {**{key: value for key, value in assignment.items() if key != "numero"}, "rifa_id": rifa_id}
+                for assignment in assignments
+            ])
+            return
+
+        rows = [
+            {"rifa_id": rifa_id, "precio": compact[1], **{key: value for key, value in assignment.items() if key != "id"}}
+            for assignment in assignments
+        ]
+        query = insert(Ticket).values(rows).on_conflict_do_nothing(index_elements=["rifa_id", "numero"])
+        result = await db.execute(query)
+        if result.rowcount < len(rows):
+            raise TicketsTakenError("Tickets taken by another purchase, try again")
+
+    async def sell_held_tickets(self, db: AsyncSession, transaction_id: str, comprado_en: datetime) -> List[Ticket]:
+        query = update(Ticket).where(
+            and_(Ticket.transaccion_id == transaction_id, Ticket.estado == "reservado")
+        ).values(
+            estado="vendido",
+            comprado_en=comprado_en,
+            reservado_hasta=None
+        ).returning(Ticket).execution_options(synchronize_session=False)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def release_held_tickets(self, db: AsyncSession, transaction_id: str) -> List[Row]:
+        """Release the holds of a transaction. Returns (rifa_id, numero) rows."""
+        held = and_(Ticket.transaccion_id == transaction_id, Ticket.estado == "reservado")
+        # A cart may span rifas of both storage modes: compact ones drop the row, the others reset it
+        deleted = delete(Ticket).where(
+            and_(held, Ticket.rifa_id.in_(COMPACT_RIFAS))
+        ).returning(Ticket.rifa_id, Ticket.numero).execution_options(synchronize_session=False)
+        query = update(Ticket).where(
+            and_(held, Ticket.rifa_id.notin_(COMPACT_RIFAS))
+        ).values(HOLD_RELEASE_VALUES).returning(Ticket.rifa_id, Ticket.numero).execution_options(synchronize_session=False)
+        return (await db.execute(deleted)).all() + (await db.execute(query)).all()
+
+    async def release_expired_holds(self, db: AsyncSession, now: datetime, keep_transactions: Sequence[str] = ()) -> List[Row]:
+        """
+        Release every hold past its deadline, except those of `keep_transactions`.
+        Returns (rifa_id, numero, transaccion_id) rows.
+        """
+        def expired(compact: bool):
+            # The CTE keeps the transaction id, which the UPDATE itself clears
+            in_mode = Ticket.rifa_id.in_(COMPACT_RIFAS) if compact else Ticket.rifa_id.notin_(COMPACT_RIFAS)
+            conditions = [Ticket.estado == "reservado", Ticket.reservado_hasta < now, in_mode]
+            if keep_transactions:
+                conditions.append(Ticket.transaccion_id.notin_(keep_transactions))
+            return select(Ticket.id, Ticket.transaccion_id).where(and_(*conditions)).with_for_update(skip_locked=True).cte("held")
+
+        held = expired(compact=True)
+        deleted = delete(Ticket).where(Ticket.id == held.c.id).returning(
+            Ticket.rifa_id, Ticket.numero, held.c.transaccion_id
+        ).execution_options(synchronize_session=False)
+        held = expired(compact=False)
+        query = update(Ticket).where(Ticket.id == held.c.id).values(HOLD_RELEASE_VALUES).returning(
+            Ticket.rifa_id, Ticket.numero, held.c.transaccion_id
+        ).execution_options(synchronize_session=False)
+        return (await db.execute(deleted)).all() + (await db.execute(query)).all()
+
     async def get_tickets_by_user(self, db: AsyncSession, user_id: str, skip: int = 0, limit: int = 100) -> List[Ticket]:
-        query = select(Ticket).where(Ticket.usuario_id == user_id).offset(skip).limit(limit)
+        return (await self.get_user_tickets_page(db, user_id, limit=limit, skip=skip)).items
+
+    async def get_user_tickets_page(
+        self, db: AsyncSession, user_id: str, cursor: Optional[str] = None, limit: int = 100, skip: int = 0
+    ) -> Page[Ticket]:
+        # Keyset (numero, id) within the user's tickets, backed by ix_tickets_usuario_numero_id
+        query = select(Ticket).where(Ticket.usuario_id == user_id)
+        return await paginate(db, query, [Ticket.numero, Ticket.id], cursor, limit, skip)
+
+    async def get_tickets_by_transaction(self, db: AsyncSession, transaction_id: str) -> List[Ticket]:
+        query = select(Ticket).where(Ticket.transaccion_id == transaction_id).order_by(Ticket.numero)
         result = await db.execute(query)
         return result.scalars().all()
 
@@ -42,6 +292,54 @@ class TicketRepository(BaseRepository[Ticket]):
         result = await db.execute(query)
         return result.scalars().all()
 
+    async def get_tickets_by_rifa_and_state(self, db: AsyncSession, rifa_id: str, estado: str) -> List[Ticket]:
+        query = select(Ticket).where(
+            and_(Ticket.rifa_id == rifa_id, Ticket.estado == estado)
+        ).order_by(Ticket.numero)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def get_tickets_by_numbers(self, db: AsyncSession, rifa_id: str, numeros: List[int], estados: List[str]) -> List[Ticket]:
+        """Tickets of a rifa with the given numbers and states: one probe of uq_tickets_rifa_numero per number."""
+        query = select(Ticket).where(
+            and_(Ticket.rifa_id == rifa_id, Ticket.numero.in_(numeros), Ticket.estado.in_(estados))
+        ).order_by(Ticket.numero)
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def set_tickets_state(self, db: AsyncSession, rifa_id: str, ticket_ids: List[str], from_estado: str, to_estado: str) -> None:
+        """Move the given tickets of a rifa from one state to another. Counters are the caller's, and so is the commit."""
+        query = update(Ticket).where(
+            and_(Ticket.rifa_id == rifa_id, Ticket.id.in_(ticket_ids), Ticket.estado == from_estado)
+        ).values(estado=to_estado).execution_options(synchronize_session=False)
+        await db.execute(query)
+
+    async def set_rifa_tickets_state(self, db: AsyncSession, rifa_id: str, from_estado: str, to_estado: str) -> None:
+        """Move every ticket of a rifa in one state to another. Counters are the caller's, and so is the commit."""
+        query = update(Ticket).where(
+            and_(Ticket.rifa_id == rifa_id, Ticket.estado == from_estado)
+        ).values(estado=to_estado)
+        await db.execute(query)
+
+    async def materialize_tickets(self, db: AsyncSession, rifa_id: str, first: int, last: int, precio: Optional[int]) -> int:
+        """
+        Create tickets `first`..`last` of a rifa with one INSERT ... SELECT over
+        generate_series. Numbers that already exist are skipped, so it can be
+        re-run. Returns the number of tickets created; the caller commits.
+        """
+        serie = func.generate_series(first, last).table_valued("numero").render_derived(name="serie")
+        source = select(
+            literal(rifa_id, Ticket.rifa_id.type),
+            serie.c.numero,
+            cast(literal("disponible"), Ticket.estado.type),
+            literal(precio, Ticket.precio.type)
+        ).select_from(serie)
+        query = insert(Ticket).from_select(["rifa_id", "numero", "estado", "precio"], source).on_conflict_do_nothing(
+            index_elements=["rifa_id", "numero"]
+        )
+        result = await db.execute(query)
+        return result.rowcount
+
     async def get_next_ticket_number(self, db: AsyncSession, rifa_id: str) -> int:
         query = select(Ticket).where(Ticket.rifa_id == rifa_id).order_by(desc(Ticket.numero)).limit(1)
         result = await db.execute(query)
@@ -61,6 +359,28 @@ class TicketRepository(BaseRepository[Ticket]):
         return ticket
 
     async def bulk_update_tickets(self, db: AsyncSession, ticket_ids: List[str], updates: dict) -> None:
+        new_estado = updates.get("estado")
+        previous = []
+        if new_estado is not None:
+            # Lock the rows and group them by current state so counters move in the same transaction
+            locked = select(Ticket.id).where(Ticket.id.in_(ticket_ids)).with_for_update().subquery()
+            grouped = select(
+                Ticket.rifa_id, Ticket.estado, func.count(Ticket.id), func.coalesce(func.sum(Ticket.precio), 0)
+            ).where(Ticket.id.in_(select(locked.c.id))).group_by(Ticket.rifa_id, Ticket.estado)
+            previous = (await db.execute(grouped)).all()
+
         query = update(Ticket).where(Ticket.id.in_(ticket_ids)).values(updates)
         await db.execute(query)
+
+        counter_repo = RifaCounterRepository()
+        for rifa_id, estado, count, precio in sorted(previous, key=lambda row: str(row[0])):
+            if estado == new_estado:
+                continue
+            deltas = {}
+            if estado in STATE_COLUMNS:
+                deltas[STATE_COLUMNS[estado]] = -count
+            if new_estado in STATE_COLUMNS:
+                deltas[STATE_COLUMNS[new_estado]] = count
+            deltas["recaudo_bruto"] = ((new_estado in REVENUE_STATES) - (estado in REVENUE_STATES)) * precio
+            await counter_repo.apply_deltas(db, str(rifa_id), deltas)
         await db.commit()
\ No newline at end of file
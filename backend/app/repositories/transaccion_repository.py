@@ -1,8 +1,10 @@
-from typing import Optional, List
+from datetime import datetime
+from typing import Optional, List, Sequence
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, insert, delete, and_
 
-from app.models.transaccion import Transaccion
+from app.models.ticket import Ticket
+from app.models.transaccion import Transaccion, TransaccionClave
 from app.repositories.base import BaseRepository
 
 
@@ -11,10 +13,19 @@ class TransaccionRepository(BaseRepository[Transaccion]):
         super().__init__(Transaccion)
 
     async def get_by_idempotency_key(self, db: AsyncSession, idempotency_key: str) -> Optional[Transaccion]:
-        query = select(Transaccion).where(Transaccion.idempotency_key == idempotency_key)
+        # The key's created_at narrows the lookup to one monthly partition
+        query = select(Transaccion).join(
+            TransaccionClave,
+            and_(TransaccionClave.transaccion_id == Transaccion.id, TransaccionClave.created_at == Transaccion.created_at)
+        ).where(TransaccionClave.idempotency_key == idempotency_key)
         result = await db.execute(query)
         return result.scalar_one_or_none()
 
+    async def bulk_create(self, db: AsyncSession, rows: List[dict]) -> None:
+        """Insert many transactions with one statement. The caller commits."""
+        if rows:
+            await db.execute(insert(Transaccion).values(rows))
+
     async def get_user_transactions(self, db: AsyncSession, user_id: str, skip: int = 0, limit: int = 100) -> List[Transaccion]:
         query = select(Transaccion).where(Transaccion.user_id == user_id).offset(skip).limit(limit)
         result = await db.execute(query)
@@ -30,4 +41,35 @@ class TransaccionRepository(BaseRepository[Transaccion]):
             transaction.status = status
             await db.commit()
             await db.refresh(transaction)
-        return transaction
\ No newline at end of file
+        return transaction
+
+    async def get_charging_with_expired_holds(self, db: AsyncSession, now: datetime) -> List[Transaccion]:
+        """Pending transactions with a PaymentIntent whose ticket holds are past their deadline."""
+        expired = select(Ticket.transaccion_id).where(
+            and_(Ticket.estado == "reservado", Ticket.reservado_hasta < now)
+        )
+        query = select(Transaccion).where(
+            and_(
+                Transaccion.status == "pending",
+                Transaccion.provider_ref.isnot(None),
+                Transaccion.id.in_(expired)
+            )
+        )
+        result = await db.execute(query)
+        return result.scalars().all()
+
+    async def delete_pending(self, db: AsyncSession, transaction_id: str, idempotency_key: str) -> None:
+        """Delete a pending transaction and its idempotency key, so the key can be used again. The caller commits."""
+        query = delete(Transaccion).where(
+            and_(Transaccion.id == transaction_id, Transaccion.status == "pending")
+        ).returning(Transaccion.id).execution_options(synchronize_session=False)
+        if (await db.execute(query)).first() is not None:
+            await db.execute(delete(TransaccionClave).where(TransaccionClave.idempotency_key == idempotency_key))
+
+    async def bulk_update_status(self, db: AsyncSession, transaction_ids: List[str], status: str, from_status: Sequence[str] = ("pending",)) -> None:
+        # The caller commits
+        query = update(Transaccion).where(
+            Transaccion.id.in_(transaction_ids),
+            Transaccion.status.in_(from_status)
+        ).values(status=status).execution_options(synchronize_session=False)
+        await db.execute(query)
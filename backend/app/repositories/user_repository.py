@@ -0,0 +1,32 @@
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.models.user import User
+from app.repositories.base import BaseRepository
+from app.schemas.user import UserCreate
+
+
+class UserRepository(BaseRepository[User]):
+    # Keyset of the user list, backed by ix_users_creado_en_id
+    page_order = [User.creado_en, User.id]
+
+    def __init__(self):
+        super().__init__(User)
+
+    async def get_by_email(self, db: AsyncSession, email: str) -> Optional[User]:
+        result = await db.execute(select(User).where(User.email == email))
+        return result.scalar_one_or_none()
+
+    async def create_user(self, db: AsyncSession, user_in: UserCreate, hashed_password: str) -> User:
+        db_user = User(
+            nombre=user_in.nombre,
+            email=user_in.email,
+            telefono=user_in.telefono,
+            hashed_password=hashed_password,
+            rol=user_in.rol
+        )
+        db.add(db_user)
+        await db.commit()
+        await db.refresh(db_user)
+        return db_user
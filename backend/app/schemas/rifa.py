@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Literal
 from datetime import datetime
 from uuid import UUID
 
@@ -13,6 +13,7 @@ class RifaBase(BaseModel):
     numero_ganadores: int = 1
     reglas: Dict[str, Any] = {}
     total_boletas: int = 100
+    almacenamiento: Literal["filas", "compacto"] = "filas"  # fixed once the rifa is created
 
 
 class RifaCreate(RifaBase):
@@ -31,10 +32,22 @@ class RifaUpdate(BaseModel):
     total_boletas: Optional[int] = None
 
 
+class RifaCounters(BaseModel):
+    disponibles: int = 0
+    reservadas: int = 0
+    vendidas: int = 0
+    ganadores: int = 0
+    recaudo_bruto: int = 0
+
+    class Config:
+        from_attributes = True
+
+
 class RifaOut(RifaBase):
     id: UUID
     estado: str
     creado_en: datetime
+    contadores: Optional[RifaCounters] = None
 
     class Config:
         from_attributes = True
@@ -50,6 +63,14 @@ class RifaList(BaseModel):
     estado: str
     total_boletas: int
     creado_en: datetime
+    contadores: Optional[RifaCounters] = None
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class RifaAvailability(BaseModel):
+    rifa_id: UUID
+    total_boletas: int
+    version: Optional[int] = None  # inventory version, None when built from the database
+    encoding: str = "bitmap-base64"
+    bitmap: str  # bit n (most significant bit first) is set when numero n is sold or reserved
@@ -29,10 +29,23 @@ class TicketPurchase(BaseModel):
     rifa_id: UUID
     user_id: UUID
     quantity: int
+    numeros: Optional[List[int]] = None  # specific numbers chosen by the buyer
     payment_method: str = "stripe"
     idempotency_key: str
 
 
 class TicketPurchaseResponse(BaseModel):
     tickets: List[TicketOut]
-    transaccion_id: UUID
\ No newline at end of file
+    transaccion_id: UUID
+
+
+class CartItem(BaseModel):
+    rifa_id: UUID
+    quantity: int
+
+
+class CartCheckout(BaseModel):
+    user_id: UUID
+    items: List[CartItem]
+    payment_method: str = "stripe"
+    idempotency_key: str
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime
+from typing import List, Dict, Optional, Union
+from uuid import uuid4
+
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.redis import get_redis
+from app.db.session import AsyncSessionLocal
+from app.repositories.rifa_counter_repository import RifaCounterRepository
+from app.repositories.ticket_repository import TicketRepository, TicketsTakenError, COMPACT_CLAIM_ATTEMPTS
+from app.services.inventory_service import TicketInventoryService
+
+IDLE_TIMEOUT_SECONDS = 5.0
+REPLY_POLL_SECONDS = 0.1
+REPLY_TTL_SECONDS = 60
+
+# Deletes the leader lease only if it still belongs to the caller.
+RELEASE_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Extends the leader lease only if it still belongs to the caller.
+RENEW_LEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+@dataclass
+class AllocationRequest:
+    transaction_id: str
+    user_id: str
+    quantity: int
+    reservado_hasta: datetime
+    request_id: str = field(default_factory=lambda: str(uuid4()))
+
+
+class BatchAllocator:
+    """
+    Allocates a whole batch of requests for one rifa with one locked query
+    and one bulk write (an UPDATE, or an INSERT for a compact rifa). A
+    compact rifa's batch is read and written again when another process
+    inserted one of its numbers first.
+    """
+
+    def __init__(self, rifa_id: str, session_factory=AsyncSessionLocal, inventory: TicketInventoryService = None):
+        self.rifa_id = rifa_id
+        self.session_factory = session_factory
+        self.ticket_repo = TicketRepository()
+        self.counter_repo = RifaCounterRepository()
+        self.inventory = inventory
+
+    async def allocate_batch(self, requests: List[AllocationRequest]) -> List[Union[List[int], Exception]]:
+        """Return, per request, the held numbers or the error that request failed with."""
+        try:
+            async with self.session_factory() as db:
+                # Free numbers of a compact rifa are not locked when read: another worker's
+                # allocator may insert some of them first, then the batch is read again
+                for attempt in range(1, COMPACT_CLAIM_ATTEMPTS + 1):
+                    try:
+                        results = await self._hold(db, requests)
+                        break
+                    except TicketsTakenError:
+                        await db.rollback()
+                        if attempt == COMPACT_CLAIM_ATTEMPTS:
+                            raise
+        except Exception as e:
+            return [e for _ in requests]
+
+        if self.inventory is not None and settings.ticket_inventory_enabled:
+            # Keep the Redis free set in step with numbers held here
+            held = [numero for result in results if isinstance(result, list) for numero in result]
+            try:
+                await self.inventory.remove(self.rifa_id, held)
+            except RedisError:
+                pass  # the holds are committed; Postgres rejects a claim of these numbers from a stale inventory
+        return results
+
+    async def _hold(self, db: AsyncSession, requests: List[AllocationRequest]) -> List[Union[List[int], Exception]]:
+        total = sum(request.quantity for request in requests)
+        tickets = await self.ticket_repo.get_available_tickets_with_lock(db, self.rifa_id, total, skip_locked=True)
+
+        # Requests are served in arrival order; once one does not fit, later ones
+        # may still fit, so each is checked against what is left
+        results: List[Union[List[int], Exception]] = []
+        assignments = []
+        held_tickets = []
+        position = 0
+        for request in requests:
+            if position + request.quantity > len(tickets):
+                results.append(ValueError("Not enough tickets available"))
+                continue
+            chunk = tickets[position:position + request.quantity]
+            position += request.quantity
+            held_tickets.extend(chunk)
+            assignments.extend({
+                "id": ticket.id,
+                "numero": ticket.numero,
+                "usuario_id": request.user_id,
+                "estado": "reservado",
+                "transaccion_id": request.transaction_id,
+                "reservado_hasta": request.reservado_hasta
+            } for ticket in chunk)
+            results.append([ticket.numero for ticket in chunk])
+
+        await self.ticket_repo.bulk_hold_tickets(db, self.rifa_id, assignments)
+        await self.counter_repo.apply_transition(db, held_tickets, "disponible", "reservado")
+        await db.commit()
+        return results
+
+
+class RifaAllocationActor:
+    """
+    Single writer for one rifa inside this worker. Callers enqueue a request
+    and await a future; one task drains the queue in batches of up to
+    `max_batch`, so a burst of N buyers costs a few round-trips instead of N
+    competing row locks. The task exits after a while without requests and is
+    restarted by the next one.
+    """
+
+    def __init__(self, rifa_id: str, allocator: BatchAllocator = None, max_batch: int = None):
+        self.rifa_id = rifa_id
+        self.allocator = allocator or BatchAllocator(rifa_id, inventory=TicketInventoryService())
+        self.max_batch = max_batch or settings.allocation_max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    async def allocate(self, request: AllocationRequest) -> List[int]:
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((request, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return await asyncio.wait_for(future, timeout=settings.allocation_timeout_seconds)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                first = await asyncio.wait_for(self.queue.get(), timeout=IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return
+            batch = [first]
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            # Callers that timed out meanwhile are not allocated anything
+            pending = [(request, future) for request, future in batch if not future.done()]
+            if not pending:
+                continue
+            results = await self.allocator.allocate_batch([request for request, _ in pending])
+            for (_, future), result in zip(pending, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+class RedisRifaAllocator:
+    """
+    Cross-worker variant: requests go to a Redis list per rifa and whichever
+    worker holds the rifa's leader lease drains it in batches, replying on a
+    per-request list the caller waits on with BLPOP. Any waiting caller tries
+    to take the lease, so the queue keeps moving if the leader dies.
+    """
+
+    def __init__(self, rifa_id: str, redis=None, allocator: BatchAllocator = None, max_batch: int = None):
+        self.rifa_id = rifa_id
+        self.redis = redis or get_redis()
+        self.allocator = allocator or BatchAllocator(rifa_id, inventory=TicketInventoryService(self.redis))
+        self.max_batch = max_batch or settings.allocation_max_batch
+        self.lease_ms = settings.allocation_leader_lease_ms
+        self._release_lease = self.redis.register_script(RELEASE_LEASE_SCRIPT)
+        self._renew_lease = self.redis.register_script(RENEW_LEASE_SCRIPT)
+
+    def queue_key(self) -> str:
+        return f"asignacion:{{{self.rifa_id}}}:cola"
+
+    def leader_key(self) -> str:
+        return f"asignacion:{{{self.rifa_id}}}:lider"
+
+    def reply_key(self, request_id: str) -> str:
+        return f"asignacion:{{{self.rifa_id}}}:respuesta:{request_id}"
+
+    async def allocate(self, request: AllocationRequest) -> List[int]:
+        payload = asdict(request)
+        payload["reservado_hasta"] = request.reservado_hasta.isoformat()
+        await self.redis.rpush(self.queue_key(), json.dumps(payload))
+
+        deadline = time.monotonic() + settings.allocation_timeout_seconds
+        reply_key = self.reply_key(request.request_id)
+        while True:
+            token = str(uuid4())
+            if await self.redis.set(self.leader_key(), token, nx=True, px=self.lease_ms):
+                await self._lead(token)
+
+            reply = await self.redis.blpop([reply_key], timeout=REPLY_POLL_SECONDS)
+            if reply:
+                result = json.loads(reply[1])
+                if "error" in result:
+                    raise ValueError(result["error"])
+                return result["numeros"]
+            if time.monotonic() > deadline:
+                raise ValueError("Ticket allocation timed out")
+
+    async def _lead(self, token: str) -> None:
+        try:
+            while True:
+                raw = await self.redis.lpop(self.queue_key(), self.max_batch)
+                if not raw:
+                    return
+                requests = []
+                for item in raw:
+                    data = json.loads(item)
+                    data["reservado_hasta"] = datetime.fromisoformat(data["reservado_hasta"])
+                    requests.append(AllocationRequest(**data))
+
+                results = await self.allocator.allocate_batch(requests)
+                pipe = self.redis.pipeline(transaction=False)
+                for request, result in zip(requests, results):
+                    reply = {"error": str(result)} if isinstance(result, Exception) else {"numeros": result}
+                    key = self.reply_key(request.request_id)
+                    pipe.rpush(key, json.dumps(reply))
+                    pipe.expire(key, REPLY_TTL_SECONDS)
+                await pipe.execute()
+
+                if not await self._renew_lease(keys=[self.leader_key()], args=[token, self.lease_ms]):
+                    return
+        finally:
+            await self._release_lease(keys=[self.leader_key()], args=[token])
+
+
+_actors: Dict[str, Union[RifaAllocationActor, RedisRifaAllocator]] = {}
+
+
+def get_allocator(rifa_id: str) -> Union[RifaAllocationActor, RedisRifaAllocator]:
+    """Per-process allocator of a rifa for the configured `allocation_mode`."""
+    allocator = _actors.get(rifa_id)
+    if allocator is None:
+        if settings.allocation_mode == "redis":
+            allocator = RedisRifaAllocator(rifa_id)
+        else:
+            allocator = RifaAllocationActor(rifa_id)
+        _actors[rifa_id] = allocator
+    return allocator
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from typing import Optional, Dict, Any
+from uuid import uuid4
+
+from app.core.config import settings
+from app.core.redis import get_redis
+
+# Deletes the in-flight marker only if this request still owns it
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+POLL_INITIAL_SECONDS = 0.05
+POLL_MAX_SECONDS = 0.5
+
+
+class IdempotencyStore:
+    """
+    Redis fast path for idempotent requests.
+
+    A completed request stores its serialized response under the key for
+    `idempotency_ttl_seconds`. While a request is processing it holds an
+    in-flight marker, so a retry arriving meanwhile waits for the stored
+    response instead of racing the first request. The durable record is the
+    transaction row itself; this store only avoids recomputing it.
+    """
+
+    def __init__(self, redis=None, namespace: str = "compra"):
+        self.redis = redis or get_redis()
+        self.namespace = namespace
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def response_key(self, key: str) -> str:
+        return f"idempotencia:{self.namespace}:{key}"
+
+    def lock_key(self, key: str) -> str:
+        return f"idempotencia:{self.namespace}:{key}:en_curso"
+
+    async def get_response(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = await self.redis.get(self.response_key(key))
+        return json.loads(cached) if cached else None
+
+    async def begin(self, key: str) -> Optional[str]:
+        """Mark the key as in flight. Returns an owner token, or None if another request holds it."""
+        token = str(uuid4())
+        acquired = await self.redis.set(self.lock_key(key), token, nx=True, ex=settings.idempotency_lock_ttl_seconds)
+        return token if acquired else None
+
+    async def complete(self, key: str, token: str, response: Dict[str, Any]) -> None:
+        await self.redis.set(self.response_key(key), json.dumps(response), ex=settings.idempotency_ttl_seconds)
+        await self.release(key, token)
+
+    async def release(self, key: str, token: str) -> None:
+        await self._release(keys=[self.lock_key(key)], args=[token])
+
+    async def wait_for_response(self, key: str, timeout: float = None) -> Optional[Dict[str, Any]]:
+        """
+        Wait for the in-flight request to finish. Returns its response, or None
+        if it ended without one (failure) or the wait timed out.
+        """
+        timeout = settings.idempotency_wait_seconds if timeout is None else timeout
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = POLL_INITIAL_SECONDS
+        while True:
+            response = await self.get_response(key)
+            if response is not None:
+                return response
+            if not await self.redis.exists(self.lock_key(key)):
+                # The response is written before the marker is dropped
+                return await self.get_response(key)
+            if loop.time() >= deadline:
+                return None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, POLL_MAX_SECONDS)
@@ -0,0 +1,347 @@
+import hashlib
+from typing import List, Optional, Dict, Any, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.core.redis import get_redis
+from app.models.rifa import Rifa
+from app.models.ticket import Ticket
+from app.repositories.ticket_repository import TicketRepository
+
+# All scripts take KEYS = free set, ready marker, taken bitmap, version counter; every change bumps the version.
+
+# Claims the `n` lowest free numbers of a rifa in one atomic step and marks them taken in the bitmap.
+# Returns -1 when the inventory is not loaded and 0 when there are not enough free numbers.
+CLAIM_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return -1
+end
+local n = tonumber(ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < n then
+    return 0
+end
+local popped = redis.call('ZPOPMIN', KEYS[1], n)
+local numeros = {}
+for i = 1, #popped, 2 do
+    numeros[#numeros + 1] = popped[i]
+    redis.call('SETBIT', KEYS[3], popped[i], 1)
+end
+redis.call('INCR', KEYS[4])
+return numeros
+"""
+
+# Claims the given numbers if all of them are free (one GETBIT each).
+# Returns -1 when the inventory is not loaded, otherwise the numbers that are taken (empty on success).
+CLAIM_NUMBERS_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return -1
+end
+local taken = {}
+for i = 1, #ARGV do
+    if redis.call('GETBIT', KEYS[3], ARGV[i]) == 1 then
+        taken[#taken + 1] = ARGV[i]
+    end
+end
+if #taken > 0 then
+    return taken
+end
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[3], ARGV[i], 1)
+    redis.call('ZREM', KEYS[1], ARGV[i])
+end
+redis.call('INCR', KEYS[4])
+return taken
+"""
+
+# Puts numbers back into the free set (no-op if the inventory was dropped meanwhile).
+RELEASE_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+for i = 1, #ARGV do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i])
+    redis.call('SETBIT', KEYS[3], ARGV[i], 0)
+end
+redis.call('INCR', KEYS[4])
+return #ARGV
+"""
+
+REBUILD_CHUNK_SIZE = 10000
+SUSPECTS_TTL_SECONDS = 3600
+SUGGESTIONS_PER_NUMBER = 2
+
+
+def pack_numbers(numeros: List[int], size: int) -> bytes:
+    """Bitmap of `size` bytes with bit n set for each numero n, in Redis bit order (MSB first)."""
+    bitmap = bytearray(size)
+    for numero in numeros:
+        if 0 <= numero < size * 8:
+            bitmap[numero >> 3] |= 0x80 >> (numero & 7)
+    return bytes(bitmap)
+
+
+class NumbersUnavailableError(ValueError):
+    """Chosen numbers are sold or held; carries the nearest free numbers to offer instead."""
+
+    def __init__(self, unavailable: List[int], suggestions: List[int]):
+        super().__init__(f"Numbers not available: {', '.join(str(numero) for numero in unavailable)}")
+        self.unavailable = unavailable
+        self.suggestions = suggestions
+
+
+class TicketInventoryService:
+    """
+    Keeps the free ticket numbers of each active rifa in Redis so purchases can
+    claim numbers without row locks. Postgres remains the source of truth: the
+    final UPDATE only sells numbers still `disponible`, so a stale inventory can
+    cause a retry but never a double sale.
+
+    Next to the sorted set of free numbers, a bitmap (bit n = numero n, set
+    when sold or held) answers "is this number taken?" in O(1) for buyers who
+    pick their own numbers.
+    """
+
+    def __init__(self, redis=None):
+        self.redis = redis or get_redis()
+        self._claim = self.redis.register_script(CLAIM_SCRIPT)
+        self._claim_numbers = self.redis.register_script(CLAIM_NUMBERS_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    @staticmethod
+    def free_key(rifa_id: str) -> str:
+        return f"inventario:{{{rifa_id}}}:libres"
+
+    @staticmethod
+    def ready_key(rifa_id: str) -> str:
+        return f"inventario:{{{rifa_id}}}:listo"
+
+    @staticmethod
+    def taken_key(rifa_id: str) -> str:
+        return f"inventario:{{{rifa_id}}}:ocupados"
+
+    @staticmethod
+    def version_key(rifa_id: str) -> str:
+        return f"inventario:{{{rifa_id}}}:version"
+
+    def _keys(self, rifa_id: str) -> List[str]:
+        return [self.free_key(rifa_id), self.ready_key(rifa_id), self.taken_key(rifa_id), self.version_key(rifa_id)]
+
+    @staticmethod
+    def suspects_key(rifa_id: str) -> str:
+        return f"inventario:{{{rifa_id}}}:sospechosos"
+
+    async def claim(self, rifa_id: str, quantity: int) -> Optional[List[int]]:
+        """
+        Atomically take `quantity` free numbers.
+        Returns None if the inventory for the rifa is not loaded.
+        Raises ValueError if there are not enough free numbers.
+        """
+        result = await self._claim(keys=self._keys(rifa_id), args=[quantity])
+        if result == -1:
+            return None
+        if result == 0:
+            raise ValueError("Not enough tickets available")
+        return [int(numero) for numero in result]
+
+    async def claim_numbers(self, rifa_id: str, numeros: List[int]) -> Optional[List[int]]:
+        """
+        Atomically take exactly the given numbers.
+        Returns None if the inventory for the rifa is not loaded.
+        Raises NumbersUnavailableError (with nearest free suggestions) if any is taken.
+        """
+        result = await self._claim_numbers(keys=self._keys(rifa_id), args=list(numeros))
+        if result == -1:
+            return None
+        if result:
+            unavailable = sorted(int(numero) for numero in result)
+            raise NumbersUnavailableError(unavailable, await self.nearest_free(rifa_id, unavailable, exclude=numeros))
+        return list(numeros)
+
+    async def nearest_free(self, rifa_id: str, numeros: List[int], exclude: List[int] = ()) -> List[int]:
+        """Free numbers closest to each of `numeros`, found with range queries on the free set."""
+        free_key = self.free_key(rifa_id)
+        pipe = self.redis.pipeline(transaction=False)
+        for numero in numeros:
+            pipe.zrangebyscore(free_key, numero, "+inf", start=0, num=SUGGESTIONS_PER_NUMBER)
+            pipe.zrevrangebyscore(free_key, numero, "-inf", start=0, num=SUGGESTIONS_PER_NUMBER)
+        results = await pipe.execute()
+
+        skip = set(exclude)
+        suggestions = []
+        for index, numero in enumerate(numeros):
+            candidates = {int(candidate) for candidate in results[2 * index] + results[2 * index + 1]} - skip
+            for candidate in sorted(candidates, key=lambda candidate: (abs(candidate - numero), candidate))[:SUGGESTIONS_PER_NUMBER]:
+                suggestions.append(candidate)
+                skip.add(candidate)
+        return sorted(suggestions)
+
+    async def release(self, rifa_id: str, numeros: List[int]) -> None:
+        if not numeros:
+            return
+        await self._release(keys=self._keys(rifa_id), args=list(numeros))
+
+    async def remove(self, rifa_id: str, numeros: List[int]) -> None:
+        """Take numbers allocated outside the inventory (e.g. by the allocation actor) out of the free set."""
+        if not numeros:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.zrem(self.free_key(rifa_id), *numeros)
+        for numero in numeros:
+            pipe.setbit(self.taken_key(rifa_id), numero, 1)
+        pipe.incr(self.version_key(rifa_id))
+        await pipe.execute()
+
+    async def drop(self, rifa_id: str) -> None:
+        # The version survives so ETags handed out before a reload never match again
+        await self.redis.delete(
+            self.free_key(rifa_id), self.ready_key(rifa_id), self.taken_key(rifa_id), self.suspects_key(rifa_id)
+        )
+
+    async def availability(self, rifa_id: str) -> Optional[Tuple[bytes, int]]:
+        """Raw taken bitmap and version of a loaded rifa, read atomically; None if not loaded."""
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.exists(self.ready_key(rifa_id))
+        pipe.get(self.taken_key(rifa_id))
+        pipe.get(self.version_key(rifa_id))
+        loaded, bitmap, version = await pipe.execute()
+        if not loaded:
+            return None
+        return bitmap or b"", int(version or 0)
+
+    async def availability_snapshot(self, db: AsyncSession, rifa: Rifa) -> Dict[str, Any]:
+        """
+        Taken bitmap of a rifa sized for `total_boletas` plus an ETag. Loaded
+        rifas are served from Redis and tagged with the inventory version;
+        others (e.g. closed rifas) are built from Postgres and tagged with a
+        hash of the bitmap.
+        """
+        rifa_id = str(rifa.id)
+        size = rifa.total_boletas // 8 + 1
+        snapshot = await self.availability(rifa_id)
+        if snapshot is not None:
+            bitmap, version = snapshot
+            bitmap = bitmap[:size].ljust(size, b"\0")
+            etag = f'"{rifa_id}-{version}"'
+        else:
+            bitmap = pack_numbers(await self._taken_numbers_from_db(db, rifa_id), size)
+            version = None
+            etag = f'"{hashlib.sha1(bitmap).hexdigest()[:20]}"'
+        return {"bitmap": bitmap, "version": version, "etag": etag}
+
+    async def _free_numbers_from_db(self, db: AsyncSession, rifa_id: str) -> List[int]:
+        # Compact rifas have no rows for free numbers; the repository derives them
+        return await TicketRepository().get_available_numbers(db, rifa_id)
+
+    async def _taken_numbers_from_db(self, db: AsyncSession, rifa_id: str) -> List[int]:
+        query = select(Ticket.numero).where(
+            Ticket.rifa_id == rifa_id,
+            Ticket.estado != "disponible"
+        )
+        result = await db.execute(query)
+        return list(result.scalars().all())
+
+    async def rebuild(self, db: AsyncSession, rifa_id: str) -> int:
+        """Reload the free numbers and the taken bitmap of a rifa from the tickets table."""
+        numeros = await self._free_numbers_from_db(db, rifa_id)
+        taken = await self._taken_numbers_from_db(db, rifa_id)
+        free_key = self.free_key(rifa_id)
+        taken_key = self.taken_key(rifa_id)
+
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(free_key, taken_key)
+        for start in range(0, len(numeros), REBUILD_CHUNK_SIZE):
+            chunk = numeros[start:start + REBUILD_CHUNK_SIZE]
+            pipe.zadd(free_key, {numero: numero for numero in chunk})
+        for numero in taken:
+            pipe.setbit(taken_key, numero, 1)
+        pipe.incr(self.version_key(rifa_id))
+        pipe.set(self.ready_key(rifa_id), 1)
+        await pipe.execute()
+        return len(numeros)
+
+    async def rebuild_active(self, db: AsyncSession, force: bool = False) -> Dict[str, int]:
+        """
+        Load the inventory of every active rifa (used on startup).
+        Rifas already loaded by another worker are skipped unless `force` is set.
+        """
+        result = await db.execute(select(Rifa.id).where(Rifa.estado == "activa"))
+        loaded = {}
+        for rifa_id in result.scalars().all():
+            rifa_id = str(rifa_id)
+            if not force and await self.redis.exists(self.ready_key(rifa_id)):
+                continue
+            if not await self._is_active(db, rifa_id):
+                continue
+            loaded[rifa_id] = await self.rebuild(db, rifa_id)
+        return loaded
+
+    async def check_active(self, db: AsyncSession, repair: bool = False) -> List[Dict[str, Any]]:
+        result = await db.execute(select(Rifa.id).where(Rifa.estado == "activa"))
+        reports = []
+        for rifa_id in result.scalars().all():
+            rifa_id = str(rifa_id)
+            if not await self._is_active(db, rifa_id):
+                # Closed or cancelled meanwhile: a repair must not bring its dropped inventory back
+                if repair:
+                    await self.drop(rifa_id)
+                continue
+            reports.append(await self.check_consistency(db, rifa_id, repair=repair))
+        return reports
+
+    async def _is_active(self, db: AsyncSession, rifa_id: str) -> bool:
+        # Checked again right before each rifa, since a sweep over every rifa takes a while
+        result = await db.execute(select(Rifa.estado).where(Rifa.id == rifa_id))
+        return result.scalar_one_or_none() == "activa"
+
+    async def check_consistency(self, db: AsyncSession, rifa_id: str, repair: bool = False) -> Dict[str, Any]:
+        """
+        Compare the Redis free set with the `disponible` tickets in Postgres.
+
+        Numbers claimed by purchases in flight are still free in Postgres, so a
+        missing number is only put back once it was already missing on the
+        previous check. Extra numbers (free in Redis, taken in Postgres) are
+        always safe to remove.
+        """
+        db_numbers = set(await self._free_numbers_from_db(db, rifa_id))
+        loaded = bool(await self.redis.exists(self.ready_key(rifa_id)))
+        redis_numbers = set()
+        if loaded:
+            members = await self.redis.zrange(self.free_key(rifa_id), 0, -1)
+            redis_numbers = {int(numero) for numero in members}
+
+        missing = db_numbers - redis_numbers
+        extra = redis_numbers - db_numbers
+        report = {
+            "rifa_id": rifa_id,
+            "loaded": loaded,
+            "missing": sorted(missing),
+            "extra": sorted(extra),
+            "consistent": loaded and not missing and not extra,
+        }
+
+        if repair and not report["consistent"]:
+            if not loaded:
+                await self.rebuild(db, rifa_id)
+            else:
+                suspects_key = self.suspects_key(rifa_id)
+                previous = {int(numero) for numero in await self.redis.smembers(suspects_key)}
+                persistent = sorted(missing & previous)
+                pipe = self.redis.pipeline(transaction=True)
+                if extra:
+                    pipe.zrem(self.free_key(rifa_id), *extra)
+                    for numero in extra:
+                        pipe.setbit(self.taken_key(rifa_id), numero, 1)
+                if persistent:
+                    pipe.zadd(self.free_key(rifa_id), {numero: numero for numero in persistent})
+                    for numero in persistent:
+                        pipe.setbit(self.taken_key(rifa_id), numero, 0)
+                if extra or persistent:
+                    pipe.incr(self.version_key(rifa_id))
+                pipe.delete(suspects_key)
+                pending = missing - previous
+                if pending:
+                    pipe.sadd(suspects_key, *pending)
+                    pipe.expire(suspects_key, SUSPECTS_TTL_SECONDS)
+                await pipe.execute()
+            report["repaired"] = True
+        return report
@@ -0,0 +1,67 @@
+from datetime import date, datetime
+from typing import List, Dict, Any
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.partitions import (
+    TRANSACCIONES_DEFAULT_PARTITION, add_months, month_start, transacciones_partition_ddl, transacciones_partition_name
+)
+
+
+class PartitionMaintenanceService:
+    """Creates the coming months of transacciones and detaches the expired ones. The caller commits."""
+
+    async def _attached_months(self, db: AsyncSession) -> Dict[date, str]:
+        result = await db.execute(text("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'transacciones'::regclass
+        """))
+        months = {}
+        for name in result.scalars().all():
+            if name != TRANSACCIONES_DEFAULT_PARTITION:
+                year, month = name.rsplit("_", 2)[1:]
+                months[date(int(year), int(month), 1)] = name
+        return months
+
+    async def create_upcoming(self, db: AsyncSession, now: datetime) -> List[str]:
+        """Make sure this month and the next `transacciones_partitions_ahead_months` have a partition."""
+        attached = await self._attached_months(db)
+        created = []
+        current = month_start(now)
+        for offset in range(settings.transacciones_partitions_ahead_months + 1):
+            month = add_months(current, offset)
+            if month not in attached:
+                await db.execute(text(transacciones_partition_ddl(month)))
+                created.append(transacciones_partition_name(month))
+        return created
+
+    async def detach_expired(self, db: AsyncSession, now: datetime) -> List[str]:
+        """
+        Detach the months older than `transacciones_retention_months` (0 keeps
+        everything). Detached partitions stay as plain tables for archiving;
+        their idempotency keys are forgotten.
+        """
+        if settings.transacciones_retention_months <= 0:
+            return []
+        cutoff = add_months(month_start(now), -settings.transacciones_retention_months)
+        detached = []
+        for month, name in sorted((await self._attached_months(db)).items()):
+            if month >= cutoff:
+                break
+            await db.execute(text(f"ALTER TABLE transacciones DETACH PARTITION {name}"))
+            detached.append(name)
+        if detached:
+            await db.execute(
+                text("DELETE FROM transaccion_claves WHERE created_at < :cutoff"), {"cutoff": cutoff}
+            )
+        return detached
+
+    async def run(self, db: AsyncSession, now: datetime = None) -> Dict[str, Any]:
+        now = now or datetime.utcnow()
+        return {
+            "created": await self.create_upcoming(db, now),
+            "detached": await self.detach_expired(db, now),
+        }
@@ -0,0 +1,66 @@
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.repositories.ganador_repository import GanadorRepository
+from app.repositories.transaccion_repository import TransaccionRepository
+
+
+class PayoutService:
+    """
+    Pays unpaid winners in batches of `payout_batch_size`. Each batch is one
+    locked query (winners joined to their ticket and purchase), one bulk
+    INSERT of payout transactions and one bulk UPDATE of the winners, all in
+    one transaction, so a crash never leaves a winner paid without a record
+    or the other way round.
+    """
+
+    def __init__(self):
+        self.ganador_repo = GanadorRepository()
+        self.transaccion_repo = TransaccionRepository()
+
+    def _payout_reference(self, ganador_id) -> str:
+        # Create Stripe payout (simplified - in real implementation, use proper Stripe Connect)
+        return f"payout_{ganador_id}"
+
+    async def process_pending(self, db: AsyncSession, rifa_id: Optional[str] = None) -> Dict[str, Any]:
+        results = {"processed_payments": 0, "total_amount": 0, "batches": 0, "errors": []}
+        after_id = None
+        while True:
+            winners = await self.ganador_repo.get_unpaid_batch(db, settings.payout_batch_size, after_id, rifa_id)
+            if not winners:
+                break
+            after_id = winners[-1].id
+
+            paid_at = datetime.utcnow()
+            payments, transactions = [], []
+            for winner in winners:
+                reference = self._payout_reference(winner.id)
+                payments.append({"id": winner.id, "fecha_pago": paid_at, "referencia_pago": reference})
+                transactions.append({
+                    "user_id": winner.usuario_id,
+                    "amount": winner.monto_ganado,
+                    "currency": "COP",
+                    "provider": "stripe",
+                    "provider_ref": reference,
+                    # One payout per winner, enforced by transaccion_claves
+                    "idempotency_key": f"payout-{winner.id}",
+                    "status": "succeeded",
+                })
+
+            try:
+                await self.transaccion_repo.bulk_create(db, transactions)
+                await self.ganador_repo.mark_paid(db, payments)
+                await db.commit()
+            except Exception as e:
+                # The batch is rolled back as a whole and retried by the next run
+                await db.rollback()
+                results["errors"].append({"first_winner_id": str(winners[0].id), "count": len(winners), "error": str(e)})
+                continue
+
+            results["batches"] += 1
+            results["processed_payments"] += len(winners)
+            results["total_amount"] += sum(winner.monto_ganado for winner in winners)
+        return results
@@ -1,113 +1,437 @@
-import stripe
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Callable, Awaitable, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import func
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
 
 from app.core.config import settings
+from app.db.session import mark_recent_write
+from app.integrations.payments.stripe_client import get_stripe_client, PaymentError, PaymentUnreachableError
 from app.models.ticket import Ticket
 from app.models.transaccion import Transaccion
 from app.models.rifa import Rifa
 from app.repositories.ticket_repository import TicketRepository
 from app.repositories.rifa_repository import RifaRepository
+from app.repositories.rifa_counter_repository import RifaCounterRepository
 from app.repositories.transaccion_repository import TransaccionRepository
-from app.schemas.ticket import TicketPurchase, TicketPurchaseResponse
+from app.schemas.ticket import TicketPurchase, TicketPurchaseResponse, CartCheckout
+from app.services.allocation_service import AllocationRequest, get_allocator
+from app.services.idempotency_service import IdempotencyStore
+from app.services.inventory_service import TicketInventoryService, NumbersUnavailableError, SUGGESTIONS_PER_NUMBER
+
+# PaymentIntent statuses of a charge that may still succeed
+PAYMENT_PENDING_STATUSES = {"processing", "requires_capture"}
 
 
 class PurchaseService:
+    """
+    Purchases run in three steps so no row lock is held during payment:
+    reserve tickets in a short transaction (hold with a TTL), charge the
+    payment with no transaction open, then sell or release the held tickets
+    in a second short transaction. Holds abandoned by crashed requests are
+    released by the `release_expired_holds` task.
+    """
+
     def __init__(self):
         self.ticket_repo = TicketRepository()
         self.rifa_repo = RifaRepository()
         self.transaccion_repo = TransaccionRepository()
-        stripe.api_key = settings.stripe_secret_key
+        self.counter_repo = RifaCounterRepository()
+        self.inventory = TicketInventoryService()
+        self.payments = get_stripe_client()
+        self.idempotency = IdempotencyStore()
 
     async def purchase_tickets(self, db: AsyncSession, purchase: TicketPurchase, user_id: str) -> TicketPurchaseResponse:
+        items = [(str(purchase.rifa_id), purchase.quantity)]
+        numeros = {str(purchase.rifa_id): purchase.numeros} if purchase.numeros is not None else None
+        return await self._idempotent(
+            purchase.idempotency_key, user_id,
+            lambda: self._purchase(db, user_id, purchase.idempotency_key, items, numeros)
+        )
+
+    async def checkout_cart(self, db: AsyncSession, cart: CartCheckout, user_id: str) -> TicketPurchaseResponse:
+        """Buy tickets of several rifas with a single payment and a single transaction record."""
+        quantities: Dict[str, int] = {}
+        for item in cart.items:
+            quantities[str(item.rifa_id)] = quantities.get(str(item.rifa_id), 0) + item.quantity
+        # Claiming rifas in a fixed order keeps concurrent carts from deadlocking
+        items = sorted(quantities.items())
+        return await self._idempotent(
+            cart.idempotency_key, user_id,
+            lambda: self._purchase(db, user_id, cart.idempotency_key, items)
+        )
+
+    async def _idempotent(self, key: str, user_id: str, run: Callable[[], Awaitable[TicketPurchaseResponse]]) -> TicketPurchaseResponse:
+        # Fast path: a previous request with this key already finished
+        cached = await self.idempotency.get_response(key)
+        if cached:
+            return self._cached_response(cached, user_id)
+
+        token = await self.idempotency.begin(key)
+        if token is None:
+            # A request with this key is in flight: wait for its result instead of racing it
+            cached = await self.idempotency.wait_for_response(key)
+            if cached:
+                return self._cached_response(cached, user_id)
+            token = await self.idempotency.begin(key)
+            if token is None:
+                raise ValueError("Purchase with this idempotency key is still processing")
+
+        try:
+            response = await run()
+        except Exception:
+            await self.idempotency.release(key, token)
+            raise
+        await self.idempotency.complete(key, token, {
+            "user_id": user_id,
+            "response": response.model_dump(mode="json")
+        })
+        return response
+
+    async def _purchase(
+        self, db: AsyncSession, user_id: str, idempotency_key: str, items: List[Tuple[str, int]],
+        numeros: Optional[Dict[str, List[int]]] = None
+    ) -> TicketPurchaseResponse:
         transaction = None
         try:
             # Check idempotency
-            existing_transaction = await self.transaccion_repo.get_by_idempotency_key(db, purchase.idempotency_key)
+            existing_transaction = await self.transaccion_repo.get_by_idempotency_key(db, idempotency_key)
             if existing_transaction:
                 # Return existing purchase result
-                tickets = await self.ticket_repo.get_tickets_by_user(db, user_id)
-                return TicketPurchaseResponse(tickets=tickets, transaccion_id=existing_transaction.id)
+                return await self._existing_purchase_response(db, existing_transaction, user_id)
 
-            # Verify rifa is active
-            rifa = await self.rifa_repo.get_active_rifa(db, str(purchase.rifa_id))
-            if not rifa:
-                raise ValueError("Rifa not found or not active")
+            if not items:
+                raise ValueError("Cart is empty")
+            if any(quantity <= 0 for _, quantity in items):
+                raise ValueError("Quantity must be positive")
 
-            # Start database transaction
-            async with db.begin():
+            # Verify rifas are active
+            rifa_ids = [rifa_id for rifa_id, _ in items]
+            active_rifas = await self.rifa_repo.get_active_rifas(db, rifa_ids)
+            if len(active_rifas) < len(rifa_ids):
+                raise ValueError("Rifa not found or not active")
+            if numeros:
+                self._validate_numbers(active_rifas, dict(items), numeros)
 
-                # Check available tickets with lock
-                available_tickets = await self.ticket_repo.get_available_tickets_with_lock(db, str(purchase.rifa_id), purchase.quantity)
-                if len(available_tickets) < purchase.quantity:
-                    raise ValueError("Not enough tickets available")
+            total_quantity = sum(quantity for _, quantity in items)
 
-                # Calculate total amount (assuming fixed price per ticket)
-                ticket_price = 1000  # COP
-                total_amount = len(available_tickets) * ticket_price
+            # Phase 1: hold the tickets; the charge is the price of the tickets held
+            transaction = await self._reserve(db, user_id, idempotency_key, items, numeros)
+            transaction_id = str(transaction.id)
+            total_amount = transaction.amount
 
-                # Process payment with Stripe (sandbox mode)
-                payment_intent = stripe.PaymentIntent.create(
+            # Phase 2: process payment with Stripe (sandbox mode) outside any transaction
+            try:
+                payment_intent = await self.payments.create_payment_intent(
                     amount=total_amount,
                     currency="cop",
                     metadata={
-                        "rifa_id": str(purchase.rifa_id),
+                        "rifa_id": ",".join(rifa_ids),
                         "user_id": user_id,
-                        "quantity": purchase.quantity,
-                        "idempotency_key": purchase.idempotency_key
-                    }
+                        "quantity": total_quantity,
+                        "idempotency_key": idempotency_key,
+                        "transaccion_id": transaction_id
+                    },
+                    idempotency_key=idempotency_key
                 )
+            except PaymentError:
+                await self._release(db, transaction_id)
+                raise
 
-                # Create transaction record
-                transaction = Transaccion(
-                    user_id=user_id,
-                    amount=total_amount,
-                    currency="COP",
-                    provider="stripe",
-                    provider_ref=payment_intent.id,
-                    idempotency_key=purchase.idempotency_key,
-                    status="pending"
-                )
-                db.add(transaction)
-                await db.flush()  # Get transaction ID without committing
-
-                # Update tickets
-                ticket_ids = [str(ticket.id) for ticket in available_tickets]
-                now = datetime.utcnow()
-
-                await self.ticket_repo.bulk_update_tickets(db, ticket_ids, {
-                    "usuario_id": user_id,
-                    "estado": "vendido",
-                    "comprado_en": now,
-                    "transaccion_id": str(transaction.id)
-                })
-
-                # Confirm payment
-                stripe.PaymentIntent.confirm(payment_intent.id)
-
-                # Update transaction status
-                transaction.status = "succeeded"
-                await db.commit()
-
-            # Refresh tickets
-            updated_tickets = await self.ticket_repo.get_tickets_by_user(db, user_id, limit=purchase.quantity)
-
-            return TicketPurchaseResponse(
-                tickets=updated_tickets,
-                transaccion_id=transaction.id
-            )
-
-        except stripe.error.StripeError as e:
-            # Update transaction status to failed
-            if transaction:
-                transaction.status = "failed"
-                await db.commit()
+            # Recorded before charging, so a charge with an unknown outcome can be looked up later
+            transaction.provider_ref = payment_intent["id"]
+            await db.commit()
+            await self._confirm(db, transaction_id, payment_intent["id"], idempotency_key)
+
+            # Phase 3: sell the held tickets
+            sold_tickets = await self._finalize(db, transaction_id, payment_intent["id"], total_quantity)
+            if not sold_tickets:
+                raise ValueError("Ticket reservation expired before payment completed")
+
+            return TicketPurchaseResponse(tickets=sold_tickets, transaccion_id=transaction.id)
+
+        except NumbersUnavailableError:
+            raise
+        except PaymentError as e:
             raise ValueError(f"Payment failed: {str(e)}")
         except Exception as e:
-            if transaction:
-                transaction.status = "failed"
-                await db.commit()
-            raise ValueError(f"Purchase failed: {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Purchase failed: {str(e)}")
+        finally:
+            if transaction is not None:
+                # The buyer's next reads must see these tickets, replicas may still lag
+                await mark_recent_write(user_id)
+
+    @staticmethod
+    def _validate_numbers(rifas: List[Rifa], quantities: Dict[str, int], numeros: Dict[str, List[int]]) -> None:
+        for rifa in rifas:
+            chosen = numeros.get(str(rifa.id))
+            if chosen is None:
+                continue
+            if len(chosen) != quantities[str(rifa.id)]:
+                raise ValueError("Quantity must match the chosen numbers")
+            if len(set(chosen)) != len(chosen):
+                raise ValueError("Chosen numbers must not repeat")
+            if any(numero < 1 or numero > rifa.total_boletas for numero in chosen):
+                raise ValueError(f"Numbers must be between 1 and {rifa.total_boletas}")
+
+    @staticmethod
+    def _cached_response(cached: Dict[str, Any], user_id: str) -> TicketPurchaseResponse:
+        if cached["user_id"] != user_id:
+            raise ValueError("Idempotency key already used")
+        return TicketPurchaseResponse.model_validate(cached["response"])
+
+    async def _existing_purchase_response(self, db: AsyncSession, transaction: Transaccion, user_id: str) -> TicketPurchaseResponse:
+        """Rebuild the response of an earlier purchase from the exact tickets it bought."""
+        if str(transaction.user_id) != user_id:
+            raise ValueError("Idempotency key already used")
+        if transaction.status != "succeeded":
+            raise ValueError(f"Previous purchase with this idempotency key is {transaction.status}")
+        tickets = await self.ticket_repo.get_tickets_by_transaction(db, str(transaction.id))
+        return TicketPurchaseResponse(tickets=tickets, transaccion_id=transaction.id)
+
+    async def _claim(self, db: AsyncSession, rifa_id: str, quantity: int, updates: Dict[str, Any], numeros: Optional[List[int]] = None) -> List[Ticket]:
+        """Claim `quantity` free tickets of a rifa with `updates` applied. The caller commits."""
+        if numeros is not None:
+            return await self._claim_numbers(db, rifa_id, numeros, updates)
+
+        claimed_numbers = None
+        if settings.ticket_inventory_enabled:
+            claimed_numbers = await self.inventory.claim(rifa_id, quantity)
+
+        if claimed_numbers is None:
+            # Inventory not loaded: the lowest free tickets straight from Postgres
+            tickets = await self.ticket_repo.claim_next_available(db, rifa_id, quantity, updates)
+            if len(tickets) < quantity:
+                raise ValueError("Not enough tickets available")
+            return tickets
+
+        try:
+            # Single bulk write; numbers taken behind the inventory's back are dropped from it
+            tickets = await self.ticket_repo.claim_available_tickets(db, rifa_id, claimed_numbers, updates)
+        except Exception:
+            await self.inventory.release(rifa_id, claimed_numbers)
+            raise
+        if len(tickets) < quantity:
+            # The caller rolls back, so the numbers claimed here become free again
+            await self.inventory.release(rifa_id, [ticket.numero for ticket in tickets])
+            raise ValueError("Not enough tickets available")
+        return tickets
+
+    async def _claim_numbers(self, db: AsyncSession, rifa_id: str, numeros: List[int], updates: Dict[str, Any]) -> List[Ticket]:
+        """Claim exactly the chosen numbers, or raise NumbersUnavailableError with nearby free ones."""
+        claimed_numbers = None
+        if settings.ticket_inventory_enabled:
+            # Conflicts are found in the bitmap, one bit per number, before touching Postgres
+            claimed_numbers = await self.inventory.claim_numbers(rifa_id, numeros)
+
+        try:
+            tickets = await self.ticket_repo.claim_available_tickets(db, rifa_id, numeros, updates)
+        except Exception:
+            if claimed_numbers is not None:
+                await self.inventory.release(rifa_id, claimed_numbers)
+            raise
+        if len(tickets) == len(numeros):
+            return tickets
+
+        unavailable = sorted(set(numeros) - {ticket.numero for ticket in tickets})
+        if claimed_numbers is None:
+            suggestions = set()
+            for numero in unavailable:
+                suggestions.update(await self.ticket_repo.get_nearest_available_numbers(
+                    db, rifa_id, numero, SUGGESTIONS_PER_NUMBER, exclude=numeros
+                ))
+            raise NumbersUnavailableError(unavailable, sorted(suggestions))
+
+        # Stale inventory: the caller rolls back, so only the numbers claimed here become free again
+        await self.inventory.release(rifa_id, [ticket.numero for ticket in tickets])
+        raise NumbersUnavailableError(unavailable, await self.inventory.nearest_free(rifa_id, unavailable, exclude=numeros))
+
+    async def _reserve(
+        self, db: AsyncSession, user_id: str, idempotency_key: str, items: List[Tuple[str, int]],
+        numeros: Optional[Dict[str, List[int]]] = None
+    ) -> Transaccion:
+        numeros = numeros or {}
+        # Chosen numbers bypass the batched allocators, which hand out the lowest free numbers
+        if settings.allocation_mode != "off" and not numeros:
+            return await self._reserve_batched(db, user_id, idempotency_key, items)
+
+        # Create transaction record; its amount is known once the tickets are held
+        transaction = Transaccion(
+            user_id=user_id,
+            amount=0,
+            currency="COP",
+            provider="stripe",
+            idempotency_key=idempotency_key,
+            status="pending"
+        )
+        db.add(transaction)
+        claimed: List[Ticket] = []
+        try:
+            await db.flush()  # Get transaction ID without committing
+
+            updates = {
+                "usuario_id": user_id,
+                "estado": "reservado",
+                "transaccion_id": str(transaction.id),
+                "reservado_hasta": datetime.utcnow() + timedelta(seconds=settings.ticket_hold_ttl_seconds)
+            }
+            for rifa_id, quantity in items:
+                claimed.extend(await self._claim(db, rifa_id, quantity, updates, numeros.get(rifa_id)))
+            await self.counter_repo.apply_transition(db, claimed, "disponible", "reservado")
+            transaction.amount = self._held_amount(claimed)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            # Numbers of rifas already claimed in this cart go back to their inventories
+            await self._return_to_inventory(claimed)
+            raise
+        return transaction
+
+    async def _reserve_batched(self, db: AsyncSession, user_id: str, idempotency_key: str, items: List[Tuple[str, int]]) -> Transaccion:
+        """
+        Hold tickets through the per-rifa allocators. They write in their own
+        transactions, so the pending transaction is committed first. On failure
+        the holds of a partly allocated cart are released and the transaction is
+        deleted, so the idempotency key can be retried as after a failed _reserve.
+        """
+        transaction = Transaccion(
+            user_id=user_id,
+            amount=0,
+            currency="COP",
+            provider="stripe",
+            idempotency_key=idempotency_key,
+            status="pending"
+        )
+        db.add(transaction)
+        await db.commit()
+
+        transaction_id = str(transaction.id)
+        reservado_hasta = datetime.utcnow() + timedelta(seconds=settings.ticket_hold_ttl_seconds)
+        try:
+            for rifa_id, quantity in items:
+                await get_allocator(rifa_id).allocate(
+                    AllocationRequest(transaction_id, user_id, quantity, reservado_hasta)
+                )
+            held = await self.ticket_repo.get_tickets_by_transaction(db, transaction_id)
+            transaction.amount = self._held_amount(held)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            await self._discard(db, transaction_id, idempotency_key)
+            raise
+        return transaction
+
+    @staticmethod
+    def _held_amount(tickets: List[Ticket]) -> int:
+        """Price of the held tickets, checked before any PaymentIntent is created."""
+        if any(ticket.precio is None for ticket in tickets):
+            raise ValueError("Tickets have no price, the rifa has no category with a valor_boleta")
+        # Same prices the counters add to recaudo_bruto
+        amount = sum(ticket.precio for ticket in tickets)
+        if amount <= 0:
+            raise ValueError("Purchase amount must be positive")
+        return amount
+
+    async def _confirm(self, db: AsyncSession, transaction_id: str, payment_intent_id: str, idempotency_key: str) -> None:
+        """Charge the PaymentIntent. The hold is released only when the charge certainly did not go through."""
+        try:
+            await self.payments.confirm_payment_intent(payment_intent_id, idempotency_key=f"confirm-{idempotency_key}")
+        except PaymentUnreachableError:
+            # The confirmation may have reached Stripe before the connection dropped
+            status = await self._payment_status(payment_intent_id)
+            if status == "succeeded":
+                return
+            if status is not None and status not in PAYMENT_PENDING_STATUSES:
+                await self._release(db, transaction_id)
+            # Otherwise the tickets stay held and release_expired_holds settles the payment
+            raise
+        except PaymentError:
+            await self._release(db, transaction_id)
+            raise
+
+    async def _payment_status(self, payment_intent_id: str) -> Optional[str]:
+        """Status of a PaymentIntent, None when Stripe cannot be asked."""
+        try:
+            payment_intent = await self.payments.retrieve_payment_intent(payment_intent_id)
+        except PaymentError:
+            return None
+        return payment_intent.get("status")
+
+    async def _finalize(self, db: AsyncSession, transaction_id: str, provider_ref: str, quantity: int) -> List[Ticket]:
+        sold_tickets = await self.ticket_repo.sell_held_tickets(db, transaction_id, datetime.utcnow())
+        if len(sold_tickets) == quantity:
+            transaction = await self.transaccion_repo.get_by_id(db, transaction_id)
+            transaction.provider_ref = provider_ref
+            transaction.status = "succeeded"
+            await self.counter_repo.apply_transition(db, sold_tickets, "reservado", "vendido")
+            await db.commit()
+            return sold_tickets
+
+        # The hold expired and was (partly) swept while paying: give the money back
+        await db.rollback()
+        await self.payments.create_refund(provider_ref, idempotency_key=f"refund-{transaction_id}")
+        await self._release(db, transaction_id, status="refunded", from_status=("pending", "failed"))
+        return []
+
+    async def _release(self, db: AsyncSession, transaction_id: str, status: str = "failed", from_status=("pending",)) -> None:
+        released = await self.ticket_repo.release_held_tickets(db, transaction_id)
+        await self.transaccion_repo.bulk_update_status(db, [transaction_id], status, from_status=from_status)
+        await self.counter_repo.apply_transition(db, released, "reservado", "disponible")
+        await db.commit()
+        await self._return_to_inventory(released)
+
+    async def _discard(self, db: AsyncSession, transaction_id: str, idempotency_key: str) -> None:
+        """Release the holds of a transaction that never reached payment and delete it."""
+        released = await self.ticket_repo.release_held_tickets(db, transaction_id)
+        await self.transaccion_repo.delete_pending(db, transaction_id, idempotency_key)
+        await self.counter_repo.apply_transition(db, released, "reservado", "disponible")
+        await db.commit()
+        await self._return_to_inventory(released)
+
+    async def _return_to_inventory(self, tickets) -> None:
+        """Put released numbers back into the Redis inventory of their rifas."""
+        numbers_by_rifa: Dict[str, List[int]] = {}
+        for ticket in tickets:
+            numbers_by_rifa.setdefault(str(ticket.rifa_id), []).append(ticket.numero)
+        for rifa_id, numeros in numbers_by_rifa.items():
+            await self.inventory.release(rifa_id, numeros)
+
+    async def release_expired_holds(self, db: AsyncSession) -> Dict[str, Any]:
+        """
+        Release holds whose payment never completed and fail their transactions.
+        A hold whose PaymentIntent was charged anyway (the purchase died after
+        confirming) is refunded instead, and one whose payment is not settled
+        yet is kept for the next sweep.
+        """
+        now = datetime.now(timezone.utc)
+        unsettled: List[str] = []
+        refunded = 0
+        for transaction in await self.transaccion_repo.get_charging_with_expired_holds(db, now):
+            transaction_id = str(transaction.id)
+            status = await self._payment_status(transaction.provider_ref)
+            if status is None or status in PAYMENT_PENDING_STATUSES:
+                unsettled.append(transaction_id)
+            elif status == "succeeded":
+                # Same as a payment that completes after its hold expired: give the money back
+                try:
+                    await self.payments.create_refund(transaction.provider_ref, idempotency_key=f"refund-{transaction_id}")
+                except PaymentError:
+                    unsettled.append(transaction_id)
+                    continue
+                await self._release(db, transaction_id, status="refunded", from_status=("pending", "failed"))
+                refunded += 1
+
+        released = await self.ticket_repo.release_expired_holds(db, now, keep_transactions=unsettled)
+        transaction_ids = list({str(row.transaccion_id) for row in released})
+        if transaction_ids:
+            await self.transaccion_repo.bulk_update_status(db, transaction_ids, "failed")
+        await self.counter_repo.apply_transition(db, released, "reservado", "disponible")
+        await db.commit()
+        await self._return_to_inventory(released)
+
+        return {
+            "released_tickets": len(released),
+            "failed_transactions": len(transaction_ids),
+            "refunded_transactions": refunded,
+            "unsettled_transactions": len(unsettled)
+        }
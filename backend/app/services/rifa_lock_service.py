@@ -0,0 +1,105 @@
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+from uuid import uuid4
+
+from prometheus_client import Counter, Histogram
+
+from app.core.config import settings
+from app.core.redis import get_redis
+
+# Takes the lease if it is free and returns a fencing token greater than any
+# given before for the rifa (0 when the lease is taken). The token never goes
+# below the Redis clock in microseconds, so it keeps growing after the
+# counter expires or Redis loses it.
+ACQUIRE_SCRIPT = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 0
+end
+local now = redis.call('TIME')
+local floor = now[1] .. string.format('%06d', tonumber(now[2]))
+local fencing = redis.call('INCR', KEYS[2])
+if fencing <= tonumber(floor) then
+    redis.call('SET', KEYS[2], floor)
+    fencing = redis.call('INCR', KEYS[2])
+end
+redis.call('PEXPIRE', KEYS[2], ARGV[2])
+return fencing
+"""
+
+# Deletes the lease only if it still belongs to the caller
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Exported on the app's /metrics endpoint (default Prometheus registry)
+RIFA_LOCK_ACQUIRED = Counter(
+    "rifa_lock_acquired_total",
+    "Close/recalculate operations that took the rifa lock",
+    ["operation"]
+)
+RIFA_LOCK_CONTENDED = Counter(
+    "rifa_lock_contended_total",
+    "Close/recalculate operations that found the rifa locked and gave up",
+    ["operation"]
+)
+RIFA_LOCK_FENCED = Counter(
+    "rifa_lock_fenced_total",
+    "Lock holders rejected because a newer holder had already written",
+    ["operation"]
+)
+RIFA_LOCK_HELD_SECONDS = Histogram(
+    "rifa_lock_held_seconds",
+    "How long close/recalculate operations held the rifa lock",
+    ["operation"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+
+
+class RifaLockedError(Exception):
+    """Another operation is closing or recalculating the rifa."""
+
+
+class RifaLock:
+    """
+    Redis lease serializing the operations that close or recalculate a rifa
+    (HTTP endpoints, close_rifa and close_rifa_at tasks). A second operation
+    on the same rifa does not wait: it gives up at once. Each holder gets a
+    fencing token that the closing transaction records on the rifa row (see
+    RifaRepository.fence_closing), so a holder whose lease expired midway is
+    rejected by the database instead of writing over the next one.
+    """
+
+    def __init__(self, redis=None):
+        self.redis = redis or get_redis()
+        self.ttl_ms = int(settings.rifa_lock_ttl_seconds * 1000)
+        self._acquire = self.redis.register_script(ACQUIRE_SCRIPT)
+        self._release = self.redis.register_script(RELEASE_SCRIPT)
+
+    def lock_key(self, rifa_id: str) -> str:
+        return f"rifa:{{{rifa_id}}}:cierre"
+
+    def fencing_key(self, rifa_id: str) -> str:
+        return f"rifa:{{{rifa_id}}}:cierre:fencing"
+
+    @asynccontextmanager
+    async def hold(self, rifa_id: str, operation: str) -> AsyncIterator[int]:
+        """Hold the rifa's lease, yielding its fencing token. Raises RifaLockedError if it is taken."""
+        token = str(uuid4())
+        fencing: Optional[int] = await self._acquire(
+            keys=[self.lock_key(rifa_id), self.fencing_key(rifa_id)], args=[token, self.ttl_ms]
+        )
+        if not fencing:
+            RIFA_LOCK_CONTENDED.labels(operation=operation).inc()
+            raise RifaLockedError("Rifa is being closed or recalculated by another operation")
+
+        RIFA_LOCK_ACQUIRED.labels(operation=operation).inc()
+        start = time.perf_counter()
+        try:
+            yield int(fencing)
+        finally:
+            RIFA_LOCK_HELD_SECONDS.labels(operation=operation).observe(time.perf_counter() - start)
+            await self._release(keys=[self.lock_key(rifa_id)], args=[token])
@@ -1,20 +1,86 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
 import random
-from typing import List, Dict, Any
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, List, Dict, Any, Optional, Tuple
 from fastapi import HTTPException
+from redis.exceptions import RedisError
 
+from app.core.config import settings
+
+from app.models.categoria import Categoria
 from app.models.rifa import Rifa
 from app.models.ticket import Ticket
-from app.models.ganador import Ganador
+from app.repositories.ganador_repository import GanadorRepository
+from app.repositories.rifa_repository import RifaRepository
+from app.repositories.ticket_repository import TicketRepository
+from app.repositories.rifa_counter_repository import lock_statement, recompute_statement
+from app.services.inventory_service import TicketInventoryService
+from app.services.rifa_lock_service import RIFA_LOCK_FENCED, RifaLock, RifaLockedError
 
+# Tickets that can win a lottery draw ("ganador" again when closing is retried)
+WINNING_STATES = ["vendido", "ganador"]
+
+
+def ticket_number(winning_number: str) -> Optional[int]:
+    """The ticket number whose 5-digit zero-padded form is `winning_number`, if there is one."""
+    if not winning_number.isdigit():
+        return None
+    numero = int(winning_number)
+    return numero if str(numero).zfill(5) == winning_number else None
+
+
+def closing_token(fecha_fin: datetime) -> str:
+    """The fecha_fin a closing was scheduled for, in UTC: rescheduling a rifa makes older closings stale."""
+    if fecha_fin.tzinfo is None:
+        fecha_fin = fecha_fin.replace(tzinfo=timezone.utc)
+    return fecha_fin.astimezone(timezone.utc).isoformat()
+
+
+def closing_eta(fecha_fin: datetime, now: Optional[datetime] = None) -> datetime:
+    """
+    When a scheduled closing should run: at fecha_fin, or sooner for distant
+    dates. Messages waiting longer than the Redis broker's visibility timeout
+    are delivered again, so far closings wake up and schedule themselves anew.
+    """
+    now = now or datetime.now(timezone.utc)
+    return min(datetime.fromisoformat(closing_token(fecha_fin)), now + timedelta(seconds=settings.rifa_closing_max_eta_seconds))
 
-class RifaService:
-    def __init__(self, db: Session):
-        self.db = db
 
-    def close_rifa(self, rifa_id: str) -> Dict[str, Any]:
-        rifa = self.db.query(Rifa).filter(Rifa.id == rifa_id).first()
+class RifaService:
+    def __init__(self, lock: RifaLock = None):
+        self.rifa_repo = RifaRepository()
+        self.ticket_repo = TicketRepository()
+        self.ganador_repo = GanadorRepository()
+        self.lock = lock or RifaLock()
+        self.inventory = TicketInventoryService()
+
+    @asynccontextmanager
+    async def locked(self, db: AsyncSession, rifa_id: str, operation: str) -> AsyncIterator[None]:
+        """
+        Hold the rifa's close/recalculate lock and fence the current
+        transaction with its token. Raises RifaLockedError, without waiting,
+        when another operation holds the lock or has written since.
+        """
+        async with self.lock.hold(rifa_id, operation) as fencing_token:
+            if not await self.rifa_repo.fence_closing(db, rifa_id, fencing_token):
+                await db.rollback()
+                RIFA_LOCK_FENCED.labels(operation=operation).inc()
+                raise RifaLockedError("Rifa was closed or recalculated by a newer operation")
+            # Anything loaded before the lock may have changed: reload it
+            db.expire_all()
+            yield
+
+    async def close_rifa(self, db: AsyncSession, rifa_id: str) -> Dict[str, Any]:
+        try:
+            async with self.locked(db, rifa_id, "close"):
+                return await self._close_rifa(db, rifa_id)
+        except RifaLockedError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    async def _close_rifa(self, db: AsyncSession, rifa_id: str) -> Dict[str, Any]:
+        rifa = await self.rifa_repo.get_by_id(db, rifa_id)
         if rifa is None:
             raise HTTPException(status_code=404, detail="Rifa not found")
 
@@ -22,31 +88,68 @@ class RifaService:
             raise HTTPException(status_code=400, detail="Rifa already closed")
 
         # Select winners
-        sold_tickets = self.db.query(Ticket).filter(
-            and_(Ticket.rifa_id == rifa_id, Ticket.estado == "vendido")
-        ).all()
+        sold_tickets = await self.ticket_repo.get_tickets_by_rifa_and_state(db, rifa_id, "vendido")
 
         if len(sold_tickets) < rifa.numero_ganadores:
             raise HTTPException(status_code=400, detail="Not enough tickets sold")
 
         winners = random.sample(sold_tickets, rifa.numero_ganadores)
-
-        for i, ticket in enumerate(winners):
-            ticket.estado = "ganador"
-            ganador = Ganador(
-                rifa_id=rifa_id,
-                ticket_id=ticket.id,
-                usuario_id=ticket.usuario_id,
-                posicion=i + 1
-            )
-            self.db.add(ganador)
+        await self._award(db, rifa, winners)
 
         rifa.estado = "cerrada"
-        self.db.commit()
+        await self._refresh_counters(db, rifa_id)
+        await db.commit()
+        await self.drop_inventory(rifa_id)
         return {"message": "Rifa closed successfully", "winners": [str(w.id) for w in winners]}
 
-    def recalculate_rifa(self, rifa_id: str) -> Dict[str, Any]:
-        rifa = self.db.query(Rifa).filter(Rifa.id == rifa_id).first()
+    async def close_with_results(self, db: AsyncSession, rifa: Rifa, prizes: Dict[str, Tuple[str, int]]) -> List[Dict[str, Any]]:
+        """
+        Close a rifa against lottery results. `prizes` maps each prize to its
+        winning number and amount. The winning tickets are fetched with one
+        indexed lookup and recorded with one bulk insert, so the cost does
+        not depend on the size of the rifa. Safe to retry; the caller holds
+        the rifa lock (see `locked`).
+        """
+        # A number drawn for several prizes wins the first one listed
+        by_numero: Dict[int, Tuple[str, int]] = {}
+        for prize, (winning_number, monto) in prizes.items():
+            numero = ticket_number(winning_number)
+            if numero is not None:
+                by_numero.setdefault(numero, (prize, monto))
+
+        tickets = []
+        if by_numero:
+            tickets = await self.ticket_repo.get_tickets_by_numbers(db, str(rifa.id), list(by_numero), WINNING_STATES)
+        await self.ganador_repo.insert_winners(db, [
+            {"ticket_id": ticket.id, "rifa_id": ticket.rifa_id, "monto_ganado": by_numero[ticket.numero][1]}
+            for ticket in tickets
+        ])
+        if tickets:
+            await self.ticket_repo.set_tickets_state(db, str(rifa.id), [ticket.id for ticket in tickets], "vendido", "ganador")
+
+        rifa.estado = "cerrada"
+        await self._refresh_counters(db, str(rifa.id))
+        await db.commit()
+        await self.drop_inventory(str(rifa.id))
+        return [
+            {
+                "ticket_id": str(ticket.id),
+                "numero": ticket.numero,
+                "prize": by_numero[ticket.numero][0],
+                "monto_ganado": by_numero[ticket.numero][1]
+            }
+            for ticket in tickets
+        ]
+
+    async def recalculate_rifa(self, db: AsyncSession, rifa_id: str) -> Dict[str, Any]:
+        try:
+            async with self.locked(db, rifa_id, "recalculate"):
+                return await self._recalculate_rifa(db, rifa_id)
+        except RifaLockedError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+
+    async def _recalculate_rifa(self, db: AsyncSession, rifa_id: str) -> Dict[str, Any]:
+        rifa = await self.rifa_repo.get_by_id(db, rifa_id)
         if rifa is None:
             raise HTTPException(status_code=404, detail="Rifa not found")
 
@@ -54,29 +157,42 @@ class RifaService:
             raise HTTPException(status_code=400, detail="Rifa must be closed to recalculate")
 
         # Remove existing winners
-        self.db.query(Ganador).filter(Ganador.rifa_id == rifa_id).delete()
+        await self.ganador_repo.delete_by_rifa(db, rifa_id)
 
         # Reset ticket states
-        self.db.query(Ticket).filter(
-            and_(Ticket.rifa_id == rifa_id, Ticket.estado == "ganador")
-        ).update({"estado": "vendido"})
+        await self.ticket_repo.set_rifa_tickets_state(db, rifa_id, "ganador", "vendido")
 
         # Re-select winners
-        sold_tickets = self.db.query(Ticket).filter(
-            and_(Ticket.rifa_id == rifa_id, Ticket.estado == "vendido")
-        ).all()
+        sold_tickets = await self.ticket_repo.get_tickets_by_rifa_and_state(db, rifa_id, "vendido")
 
         winners = random.sample(sold_tickets, min(rifa.numero_ganadores, len(sold_tickets)))
-
-        for i, ticket in enumerate(winners):
+        await self._award(db, rifa, winners)
+
+        await self._refresh_counters(db, rifa_id)
+        await db.commit()
+        return {"message": "Rifa recalculated successfully", "winners": [str(w.id) for w in winners]}
+
+    async def drop_inventory(self, rifa_id: str) -> None:
+        """Remove the Redis inventory of a rifa that was closed or cancelled, once that is committed."""
+        if not settings.ticket_inventory_enabled:
+            return
+        try:
+            await self.inventory.drop(rifa_id)
+        except RedisError:
+            pass  # the rifa is no longer active in Postgres, which rejects any claim on it
+
+    async def _award(self, db: AsyncSession, rifa: Rifa, winners: List[Ticket]) -> None:
+        # Each winner gets the prize per winner of the rifa's category
+        premio = None
+        if rifa.categoria_id is not None:
+            result = await db.execute(select(Categoria.premio_por_ganador).where(Categoria.id == rifa.categoria_id))
+            premio = result.scalar_one_or_none()
+
+        for ticket in winners:
             ticket.estado = "ganador"
-            ganador = Ganador(
-                rifa_id=rifa_id,
-                ticket_id=ticket.id,
-                usuario_id=ticket.usuario_id,
-                posicion=i + 1
-            )
-            self.db.add(ganador)
-
-        self.db.commit()
-        return {"message": "Rifa recalculated successfully", "winners": [str(w.id) for w in winners]}
\ No newline at end of file
+        self.ganador_repo.add_winners(db, winners, premio or 0)
+
+    async def _refresh_counters(self, db: AsyncSession, rifa_id: str) -> None:
+        # Closing moves tickets between states in bulk: recount this rifa inside the same transaction
+        await db.execute(lock_statement([rifa_id]))
+        await db.execute(recompute_statement([rifa_id]))
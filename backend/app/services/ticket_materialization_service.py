@@ -0,0 +1,66 @@
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.models.categoria import Categoria
+from app.models.rifa import Rifa
+from app.repositories.rifa_repository import RifaRepository
+from app.repositories.rifa_counter_repository import RifaCounterRepository
+from app.repositories.ticket_repository import TicketRepository
+from app.services.inventory_service import TicketInventoryService
+
+MATERIALIZE_CHUNK_SIZE = 100000
+
+
+class TicketMaterializationService:
+    """
+    Creates the `total_boletas` ticket rows of a rifa (numbers 1..N) with
+    set-based INSERT ... SELECT generate_series statements, one short
+    transaction per chunk. Existing numbers are skipped, so running it again
+    (e.g. on activation or after raising `total_boletas`) only adds what is
+    missing.
+
+    Compact rifas get no rows until a number is taken; for them this only
+    brings the counters and the inventory up to `total_boletas`.
+    """
+
+    def __init__(self):
+        self.ticket_repo = TicketRepository()
+        self.rifa_repo = RifaRepository()
+        self.counter_repo = RifaCounterRepository()
+        self.inventory = TicketInventoryService()
+
+    async def _ticket_price(self, db: AsyncSession, rifa: Rifa) -> Optional[int]:
+        if rifa.categoria_id is None:
+            return None
+        result = await db.execute(select(Categoria.valor_boleta).where(Categoria.id == rifa.categoria_id))
+        return result.scalar_one_or_none()
+
+    async def materialize(self, db: AsyncSession, rifa_id: str) -> int:
+        """Create the missing tickets of a rifa. Returns how many were created."""
+        rifa = await self.rifa_repo.get_by_id(db, rifa_id)
+        if rifa is None:
+            raise ValueError("Rifa not found")
+
+        if rifa.almacenamiento == "compacto":
+            await self.counter_repo.recompute(db, rifa_id)
+            await db.commit()
+            if rifa.estado == "activa" and settings.ticket_inventory_enabled:
+                await self.inventory.rebuild(db, rifa_id)
+            return 0
+
+        precio = await self._ticket_price(db, rifa)
+        total = rifa.total_boletas or 0
+        created = 0
+        for first in range(1, total + 1, MATERIALIZE_CHUNK_SIZE):
+            last = min(first + MATERIALIZE_CHUNK_SIZE - 1, total)
+            count = await self.ticket_repo.materialize_tickets(db, rifa_id, first, last, precio)
+            await self.counter_repo.apply_deltas(db, rifa_id, {"disponibles": count})
+            await db.commit()
+            created += count
+
+        # Also when nothing was created: a rifa activated after its tickets exist still needs its inventory
+        if rifa.estado == "activa" and settings.ticket_inventory_enabled:
+            await self.inventory.rebuild(db, rifa_id)
+        return created
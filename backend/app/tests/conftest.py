@@ -1,4 +1,5 @@
 import pytest
+import pytest_asyncio
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
@@ -97,4 +98,57 @@ async def async_client():
     """Create async test client."""
     from httpx import AsyncClient
     async with AsyncClient(app=app, base_url="http://testserver") as client:
-        yield client
\ No newline at end of file
+        yield client
+
+@pytest_asyncio.fixture(scope="function")
+async def redis_client():
+    """Async Redis client against the configured Redis (skips if unreachable)."""
+    from redis import asyncio as aioredis
+    from redis.exceptions import ConnectionError as RedisConnectionError
+
+    client = aioredis.from_url(settings.redis_url)
+    try:
+        await client.ping()
+    except RedisConnectionError:
+        pytest.skip("Redis not available")
+    await client.flushdb()
+    yield client
+    await client.flushdb()
+    await client.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def stripe_client():
+    """StripeClient wired in-process to the local Stripe stub."""
+    import httpx
+    from app.integrations.payments.stripe_client import StripeClient
+    from app.tests.stubs.stripe_stub import app as stripe_stub_app, state
+
+    state.reset()
+    client = StripeClient(
+        api_key="sk_test_stub",
+        base_url="http://stripe-stub",
+        max_retries=2,
+        transport=httpx.ASGITransport(app=stripe_stub_app),
+    )
+    yield client
+    await client.aclose()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def pg_connection():
+    """Connection to the configured, migrated Postgres inside a rolled back transaction (skips if unreachable)."""
+    from sqlalchemy.exc import SQLAlchemyError
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(settings.database_url.replace("postgresql://", "postgresql+asyncpg://"))
+    try:
+        connection = await engine.connect()
+    except (OSError, SQLAlchemyError):
+        await engine.dispose()
+        pytest.skip("Postgres not available")
+    transaction = await connection.begin()
+    yield connection
+    await transaction.rollback()
+    await connection.close()
+    await engine.dispose()
@@ -0,0 +1,134 @@
+"""
+EXPLAIN-based regression tests: every hot repository query must be able to use
+an index. Runs against the configured Postgres after `alembic upgrade head`;
+sequential scans are disabled so the planner picks an index whenever one
+applies, even on near-empty tables.
+"""
+from datetime import datetime
+from typing import List
+from unittest.mock import MagicMock
+from uuid import uuid4
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql
+
+from app.models.ganador import Ganador
+from app.repositories.base import encode_cursor
+from app.repositories.rifa_repository import RifaRepository
+from app.repositories.ticket_repository import TicketRepository
+from app.repositories.transaccion_repository import TransaccionRepository
+
+
+class RecordingSession:
+    """Stands in for AsyncSession and keeps the statements a repository method issues."""
+
+    def __init__(self, compact_rifa=None):
+        # Row the storage mode lookup returns: (total_boletas, valor_boleta) of a compact rifa, or None
+        self.compact_rifa = compact_rifa
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        result = MagicMock()
+        result.scalar_one_or_none.return_value = None
+        result.first.return_value = self.compact_rifa
+        result.rowcount = 0
+        return result
+
+    async def commit(self):
+        pass
+
+
+async def _explain(connection, statement) -> str:
+    sql = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    rows = (await connection.execute(text(f"EXPLAIN {sql}"))).scalars().all()
+    return "\n".join(rows)
+
+
+async def _plans(connection, call, compact_rifa=None) -> List[str]:
+    db = RecordingSession(compact_rifa)
+    await call(db)
+    assert db.statements, "repository method issued no query"
+    return [await _explain(connection, statement) for statement in db.statements]
+
+
+RIFA_ID = str(uuid4())
+TRANSACTION_ID = str(uuid4())
+USER_ID = str(uuid4())
+
+TICKET_QUERIES = {
+    "get_available_tickets": lambda repo, db: repo.get_available_tickets(db, RIFA_ID, limit=5),
+    "get_available_tickets_with_lock": lambda repo, db: repo.get_available_tickets_with_lock(db, RIFA_ID, 5, skip_locked=True),
+    "claim_available_tickets": lambda repo, db: repo.claim_available_tickets(db, RIFA_ID, [1, 2], {"estado": "reservado"}),
+    "get_nearest_available_numbers": lambda repo, db: repo.get_nearest_available_numbers(db, RIFA_ID, 50, 2, exclude=[50]),
+    "sell_held_tickets": lambda repo, db: repo.sell_held_tickets(db, TRANSACTION_ID, datetime.utcnow()),
+    "release_held_tickets": lambda repo, db: repo.release_held_tickets(db, TRANSACTION_ID),
+    "release_expired_holds": lambda repo, db: repo.release_expired_holds(db, datetime.utcnow()),
+    "get_tickets_by_user": lambda repo, db: repo.get_tickets_by_user(db, USER_ID),
+    "get_user_tickets_page": lambda repo, db: repo.get_user_tickets_page(db, USER_ID, encode_cursor([10, uuid4()])),
+    "get_tickets_by_transaction": lambda repo, db: repo.get_tickets_by_transaction(db, TRANSACTION_ID),
+    "get_tickets_by_rifa": lambda repo, db: repo.get_tickets_by_rifa(db, RIFA_ID),
+    "get_next_ticket_number": lambda repo, db: repo.get_next_ticket_number(db, RIFA_ID),
+    "get_tickets_by_numbers": lambda repo, db: repo.get_tickets_by_numbers(db, RIFA_ID, [12345, 67890], ["vendido"]),
+}
+
+# Free numbers of a compact rifa are probed one by one in uq_tickets_rifa_numero
+COMPACT_TICKET_QUERIES = {
+    "get_available_tickets": lambda repo, db: repo.get_available_tickets(db, RIFA_ID, limit=5),
+    "claim_available_tickets": lambda repo, db: repo.claim_available_tickets(db, RIFA_ID, [1, 2], {"estado": "reservado"}),
+    "claim_next_available": lambda repo, db: repo.claim_next_available(db, RIFA_ID, 2, {"estado": "reservado"}),
+    "get_nearest_available_numbers": lambda repo, db: repo.get_nearest_available_numbers(db, RIFA_ID, 50, 2, exclude=[50]),
+}
+
+TRANSACTION_QUERIES = {
+    "get_by_idempotency_key": lambda repo, db: repo.get_by_idempotency_key(db, "key"),
+    "get_user_transactions": lambda repo, db: repo.get_user_transactions(db, USER_ID),
+    "update_transaction_status": lambda repo, db: repo.update_transaction_status(db, "pi_123", "succeeded"),
+    "bulk_update_status": lambda repo, db: repo.bulk_update_status(db, [TRANSACTION_ID], "failed"),
+    "get_charging_with_expired_holds": lambda repo, db: repo.get_charging_with_expired_holds(db, datetime.utcnow()),
+}
+
+
+@pytest.mark.asyncio
+class TestQueryPlans:
+    @pytest_asyncio.fixture(autouse=True)
+    async def _no_seqscan(self, pg_connection):
+        await pg_connection.execute(text("SET LOCAL enable_seqscan = off"))
+
+    @pytest.mark.parametrize("name", sorted(TICKET_QUERIES))
+    async def test_ticket_queries_use_indexes(self, pg_connection, name):
+        """Test ticket repository queries avoid sequential scans."""
+        repo = TicketRepository()
+        for plan in await _plans(pg_connection, lambda db: TICKET_QUERIES[name](repo, db)):
+            assert "Seq Scan" not in plan, plan
+            assert "Index" in plan, plan
+
+    @pytest.mark.parametrize("name", sorted(COMPACT_TICKET_QUERIES))
+    async def test_compact_ticket_queries_use_indexes(self, pg_connection, name):
+        """Test ticket queries of a compact rifa avoid sequential scans."""
+        repo = TicketRepository()
+        call = lambda db: COMPACT_TICKET_QUERIES[name](repo, db)
+        for plan in await _plans(pg_connection, call, compact_rifa=(1000, 5000)):
+            assert "Seq Scan" not in plan, plan
+
+    @pytest.mark.parametrize("name", sorted(TRANSACTION_QUERIES))
+    async def test_transaction_queries_use_indexes(self, pg_connection, name):
+        """Test transaction repository queries avoid sequential scans."""
+        repo = TransaccionRepository()
+        for plan in await _plans(pg_connection, lambda db: TRANSACTION_QUERIES[name](repo, db)):
+            assert "Seq Scan" not in plan, plan
+            assert "Index" in plan, plan
+
+    async def test_rifa_list_pages_by_index(self, pg_connection):
+        """Test a deep page of the rifa list is read from the keyset index."""
+        cursor = encode_cursor([datetime.utcnow(), uuid4()])
+        plans = await _plans(pg_connection, lambda db: RifaRepository().get_rifas_with_counters(db, cursor))
+        assert "ix_rifas_creado_en_id" in plans[0], plans[0]
+
+    async def test_winner_lookup_uses_index(self, pg_connection):
+        """Test looking up winners by ticket uses the ganadores index."""
+        statement = select(Ganador).where(Ganador.ticket_id.in_([str(uuid4())]))
+        plan = await _explain(pg_connection, statement)
+        assert "uq_ganadores_ticket_id" in plan, plan
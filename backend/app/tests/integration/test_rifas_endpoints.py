@@ -199,4 +199,62 @@ class TestRifasEndpoints:
 
             response = await client.post("/api/v1/rifas/non-existent-id/close", headers=headers)
             assert response.status_code == 404
-            assert "Rifa not found" in response.json()["detail"]
\ No newline at end of file
+            assert "Rifa not found" in response.json()["detail"]
+
+    async def test_purchase_chosen_numbers_taken(self, db_session, test_user, test_rifa):
+        """Test buying taken numbers through the rifa endpoint returns 409 with suggestions."""
+        from unittest.mock import AsyncMock, patch
+        from app.services.inventory_service import NumbersUnavailableError
+
+        async with AsyncClient(app=app, base_url="http://testserver") as client:
+            login_data = {"username": test_user.email, "password": "testpass"}
+            login_response = await client.post("/api/v1/auth/login", data=login_data)
+            token = login_response.json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            purchase_data = {
+                "rifa_id": str(test_rifa.id),
+                "quantity": 1,
+                "numeros": [7],
+                "user_id": str(test_user.id),
+                "idempotency_key": "test-rifa-numbers-taken"
+            }
+            taken = NumbersUnavailableError([7], [6, 8])
+            with patch("app.api.v1.endpoints.rifas.PurchaseService.purchase_tickets", AsyncMock(side_effect=taken)):
+                response = await client.post(f"/api/v1/rifas/{test_rifa.id}/tickets", json=purchase_data, headers=headers)
+
+            assert response.status_code == 409
+            detail = response.json()["detail"]
+            assert detail["unavailable"] == [7]
+            assert detail["suggestions"] == [6, 8]
+            assert "message" in detail
+
+    async def test_update_rifa_with_broker_down(self, db_session, test_rifa):
+        """Test a saved rifa is returned even when its closing cannot be scheduled."""
+        from unittest.mock import patch
+        from app.models.user import User
+        from app.core.security import get_password_hash
+
+        operador = User(
+            nombre="Operador Test",
+            email="operador-broker@example.com",
+            telefono="1234567890",
+            hashed_password=get_password_hash("testpass"),
+            rol="operador"
+        )
+        db_session.add(operador)
+        db_session.commit()
+
+        async with AsyncClient(app=app, base_url="http://testserver") as client:
+            login_data = {"username": operador.email, "password": "testpass"}
+            login_response = await client.post("/api/v1/auth/login", data=login_data)
+            token = login_response.json()["access_token"]
+            headers = {"Authorization": f"Bearer {token}"}
+
+            with patch("app.api.v1.endpoints.rifas.celery_app.send_task", side_effect=ConnectionError("broker down")) as send_task:
+                response = await client.put(
+                    f"/api/v1/rifas/{test_rifa.id}", json={"fecha_fin": "2030-01-01T00:00:00+00:00"}, headers=headers
+                )
+
+            assert response.status_code == 200
+            send_task.assert_called_once()
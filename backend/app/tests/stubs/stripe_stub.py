@@ -0,0 +1,120 @@
+"""
+Local stand-in for the Stripe REST API used by StripeClient.
+
+In tests it is mounted in-process with `httpx.ASGITransport(app=app)`; for
+manual runs start it with
+    uvicorn app.tests.stubs.stripe_stub:app --port 12111
+and set STRIPE_API_BASE=http://localhost:12111.
+
+`state` allows injecting latency and failures:
+    state.latency_seconds = 0.5   # delay every response
+    state.fail_next = 2           # next 2 requests return 500
+    state.decline = True          # confirmations fail with card_declined
+"""
+import asyncio
+import json
+from uuid import uuid4
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class StubState:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.latency_seconds = 0.0
+        self.fail_next = 0
+        self.decline = False
+        self.payment_intents = {}
+        self.refunds = {}
+        self.idempotent_responses = {}
+        self.requests = 0
+
+
+state = StubState()
+app = FastAPI(title="Stripe stub")
+
+
+def _error(status_code: int, message: str, code: str = None, error_type: str = "api_error") -> JSONResponse:
+    return JSONResponse(status_code=status_code, content={"error": {"type": error_type, "message": message, "code": code}})
+
+
+async def _handle(request: Request, handler):
+    state.requests += 1
+    if state.latency_seconds:
+        await asyncio.sleep(state.latency_seconds)
+    if state.fail_next:
+        state.fail_next -= 1
+        return _error(500, "Injected failure")
+
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key and idempotency_key in state.idempotent_responses:
+        status_code, content = state.idempotent_responses[idempotency_key]
+        return JSONResponse(status_code=status_code, content=content)
+
+    form = dict(await request.form())
+    response = handler(form)
+    if idempotency_key:
+        state.idempotent_responses[idempotency_key] = (response.status_code, json.loads(response.body))
+    return response
+
+
+@app.post("/v1/payment_intents")
+async def create_payment_intent(request: Request):
+    def handler(form):
+        payment_intent = {
+            "id": f"pi_stub_{uuid4().hex[:16]}",
+            "object": "payment_intent",
+            "amount": int(form["amount"]),
+            "currency": form.get("currency", "cop"),
+            "status": "requires_confirmation",
+            "client_secret": f"secret_{uuid4().hex}",
+            "metadata": {key[9:-1]: value for key, value in form.items() if key.startswith("metadata[")},
+        }
+        state.payment_intents[payment_intent["id"]] = payment_intent
+        return JSONResponse(content=payment_intent)
+
+    return await _handle(request, handler)
+
+
+@app.post("/v1/payment_intents/{payment_intent_id}/confirm")
+async def confirm_payment_intent(payment_intent_id: str, request: Request):
+    def handler(form):
+        payment_intent = state.payment_intents.get(payment_intent_id)
+        if payment_intent is None:
+            return _error(404, f"No such payment_intent: '{payment_intent_id}'", "resource_missing", "invalid_request_error")
+        if state.decline:
+            return _error(402, "Your card was declined.", "card_declined", "card_error")
+        payment_intent["status"] = "succeeded"
+        return JSONResponse(content=payment_intent)
+
+    return await _handle(request, handler)
+
+
+@app.get("/v1/payment_intents/{payment_intent_id}")
+async def retrieve_payment_intent(payment_intent_id: str, request: Request):
+    payment_intent = state.payment_intents.get(payment_intent_id)
+    if payment_intent is None:
+        return _error(404, f"No such payment_intent: '{payment_intent_id}'", "resource_missing", "invalid_request_error")
+    return JSONResponse(content=payment_intent)
+
+
+@app.post("/v1/refunds")
+async def create_refund(request: Request):
+    def handler(form):
+        payment_intent = state.payment_intents.get(form.get("payment_intent"))
+        if payment_intent is None:
+            return _error(404, "No such payment_intent", "resource_missing", "invalid_request_error")
+        refund = {
+            "id": f"re_stub_{uuid4().hex[:16]}",
+            "object": "refund",
+            "payment_intent": payment_intent["id"],
+            "amount": payment_intent["amount"],
+            "status": "succeeded",
+        }
+        state.refunds[refund["id"]] = refund
+        return JSONResponse(content=refund)
+
+    return await _handle(request, handler)
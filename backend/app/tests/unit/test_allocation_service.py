@@ -0,0 +1,137 @@
+import asyncio
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from redis.exceptions import RedisError
+
+from app.repositories.ticket_repository import TicketsTakenError
+from app.services.allocation_service import (
+    AllocationRequest, BatchAllocator, RifaAllocationActor, RedisRifaAllocator
+)
+
+
+def _request(quantity: int, transaction_id: str = "tx") -> AllocationRequest:
+    return AllocationRequest(transaction_id, "user", quantity, datetime.utcnow() + timedelta(minutes=10))
+
+
+class _CompactRifa:
+    """Ticket repository of one compact rifa shared by several allocators: free numbers are read without locks."""
+
+    def __init__(self):
+        self.taken = set()
+        self.reads = asyncio.Event()
+        self.readers = 0
+
+    async def get_available_tickets_with_lock(self, db, rifa_id, limit, skip_locked=False):
+        numeros = [numero for numero in range(1, 101) if numero not in self.taken][:limit]
+        # Both allocators read before either one writes
+        self.readers += 1
+        if self.readers == 2:
+            self.reads.set()
+        await asyncio.wait_for(self.reads.wait(), timeout=1)
+        return [MagicMock(id=None, numero=numero) for numero in numeros]
+
+    async def bulk_hold_tickets(self, db, rifa_id, assignments):
+        numeros = {assignment["numero"] for assignment in assignments}
+        if numeros & self.taken:
+            raise TicketsTakenError("Tickets taken by another purchase, try again")
+        self.taken |= numeros
+
+
+def _session_factory(db):
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+    return lambda: session
+
+
+@pytest.mark.asyncio
+class TestBatchAllocator:
+    async def test_one_query_and_one_update_per_batch(self):
+        """Test a batch is allocated with a single locked query and a single bulk update."""
+        db = AsyncMock()
+        allocator = BatchAllocator("rifa", session_factory=_session_factory(db))
+        allocator.ticket_repo = AsyncMock()
+        allocator.ticket_repo.get_available_tickets_with_lock.return_value = [
+            MagicMock(id=i, numero=i) for i in range(1, 5)
+        ]
+
+        results = await allocator.allocate_batch([_request(2, "a"), _request(3, "b"), _request(2, "c")])
+
+        assert results[0] == [1, 2]
+        assert isinstance(results[1], ValueError)
+        assert results[2] == [3, 4]
+        allocator.ticket_repo.get_available_tickets_with_lock.assert_awaited_once()
+        allocator.ticket_repo.bulk_hold_tickets.assert_awaited_once()
+        assignments = allocator.ticket_repo.bulk_hold_tickets.call_args[0][2]
+        assert [a["transaccion_id"] for a in assignments] == ["a", "a", "c", "c"]
+        db.commit.assert_awaited_once()
+
+    async def test_inventory_outage_keeps_the_held_numbers(self):
+        """Test a Redis error after the batch commit still answers every request with its numbers."""
+        allocator = BatchAllocator("rifa", session_factory=_session_factory(AsyncMock()), inventory=AsyncMock())
+        allocator.ticket_repo = AsyncMock()
+        allocator.counter_repo = AsyncMock()
+        allocator.ticket_repo.get_available_tickets_with_lock.return_value = [MagicMock(id=i, numero=i) for i in range(1, 4)]
+        allocator.inventory.remove.side_effect = RedisError("down")
+
+        results = await allocator.allocate_batch([_request(1, "a"), _request(2, "b")])
+
+        assert results == [[1], [2, 3]]
+
+    async def test_allocators_of_one_compact_rifa_do_not_fail_each_other(self):
+        """Test a batch whose numbers another allocator inserted first is read again instead of failing."""
+        rifa = _CompactRifa()
+        allocators = []
+        for _ in range(2):
+            allocator = BatchAllocator("rifa", session_factory=_session_factory(AsyncMock()))
+            allocator.ticket_repo = rifa
+            allocator.counter_repo = AsyncMock()
+            allocators.append(allocator)
+
+        first, second = await asyncio.gather(*[
+            allocator.allocate_batch([_request(2, name)]) for allocator, name in zip(allocators, "ab")
+        ])
+
+        assert sorted(first + second) == [[1, 2], [3, 4]]
+        assert rifa.taken == {1, 2, 3, 4}
+
+
+@pytest.mark.asyncio
+class TestRifaAllocationActor:
+    async def test_concurrent_requests_are_batched(self):
+        """Test requests arriving together are drained into one batch."""
+        allocator = AsyncMock()
+        allocator.allocate_batch.side_effect = lambda requests: [[i] for i, _ in enumerate(requests)]
+        actor = RifaAllocationActor("rifa", allocator=allocator, max_batch=10)
+
+        results = await asyncio.gather(*[actor.allocate(_request(1)) for _ in range(5)])
+
+        assert sorted(results) == [[0], [1], [2], [3], [4]]
+        allocator.allocate_batch.assert_awaited_once()
+
+    async def test_errors_reach_their_caller(self):
+        """Test a failed request raises in its caller only."""
+        allocator = AsyncMock()
+        allocator.allocate_batch.return_value = [ValueError("Not enough tickets available")]
+        actor = RifaAllocationActor("rifa", allocator=allocator)
+
+        with pytest.raises(ValueError, match="Not enough tickets"):
+            await actor.allocate(_request(1))
+
+
+@pytest.mark.asyncio
+class TestRedisRifaAllocator:
+    async def test_requests_from_several_workers_share_a_batch(self, redis_client):
+        """Test callers on different allocators get replies from a single leader."""
+        allocator = AsyncMock()
+        allocator.allocate_batch.side_effect = lambda requests: [[request.quantity] for request in requests]
+        workers = [RedisRifaAllocator("rifa", redis=redis_client, allocator=allocator) for _ in range(3)]
+
+        results = await asyncio.gather(*[
+            worker.allocate(_request(quantity)) for quantity, worker in enumerate(workers, start=1)
+        ])
+
+        assert results == [[1], [2], [3]]
+        assert not await redis_client.exists(workers[0].leader_key())
@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from sqlalchemy.exc import OperationalError
+
+from app.workers import tasks
+
+
+@pytest.fixture
+def worker_db():
+    db = AsyncMock()
+    session = MagicMock()
+    session.__aenter__ = AsyncMock(return_value=db)
+    session.__aexit__ = AsyncMock(return_value=False)
+    with patch.object(tasks, "worker_session", return_value=session), \
+            patch.object(tasks, "run_async", asyncio.run):
+        yield db
+
+
+class TestCloseRifaTask:
+    def test_lost_connection_is_retried(self, worker_db):
+        """Test a dropped database connection raises so the task is retried."""
+        lost = OperationalError("SELECT 1", {}, ConnectionResetError("connection reset"))
+
+        with patch.object(tasks, "_close_one", AsyncMock(side_effect=lost)), \
+                patch.object(tasks.close_rifa, "retry", side_effect=RuntimeError("retry")) as retry:
+            with pytest.raises(RuntimeError, match="retry"):
+                tasks.close_rifa.run("rifa-1")
+
+        assert retry.call_args.kwargs["exc"] is lost
+        worker_db.rollback.assert_awaited_once()
+
+    def test_other_errors_are_reported(self, worker_db):
+        """Test an error that a retry would not fix is returned for the chord summary."""
+        with patch.object(tasks, "_close_one", AsyncMock(side_effect=ValueError("Rifa has no tickets"))):
+            results = tasks.close_rifa.run("rifa-1")
+
+        assert results == {"closed_rifas": [], "errors": [{"rifa_id": "rifa-1", "error": "Rifa has no tickets"}]}
@@ -0,0 +1,36 @@
+import pytest
+
+from app.services.idempotency_service import IdempotencyStore
+
+
+@pytest.mark.asyncio
+class TestIdempotencyStore:
+    async def test_begin_is_exclusive(self, redis_client):
+        """Test only one request can hold the in-flight marker."""
+        store = IdempotencyStore(redis_client)
+
+        token = await store.begin("key-1")
+        assert token is not None
+        assert await store.begin("key-1") is None
+
+        await store.release("key-1", token)
+        assert await store.begin("key-1") is not None
+
+    async def test_complete_stores_response(self, redis_client):
+        """Test completed responses are served from the store."""
+        store = IdempotencyStore(redis_client)
+
+        token = await store.begin("key-2")
+        await store.complete("key-2", token, {"user_id": "u1", "response": {"tickets": []}})
+
+        assert await store.get_response("key-2") == {"user_id": "u1", "response": {"tickets": []}}
+        assert await store.begin("key-2") is not None
+
+    async def test_wait_returns_none_when_first_request_fails(self, redis_client):
+        """Test waiters stop waiting when the in-flight request gives up."""
+        store = IdempotencyStore(redis_client)
+
+        token = await store.begin("key-3")
+        await store.release("key-3", token)
+
+        assert await store.wait_for_response("key-3", timeout=1) is None
@@ -0,0 +1,125 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.services.inventory_service import TicketInventoryService, NumbersUnavailableError, pack_numbers
+
+
+@pytest.mark.asyncio
+class TestTicketInventoryService:
+    async def _load(self, inventory, redis_client, rifa_id, numeros):
+        await redis_client.zadd(inventory.free_key(rifa_id), {n: n for n in numeros})
+        await redis_client.set(inventory.ready_key(rifa_id), 1)
+
+    async def test_claim_not_loaded(self, redis_client):
+        """Test claim returns None when the rifa inventory is not loaded."""
+        inventory = TicketInventoryService(redis_client)
+
+        assert await inventory.claim("rifa-1", 2) is None
+
+    async def test_claim_lowest_numbers(self, redis_client):
+        """Test claim pops the lowest free numbers atomically."""
+        inventory = TicketInventoryService(redis_client)
+        await self._load(inventory, redis_client, "rifa-1", range(1, 11))
+
+        assert await inventory.claim("rifa-1", 3) == [1, 2, 3]
+        assert await inventory.claim("rifa-1", 2) == [4, 5]
+        assert await redis_client.zcard(inventory.free_key("rifa-1")) == 5
+
+    async def test_claim_not_enough(self, redis_client):
+        """Test claim fails without taking anything when stock is short."""
+        inventory = TicketInventoryService(redis_client)
+        await self._load(inventory, redis_client, "rifa-1", [1, 2])
+
+        with pytest.raises(ValueError, match="Not enough tickets available"):
+            await inventory.claim("rifa-1", 3)
+        assert await redis_client.zcard(inventory.free_key("rifa-1")) == 2
+
+    async def test_release(self, redis_client):
+        """Test released numbers can be claimed again."""
+        inventory = TicketInventoryService(redis_client)
+        await self._load(inventory, redis_client, "rifa-1", range(1, 4))
+
+        claimed = await inventory.claim("rifa-1", 2)
+        await inventory.release("rifa-1", claimed)
+
+        assert await inventory.claim("rifa-1", 3) == [1, 2, 3]
+
+    async def test_claim_numbers(self, redis_client):
+        """Test chosen numbers are taken from the free set and marked in the bitmap."""
+        inventory = TicketInventoryService(redis_client)
+        await self._load(inventory, redis_client, "rifa-1", range(1, 11))
+
+        assert await inventory.claim_numbers("rifa-1", [3, 7]) == [3, 7]
+        assert await redis_client.getbit(inventory.taken_key("rifa-1"), 7) == 1
+        assert await inventory.claim("rifa-1", 3) == [1, 2, 4]
+
+    async def test_claim_numbers_conflict_suggests_nearest(self, redis_client):
+        """Test a taken number fails the whole claim and suggests the closest free ones."""
+        inventory = TicketInventoryService(redis_client)
+        await self._load(inventory, redis_client, "rifa-1", range(1, 11))
+        await inventory.claim_numbers("rifa-1", [5, 6])
+
+        with pytest.raises(NumbersUnavailableError) as error:
+            await inventory.claim_numbers("rifa-1", [6, 9])
+
+        assert error.value.unavailable == [6]
+        assert error.value.suggestions == [4, 7]
+        assert await redis_client.getbit(inventory.taken_key("rifa-1"), 9) == 0
+
+    async def test_availability_version_changes_with_inventory(self, redis_client):
+        """Test the availability bitmap reflects claims and its version moves on every change."""
+        inventory = TicketInventoryService(redis_client)
+        await self._load(inventory, redis_client, "rifa-1", range(1, 11))
+
+        await inventory.claim_numbers("rifa-1", [1, 9])
+        bitmap, version = await inventory.availability("rifa-1")
+        assert bitmap == pack_numbers([1, 9], 2)
+
+        await inventory.release("rifa-1", [9])
+        bitmap, next_version = await inventory.availability("rifa-1")
+        assert bitmap[:2] == pack_numbers([1], 2)
+        assert next_version > version
+
+
+class TestPackNumbers:
+    def test_bit_order_matches_redis(self):
+        """Test numero n maps to bit n counting from the most significant bit."""
+        assert pack_numbers([0, 7, 8], 2) == bytes([0b10000001, 0b10000000])
+
+    def test_ignores_numbers_outside_bitmap(self):
+        """Test numbers beyond the bitmap size are skipped."""
+        assert pack_numbers([16], 2) == bytes(2)
+
+
+@pytest.mark.asyncio
+class TestActiveRifaSweeps:
+    def _db(self, rifa_ids, estado):
+        db = AsyncMock()
+        listing = MagicMock()
+        listing.scalars.return_value.all.return_value = rifa_ids
+        current = MagicMock()
+        current.scalar_one_or_none.return_value = estado
+        db.execute.side_effect = [listing, current]
+        return db
+
+    async def test_check_drops_rifa_closed_meanwhile(self):
+        """Test a rifa closed after the listing is not repaired back and its inventory is dropped."""
+        redis = MagicMock()
+        redis.delete = AsyncMock()
+        inventory = TicketInventoryService(redis)
+
+        with patch.object(inventory, "check_consistency", AsyncMock()) as check:
+            assert await inventory.check_active(self._db(["rifa-1"], "cerrada"), repair=True) == []
+
+        check.assert_not_awaited()
+        redis.delete.assert_awaited_once()
+
+    async def test_startup_skips_rifa_closed_meanwhile(self):
+        """Test startup loading skips a rifa that is no longer active."""
+        redis = MagicMock()
+        redis.exists = AsyncMock(return_value=0)
+        inventory = TicketInventoryService(redis)
+
+        with patch.object(inventory, "rebuild", AsyncMock()) as rebuild:
+            assert await inventory.rebuild_active(self._db(["rifa-1"], "cancelada")) == {}
+        rebuild.assert_not_awaited()
@@ -0,0 +1,89 @@
+import json
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from redis.exceptions import RedisError
+
+from app.integrations.loterias.cached_loteria_service import CachedLoteriaService
+
+DRAW = {"date": "2026-10-17", "results": {"Primer Premio": "12345"}}
+
+
+def _redis(cached=None):
+    redis = AsyncMock()
+    redis.register_script = MagicMock(return_value=AsyncMock())
+    redis.get.return_value = cached
+    redis.set.return_value = True
+    return redis
+
+
+def _provider(results=DRAW):
+    provider = MagicMock()
+    provider.get_results.return_value = results
+    return provider
+
+
+@pytest.mark.asyncio
+class TestCachedLoteriaService:
+    async def test_published_results_are_cached_for_good(self):
+        """Test a published draw is stored without expiry and then served from memory."""
+        redis, provider = _redis(), _provider()
+        service = CachedLoteriaService(provider, redis=redis, local_size=8)
+
+        assert await service.get_results("2026-10-17", "baloto") == DRAW
+        assert await service.get_results("2026-10-17", "baloto") == DRAW
+
+        provider.get_results.assert_called_once_with("2026-10-17", "baloto")
+        redis.get.assert_awaited_once()
+        stored = redis.set.await_args_list[1]
+        assert json.loads(stored.args[1]) == DRAW and "ex" not in stored.kwargs
+
+    async def test_pending_draw_is_cached_briefly(self):
+        """Test a draw that is not out yet is cached negatively with a short TTL."""
+        redis, provider = _redis(), _provider(results=None)
+        service = CachedLoteriaService(provider, redis=redis, local_size=8)
+
+        with patch("app.integrations.loterias.cached_loteria_service.settings") as settings:
+            settings.loteria_pending_ttl_seconds = 300
+            assert await service.get_results("2026-10-17", "baloto") is None
+
+        assert redis.set.await_args_list[1].kwargs["ex"] == 300
+        assert not service._local
+
+    async def test_cached_pending_draw_skips_the_provider(self):
+        """Test a negative entry in Redis answers without asking the provider."""
+        redis, provider = _redis(cached=b"null"), _provider()
+        service = CachedLoteriaService(provider, redis=redis, local_size=8)
+
+        assert await service.get_results("2026-10-17", "baloto") is None
+        provider.get_results.assert_not_called()
+
+    async def test_concurrent_miss_waits_for_the_fetching_process(self):
+        """Test a process that loses the fetch lock reads the other one's result."""
+        redis, provider = _redis(), _provider()
+        redis.get.side_effect = [None, None, json.dumps(DRAW).encode()]
+        redis.set.return_value = None
+        redis.exists.return_value = 1
+        service = CachedLoteriaService(provider, redis=redis, local_size=8)
+
+        with patch("app.integrations.loterias.cached_loteria_service.asyncio.sleep", AsyncMock()):
+            assert await service.get_results("2026-10-17", "baloto") == DRAW
+
+        provider.get_results.assert_not_called()
+
+    async def test_redis_outage_falls_back_to_provider(self):
+        """Test results are still returned when Redis is unreachable."""
+        redis, provider = _redis(), _provider()
+        redis.get.side_effect = RedisError("down")
+        service = CachedLoteriaService(provider, redis=redis, local_size=8)
+
+        assert await service.get_results("2026-10-17", "baloto") == DRAW
+
+    async def test_memory_keeps_the_most_recent_draws(self):
+        """Test the in-process cache evicts the least recently used draw."""
+        service = CachedLoteriaService(_provider(), redis=_redis(), local_size=2)
+
+        for date in ["2026-10-15", "2026-10-16", "2026-10-15", "2026-10-17"]:
+            await service.get_results(date, "baloto")
+
+        assert list(service._local) == [("baloto", "2026-10-15"), ("baloto", "2026-10-17")]
@@ -0,0 +1,68 @@
+import uuid
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models.rifa import Rifa
+from app.models.ticket import Ticket
+from app.repositories.base import encode_cursor, decode_cursor, paginate
+
+
+def _db(rows):
+    db = AsyncMock()
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = rows
+    db.execute.return_value = result
+    return db
+
+
+class TestCursor:
+    def test_round_trip_keeps_types(self):
+        """Test a cursor decodes back to the column types it was built from."""
+        values = [datetime(2026, 10, 18, 12, 30, tzinfo=timezone.utc), uuid.uuid4()]
+
+        decoded = decode_cursor(encode_cursor(values), [Rifa.creado_en, Rifa.id])
+
+        assert decoded == values
+
+    @pytest.mark.parametrize("cursor", ["not-base64!", encode_cursor([1]), encode_cursor(["x", "y"])])
+    def test_invalid_cursor(self, cursor):
+        """Test malformed or mismatched cursors are rejected."""
+        with pytest.raises(ValueError, match="Invalid cursor"):
+            decode_cursor(cursor, [Ticket.numero, Ticket.id])
+
+
+@pytest.mark.asyncio
+class TestPaginate:
+    async def test_next_cursor_points_after_last_item(self):
+        """Test a full page fetches one extra row and returns a cursor for the last item kept."""
+        rows = [MagicMock(numero=n, id=uuid.uuid4()) for n in (1, 2, 3)]
+        db = _db(rows)
+
+        page = await paginate(db, select(Ticket), [Ticket.numero, Ticket.id], limit=2)
+
+        assert page.items == rows[:2]
+        assert decode_cursor(page.next_cursor, [Ticket.numero, Ticket.id]) == [2, rows[1].id]
+        sql = str(db.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+        assert "ORDER BY tickets.numero, tickets.id" in sql
+        assert "OFFSET" not in sql
+
+    async def test_last_page_has_no_cursor(self):
+        """Test a short page ends the listing."""
+        page = await paginate(_db([MagicMock(numero=1, id=uuid.uuid4())]), select(Ticket), [Ticket.numero, Ticket.id])
+
+        assert page.next_cursor is None
+
+    async def test_cursor_filters_by_key(self):
+        """Test a cursor turns into a row comparison on the sort key instead of an offset."""
+        db = _db([])
+        cursor = encode_cursor([7, uuid.uuid4()])
+
+        await paginate(db, select(Ticket), [Ticket.numero, Ticket.id], cursor=cursor, skip=100)
+
+        sql = str(db.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+        assert "(tickets.numero, tickets.id) >" in sql
+        assert "OFFSET" not in sql
@@ -0,0 +1,68 @@
+import pytest
+from datetime import date, datetime
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.db.partitions import add_months, transacciones_partition_ddl
+from app.services.partition_maintenance_service import PartitionMaintenanceService
+
+
+def _db(partitions):
+    db = AsyncMock()
+    listing = MagicMock()
+    listing.scalars.return_value.all.return_value = partitions
+    db.execute.return_value = listing
+    return db
+
+
+def _statements(db):
+    return [str(call.args[0]) for call in db.execute.await_args_list[1:]]
+
+
+class TestPartitionHelpers:
+    def test_add_months_crosses_years(self):
+        """Test month arithmetic across year boundaries."""
+        assert add_months(date(2026, 11, 1), 3) == date(2027, 2, 1)
+        assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+
+    def test_month_partition_bounds(self):
+        """Test a monthly partition covers exactly its month."""
+        ddl = transacciones_partition_ddl(date(2026, 12, 1))
+        assert "transacciones_2026_12 PARTITION OF transacciones" in ddl
+        assert "FROM ('2026-12-01') TO ('2027-01-01')" in ddl
+
+
+@pytest.mark.asyncio
+class TestPartitionMaintenanceService:
+    async def test_creates_missing_upcoming_months(self):
+        """Test only the months not yet attached are created."""
+        db = _db(["transacciones_default", "transacciones_2026_10", "transacciones_2026_11"])
+
+        with patch("app.services.partition_maintenance_service.settings") as settings:
+            settings.transacciones_partitions_ahead_months = 3
+            created = await PartitionMaintenanceService().create_upcoming(db, datetime(2026, 10, 18))
+
+        assert created == ["transacciones_2026_12", "transacciones_2027_01"]
+        assert len(_statements(db)) == 2
+
+    async def test_detaches_months_past_retention(self):
+        """Test months older than the retention period are detached and their keys forgotten."""
+        db = _db(["transacciones_2026_07", "transacciones_2026_08", "transacciones_2026_09", "transacciones_2026_10"])
+
+        with patch("app.services.partition_maintenance_service.settings") as settings:
+            settings.transacciones_retention_months = 2
+            detached = await PartitionMaintenanceService().detach_expired(db, datetime(2026, 10, 18))
+
+        assert detached == ["transacciones_2026_07"]
+        statements = _statements(db)
+        assert statements[0] == "ALTER TABLE transacciones DETACH PARTITION transacciones_2026_07"
+        assert statements[1].startswith("DELETE FROM transaccion_claves")
+
+    async def test_retention_disabled_keeps_everything(self):
+        """Test nothing is detached without a retention period."""
+        db = _db(["transacciones_2020_01"])
+
+        with patch("app.services.partition_maintenance_service.settings") as settings:
+            settings.transacciones_retention_months = 0
+            assert await PartitionMaintenanceService().detach_expired(db, datetime(2026, 10, 18)) == []
+
+        db.execute.assert_not_awaited()
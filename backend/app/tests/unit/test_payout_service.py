@@ -0,0 +1,62 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from app.services.payout_service import PayoutService
+
+
+def _winner(id, monto=1000):
+    return SimpleNamespace(id=id, monto_ganado=monto, usuario_id=f"user-{id}")
+
+
+def _service(batches):
+    service = PayoutService()
+    service.ganador_repo = AsyncMock()
+    service.ganador_repo.get_unpaid_batch.side_effect = batches + [[]]
+    service.transaccion_repo = AsyncMock()
+    return service
+
+
+@pytest.mark.asyncio
+class TestPayoutService:
+    async def test_pays_winners_batch_by_batch(self):
+        """Test each batch is one bulk insert, one bulk update and one commit."""
+        service = _service([[_winner(1), _winner(2, 500)], [_winner(3)]])
+        db = AsyncMock()
+
+        with patch("app.services.payout_service.settings") as settings:
+            settings.payout_batch_size = 2
+            results = await service.process_pending(db)
+
+        assert results == {"processed_payments": 3, "total_amount": 2500, "batches": 2, "errors": []}
+        assert db.commit.await_count == 2
+        transactions = service.transaccion_repo.bulk_create.await_args_list[0].args[1]
+        assert [tx["idempotency_key"] for tx in transactions] == ["payout-1", "payout-2"]
+        assert transactions[1]["user_id"] == "user-2"
+
+    async def test_batches_continue_after_the_last_id(self):
+        """Test the next batch is read from after the last winner of the previous one."""
+        service = _service([[_winner(1), _winner(2)]])
+
+        with patch("app.services.payout_service.settings") as settings:
+            settings.payout_batch_size = 2
+            await service.process_pending(AsyncMock(), rifa_id="rifa")
+
+        calls = service.ganador_repo.get_unpaid_batch.await_args_list
+        assert calls[0].args[1:] == (2, None, "rifa")
+        assert calls[1].args[1:] == (2, 2, "rifa")
+
+    async def test_failed_batch_is_rolled_back(self):
+        """Test a failing batch is rolled back alone and the following ones are still paid."""
+        service = _service([[_winner(1)], [_winner(2)]])
+        service.transaccion_repo.bulk_create.side_effect = [Exception("duplicate key"), None]
+        db = AsyncMock()
+
+        with patch("app.services.payout_service.settings") as settings:
+            settings.payout_batch_size = 1
+            results = await service.process_pending(db)
+
+        assert results["processed_payments"] == 1
+        assert results["errors"] == [{"first_winner_id": "1", "count": 1, "error": "duplicate key"}]
+        db.rollback.assert_awaited_once()
+        assert service.ganador_repo.mark_paid.await_count == 1
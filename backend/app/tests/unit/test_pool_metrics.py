@@ -0,0 +1,38 @@
+from unittest.mock import MagicMock
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlalchemy import exc
+from sqlalchemy.util import greenlet_spawn
+
+from app.db.pool_metrics import InstrumentedQueuePool
+
+
+def _sample(name: str, pool: str) -> float:
+    return REGISTRY.get_sample_value(name, {"pool": pool}) or 0
+
+
+@pytest.mark.asyncio
+class TestInstrumentedQueuePool:
+    async def test_checkouts_are_timed_and_timeouts_counted(self):
+        """Test every checkout is observed and an exhausted pool counts a timeout."""
+        pool = InstrumentedQueuePool(MagicMock, pool_size=1, max_overflow=0, timeout=0.01)
+        pool.metrics_name = "test-exhausted"
+
+        def checkout_twice():
+            first = pool.connect()
+            with pytest.raises(exc.TimeoutError):
+                pool.connect()
+            first.close()
+
+        await greenlet_spawn(checkout_twice)
+
+        assert _sample("db_pool_checkout_seconds_count", "test-exhausted") == 2
+        assert _sample("db_pool_checkout_timeouts_total", "test-exhausted") == 1
+
+    async def test_recreated_pool_keeps_its_name(self):
+        """Test the pool built by engine.dispose() reports under the same name."""
+        pool = InstrumentedQueuePool(MagicMock, pool_size=1)
+        pool.metrics_name = "replica-0"
+
+        assert pool.recreate().metrics_name == "replica-0"
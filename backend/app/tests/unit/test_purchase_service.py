@@ -1,7 +1,8 @@
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import Mock, AsyncMock, patch
 from sqlalchemy.orm import Session
 
+from app.integrations.payments.stripe_client import PaymentError, PaymentUnreachableError
 from app.services.purchase_service import PurchaseService
 from app.schemas.ticket import TicketPurchase
 
@@ -18,12 +19,10 @@ class TestPurchaseService:
             idempotency_key="test-key-123"
         )
 
-        with patch('stripe.PaymentIntent.create') as mock_stripe_create, \
-             patch('stripe.PaymentIntent.confirm') as mock_stripe_confirm:
+        with patch('app.integrations.payments.stripe_client.StripeClient.create_payment_intent', new_callable=AsyncMock) as mock_stripe_create, \
+             patch('app.integrations.payments.stripe_client.StripeClient.confirm_payment_intent', new_callable=AsyncMock) as mock_stripe_confirm:
 
-            mock_payment_intent = Mock()
-            mock_payment_intent.id = "pi_test_123"
-            mock_stripe_create.return_value = mock_payment_intent
+            mock_stripe_create.return_value = {"id": "pi_test_123"}
 
             result = service.purchase_tickets(db_session, purchase, str(test_user.id))
 
@@ -115,8 +114,285 @@ class TestPurchaseService:
             idempotency_key="stripe-error-key"
         )
 
-        with patch('stripe.PaymentIntent.create') as mock_stripe_create:
-            mock_stripe_create.side_effect = Exception("Stripe error")
+        with patch('app.integrations.payments.stripe_client.StripeClient.create_payment_intent', new_callable=AsyncMock) as mock_stripe_create:
+            mock_stripe_create.side_effect = PaymentError("Stripe error")
 
             with pytest.raises(ValueError, match="Payment failed"):
-                service.purchase_tickets(db_session, purchase, str(test_user.id))
\ No newline at end of file
+                service.purchase_tickets(db_session, purchase, str(test_user.id))
+
+@pytest.mark.asyncio
+class TestPurchasePipeline:
+    def _service(self):
+        with patch('app.services.purchase_service.TicketInventoryService'), \
+             patch('app.services.purchase_service.get_stripe_client'):
+            service = PurchaseService()
+        service.payments = AsyncMock()
+        service.ticket_repo = AsyncMock()
+        service.rifa_repo = AsyncMock()
+        service.transaccion_repo = AsyncMock()
+        service.counter_repo = AsyncMock()
+        service.inventory = AsyncMock()
+        service.idempotency = AsyncMock()
+        service.idempotency.get_response.return_value = None
+        service.idempotency.begin.return_value = "token"
+        return service
+
+    def _db(self):
+        from unittest.mock import MagicMock
+
+        db = AsyncMock()
+        db.add = MagicMock()
+        return db
+
+    async def test_payment_failure_releases_hold(self):
+        """Test a failed payment releases the held tickets and fails the transaction."""
+        from uuid import uuid4
+
+        service = self._service()
+        db = self._db()
+        service.transaccion_repo.get_by_idempotency_key.return_value = None
+        service.rifa_repo.get_active_rifas.return_value = [Mock()]
+        service.payments.create_payment_intent.return_value = {"id": "pi_test_123"}
+        service.payments.confirm_payment_intent.side_effect = PaymentError("Your card was declined.", 402, "card_declined")
+
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=2, user_id=uuid4(), idempotency_key="hold-key")
+        service.ticket_repo.release_held_tickets.return_value = [
+            Mock(rifa_id=purchase.rifa_id, numero=1),
+            Mock(rifa_id=purchase.rifa_id, numero=2)
+        ]
+
+        held = [Mock(precio=1000)] * 2
+        with patch.object(service, '_claim', return_value=held) as mock_claim:
+            with pytest.raises(ValueError, match="Payment failed"):
+                await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        mock_claim.assert_awaited_once()
+        service.counter_repo.apply_transition.assert_any_await(db, held, "disponible", "reservado")
+        service.ticket_repo.release_held_tickets.assert_awaited_once()
+        service.transaccion_repo.bulk_update_status.assert_awaited_once()
+        service.inventory.release.assert_awaited_once_with(str(purchase.rifa_id), [1, 2])
+
+    async def test_confirm_timeout_after_charge_finalizes(self):
+        """Test a confirmation that timed out but charged the card sells the tickets instead of releasing them."""
+        service = self._service()
+        db = self._db()
+        service.payments.confirm_payment_intent.side_effect = PaymentUnreachableError("read timed out")
+        service.payments.retrieve_payment_intent.return_value = {"id": "pi_test_123", "status": "succeeded"}
+
+        with patch.object(service, '_release') as mock_release:
+            await service._confirm(db, "trans-1", "pi_test_123", "key")
+
+        service.payments.retrieve_payment_intent.assert_awaited_once_with("pi_test_123")
+        mock_release.assert_not_awaited()
+
+    async def test_confirm_timeout_without_charge_releases_hold(self):
+        """Test a confirmation that timed out before charging releases the held tickets."""
+        service = self._service()
+        db = self._db()
+        service.payments.confirm_payment_intent.side_effect = PaymentUnreachableError("read timed out")
+        service.payments.retrieve_payment_intent.return_value = {"id": "pi_test_123", "status": "requires_payment_method"}
+
+        with patch.object(service, '_release') as mock_release:
+            with pytest.raises(PaymentUnreachableError):
+                await service._confirm(db, "trans-1", "pi_test_123", "key")
+
+        mock_release.assert_awaited_once_with(db, "trans-1")
+
+    async def test_confirm_outcome_unknown_keeps_hold(self):
+        """Test the hold is kept for the sweep when Stripe cannot say whether the card was charged."""
+        service = self._service()
+        db = self._db()
+        service.payments.confirm_payment_intent.side_effect = PaymentUnreachableError("read timed out")
+        service.payments.retrieve_payment_intent.side_effect = PaymentUnreachableError("connection refused")
+
+        with patch.object(service, '_release') as mock_release:
+            with pytest.raises(PaymentUnreachableError):
+                await service._confirm(db, "trans-1", "pi_test_123", "key")
+
+        mock_release.assert_not_awaited()
+
+    async def test_expired_hold_is_refunded(self):
+        """Test a payment that completes after its hold expired is refunded."""
+        service = self._service()
+        db = self._db()
+        service.ticket_repo.sell_held_tickets.return_value = []
+        service.ticket_repo.release_held_tickets.return_value = []
+
+        sold = await service._finalize(db, "trans-1", "pi_test_123", 2)
+
+        assert sold == []
+        service.payments.create_refund.assert_awaited_once_with("pi_test_123", idempotency_key="refund-trans-1")
+        db.rollback.assert_awaited()
+        service.transaccion_repo.bulk_update_status.assert_awaited_once()
+
+    async def test_sweep_refunds_charged_expired_holds(self):
+        """Test the hold sweep refunds charged payments, keeps unsettled ones and fails the rest."""
+        service = self._service()
+        db = self._db()
+        service.transaccion_repo.get_charging_with_expired_holds.return_value = [
+            Mock(id="charged", provider_ref="pi_1"), Mock(id="processing", provider_ref="pi_2"), Mock(id="abandoned", provider_ref="pi_3")
+        ]
+        service.payments.retrieve_payment_intent.side_effect = [
+            {"status": "succeeded"}, {"status": "processing"}, {"status": "requires_confirmation"}
+        ]
+        service.ticket_repo.release_expired_holds.return_value = [Mock(rifa_id="rifa", numero=1, transaccion_id="abandoned")]
+
+        with patch.object(service, '_release') as mock_release:
+            results = await service.release_expired_holds(db)
+
+        service.payments.create_refund.assert_awaited_once_with("pi_1", idempotency_key="refund-charged")
+        mock_release.assert_awaited_once_with(db, "charged", status="refunded", from_status=("pending", "failed"))
+        now = service.ticket_repo.release_expired_holds.await_args.args[1]
+        assert now.tzinfo is not None
+        assert service.ticket_repo.release_expired_holds.await_args.kwargs["keep_transactions"] == ["processing"]
+        service.transaccion_repo.bulk_update_status.assert_awaited_once_with(db, ["abandoned"], "failed")
+        assert results["refunded_transactions"] == 1 and results["unsettled_transactions"] == 1
+
+    async def test_cached_response_is_returned(self):
+        """Test a retried purchase returns the stored response without touching the DB."""
+        from uuid import uuid4
+
+        service = self._service()
+        db = self._db()
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=1, user_id=uuid4(), idempotency_key="cached-key")
+        transaction_id = uuid4()
+        service.idempotency.get_response.return_value = {
+            "user_id": str(purchase.user_id),
+            "response": {"tickets": [], "transaccion_id": str(transaction_id)}
+        }
+
+        result = await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        assert result.transaccion_id == transaction_id
+        service.transaccion_repo.get_by_idempotency_key.assert_not_awaited()
+
+    async def test_in_flight_duplicate_waits(self):
+        """Test a duplicate arriving while the first request runs waits for its result."""
+        from uuid import uuid4
+
+        service = self._service()
+        db = self._db()
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=1, user_id=uuid4(), idempotency_key="in-flight-key")
+        transaction_id = uuid4()
+        service.idempotency.begin.return_value = None
+        service.idempotency.wait_for_response.return_value = {
+            "user_id": str(purchase.user_id),
+            "response": {"tickets": [], "transaccion_id": str(transaction_id)}
+        }
+
+        result = await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        assert result.transaccion_id == transaction_id
+        service.idempotency.wait_for_response.assert_awaited_once_with("in-flight-key")
+        service.rifa_repo.get_active_rifa.assert_not_awaited()
+
+    async def test_checkout_cart_single_payment(self):
+        """Test a cart over several rifas is claimed in rifa order and paid once."""
+        from uuid import uuid4
+        from app.schemas.ticket import CartCheckout
+
+        service = self._service()
+        db = self._db()
+        service.transaccion_repo.get_by_idempotency_key.return_value = None
+        service.payments.create_payment_intent.return_value = {"id": "pi_cart_123"}
+        rifa_a, rifa_b = sorted([uuid4(), uuid4()], key=str)
+        service.rifa_repo.get_active_rifas.return_value = [Mock(), Mock()]
+
+        cart = CartCheckout(
+            user_id=uuid4(),
+            idempotency_key="cart-key",
+            items=[
+                {"rifa_id": rifa_b, "quantity": 1},
+                {"rifa_id": rifa_a, "quantity": 2},
+                {"rifa_id": rifa_b, "quantity": 1},
+            ]
+        )
+
+        held = {str(rifa_a): [Mock(precio=1500)] * 2, str(rifa_b): [Mock(precio=500)] * 2}
+        with patch.object(service, '_claim', side_effect=lambda db, rifa_id, *args: held[rifa_id]) as mock_claim, \
+             patch.object(service, '_finalize', return_value=[Mock()] * 4) as mock_finalize, \
+             patch('app.services.purchase_service.TicketPurchaseResponse') as mock_response:
+            await service.checkout_cart(db, cart, str(cart.user_id))
+
+        claimed = [(call.args[1], call.args[2]) for call in mock_claim.await_args_list]
+        # Charged at the price of the held tickets, not a flat rate
+        assert claimed == [(str(rifa_a), 2), (str(rifa_b), 2)]
+        service.payments.create_payment_intent.assert_awaited_once()
+        assert service.payments.create_payment_intent.await_args.kwargs["amount"] == 4000
+        assert mock_finalize.await_args.args[3] == 4
+
+    async def test_failed_batched_reserve_frees_the_idempotency_key(self):
+        """Test a failed allocation deletes the pending transaction, so a retry with the same key can run."""
+        from uuid import uuid4
+
+        service = self._service()
+        db = self._db()
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=2, user_id=uuid4(), idempotency_key="batched-key")
+        service.transaccion_repo.get_by_idempotency_key.return_value = None
+        service.rifa_repo.get_active_rifas.return_value = [Mock()]
+        service.ticket_repo.release_held_tickets.return_value = []
+        allocator = AsyncMock()
+        allocator.allocate.side_effect = ValueError("Not enough tickets available")
+
+        with patch('app.services.purchase_service.settings') as mock_settings, \
+             patch('app.services.purchase_service.get_allocator', return_value=allocator):
+            mock_settings.allocation_mode = "local"
+            mock_settings.ticket_hold_ttl_seconds = 600
+            with pytest.raises(ValueError, match="Not enough tickets"):
+                await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        service.transaccion_repo.delete_pending.assert_awaited_once()
+        assert service.transaccion_repo.delete_pending.await_args.args[2] == "batched-key"
+        service.transaccion_repo.bulk_update_status.assert_not_awaited()
+        service.payments.create_payment_intent.assert_not_awaited()
+
+    async def test_unpriced_tickets_are_not_charged(self):
+        """Test tickets without a price fail the purchase before any PaymentIntent is created."""
+        from uuid import uuid4
+
+        service = self._service()
+        db = self._db()
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=2, user_id=uuid4(), idempotency_key="unpriced-key")
+        service.transaccion_repo.get_by_idempotency_key.return_value = None
+        service.rifa_repo.get_active_rifas.return_value = [Mock()]
+
+        with patch.object(service, '_claim', return_value=[Mock(precio=None, rifa_id=purchase.rifa_id, numero=1)] * 2):
+            with pytest.raises(ValueError, match="no price"):
+                await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        db.rollback.assert_awaited()
+        service.payments.create_payment_intent.assert_not_awaited()
+
+    async def test_chosen_numbers_conflict_suggests_nearest(self):
+        """Test a purchase of taken numbers fails with nearby free numbers and no payment."""
+        from uuid import uuid4
+        from app.services.inventory_service import NumbersUnavailableError
+
+        service = self._service()
+        db = self._db()
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=2, numeros=[7, 8], user_id=uuid4(), idempotency_key="pick-key")
+        service.transaccion_repo.get_by_idempotency_key.return_value = None
+        service.rifa_repo.get_active_rifas.return_value = [Mock(id=purchase.rifa_id, total_boletas=100)]
+        service.inventory.claim_numbers.side_effect = NumbersUnavailableError([7], [6, 9])
+
+        with pytest.raises(NumbersUnavailableError) as error:
+            await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        assert error.value.suggestions == [6, 9]
+        db.rollback.assert_awaited()
+        service.payments.create_payment_intent.assert_not_awaited()
+
+    async def test_chosen_numbers_out_of_range(self):
+        """Test chosen numbers outside the rifa are rejected before reserving."""
+        from uuid import uuid4
+
+        service = self._service()
+        db = self._db()
+        purchase = TicketPurchase(rifa_id=uuid4(), quantity=1, numeros=[101], user_id=uuid4(), idempotency_key="range-key")
+        service.transaccion_repo.get_by_idempotency_key.return_value = None
+        service.rifa_repo.get_active_rifas.return_value = [Mock(id=purchase.rifa_id, total_boletas=100)]
+
+        with pytest.raises(ValueError, match="between 1 and 100"):
+            await service.purchase_tickets(db, purchase, str(purchase.user_id))
+
+        service.inventory.claim_numbers.assert_not_awaited()
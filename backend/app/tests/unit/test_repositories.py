@@ -4,6 +4,7 @@ from sqlalchemy.orm import Session
 from app.repositories.ticket_repository import TicketRepository
 from app.repositories.transaccion_repository import TransaccionRepository
 from app.repositories.rifa_repository import RifaRepository
+from app.repositories.rifa_counter_repository import recompute_statement, transition_deltas
 
 
 class TestTicketRepository:
@@ -144,11 +145,32 @@ class TestRifaRepository:
         """Test getting rifa with available tickets count."""
         repo = RifaRepository()
 
-        # Mark some tickets as sold
+        # Mark some tickets as sold; direct writes bypass the counters, so recount
         for ticket in test_tickets[:3]:
             ticket.estado = "vendido"
+        db_session.execute(recompute_statement([str(test_rifa.id)]))
         db_session.commit()
 
         rifa_with_count = repo.get_rifa_with_tickets_count(db_session, str(test_rifa.id))
         assert rifa_with_count is not None
-        assert rifa_with_count.available_tickets == 7  # 10 total - 3 sold
\ No newline at end of file
+        assert rifa_with_count.available_tickets == 7  # 10 total - 3 sold
+
+class TestRifaCounterDeltas:
+    def test_sale_moves_counts_and_revenue(self):
+        """Test selling held tickets moves them to sold and adds their price to revenue."""
+        from unittest.mock import Mock
+
+        tickets = [Mock(rifa_id="r1", precio=1000), Mock(rifa_id="r1", precio=1000), Mock(rifa_id="r2", precio=None)]
+
+        deltas = transition_deltas(tickets, "reservado", "vendido")
+
+        assert deltas["r1"] == {"reservadas": -2, "vendidas": 2, "recaudo_bruto": 2000}
+        assert deltas["r2"] == {"reservadas": -1, "vendidas": 1, "recaudo_bruto": 0}
+
+    def test_winner_keeps_revenue(self):
+        """Test picking a winner does not change gross revenue."""
+        from unittest.mock import Mock
+
+        deltas = transition_deltas([Mock(rifa_id="r1", precio=1000)], "vendido", "ganador")
+
+        assert deltas["r1"] == {"vendidas": -1, "ganadores": 1}
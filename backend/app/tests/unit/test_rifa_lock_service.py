@@ -0,0 +1,46 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from app.services.rifa_lock_service import RIFA_LOCK_CONTENDED, RifaLock, RifaLockedError
+
+
+def _lock(fencing_token):
+    redis = MagicMock()
+    acquire, release = AsyncMock(return_value=fencing_token), AsyncMock()
+    redis.register_script.side_effect = [acquire, release]
+    return RifaLock(redis=redis), acquire, release
+
+
+@pytest.mark.asyncio
+class TestRifaLock:
+    async def test_holder_gets_fencing_token_and_releases(self):
+        """Test the lease yields its fencing token and is released with the owner token."""
+        lock, acquire, release = _lock(fencing_token=42)
+
+        async with lock.hold("rifa", "close") as fencing_token:
+            assert fencing_token == 42
+
+        assert acquire.await_args.kwargs["keys"] == ["rifa:{rifa}:cierre", "rifa:{rifa}:cierre:fencing"]
+        assert release.await_args.kwargs["args"] == [acquire.await_args.kwargs["args"][0]]
+
+    async def test_released_when_the_operation_fails(self):
+        """Test an error inside the lock still frees the lease."""
+        lock, _, release = _lock(fencing_token=1)
+
+        with pytest.raises(ValueError):
+            async with lock.hold("rifa", "close"):
+                raise ValueError("boom")
+
+        release.assert_awaited_once()
+
+    async def test_contention_is_counted_and_fails_fast(self):
+        """Test a taken lease raises at once and is reported as contention."""
+        lock, _, release = _lock(fencing_token=0)
+        before = RIFA_LOCK_CONTENDED.labels(operation="recalculate")._value.get()
+
+        with pytest.raises(RifaLockedError):
+            async with lock.hold("rifa", "recalculate"):
+                pass
+
+        assert RIFA_LOCK_CONTENDED.labels(operation="recalculate")._value.get() == before + 1
+        release.assert_not_awaited()
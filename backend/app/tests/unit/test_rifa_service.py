@@ -0,0 +1,150 @@
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.rifa_lock_service import RifaLock
+from app.services.rifa_service import RifaService, closing_eta, closing_token, ticket_number
+
+
+def _lock(fencing_token=1):
+    redis = MagicMock()
+    redis.register_script.side_effect = [AsyncMock(return_value=fencing_token), AsyncMock()]
+    return RifaLock(redis=redis)
+
+
+def _db():
+    db = AsyncMock()
+    db.expire_all = MagicMock()
+    return db
+
+
+def _service(rifa, sold_tickets, lock=None):
+    service = RifaService(lock=lock or _lock())
+    service.rifa_repo = AsyncMock()
+    service.rifa_repo.get_by_id.return_value = rifa
+    service.rifa_repo.fence_closing.return_value = True
+    service.ticket_repo = AsyncMock()
+    service.ticket_repo.get_tickets_by_rifa_and_state.return_value = sold_tickets
+    service.ganador_repo = MagicMock()
+    service.ganador_repo.delete_by_rifa = AsyncMock()
+    service.ganador_repo.insert_winners = AsyncMock()
+    service.inventory = AsyncMock()
+    return service
+
+
+@pytest.mark.asyncio
+class TestRifaService:
+    async def test_close_rifa_awards_winners(self):
+        """Test closing marks the drawn tickets as winners and commits once."""
+        rifa = MagicMock(estado="activa", numero_ganadores=2, categoria_id=None)
+        tickets = [MagicMock(estado="vendido") for _ in range(5)]
+        service = _service(rifa, tickets)
+        db = _db()
+
+        result = await service.close_rifa(db, "rifa")
+
+        assert len(result["winners"]) == 2
+        assert rifa.estado == "cerrada"
+        assert sum(ticket.estado == "ganador" for ticket in tickets) == 2
+        winners, monto = service.ganador_repo.add_winners.call_args[0][1:]
+        assert len(winners) == 2 and monto == 0
+        db.commit.assert_awaited_once()
+        service.inventory.drop.assert_awaited_once_with("rifa")
+
+    async def test_close_rifa_not_enough_sold(self):
+        """Test closing fails when fewer tickets were sold than winners are drawn."""
+        service = _service(MagicMock(estado="activa", numero_ganadores=3), [MagicMock()])
+
+        with pytest.raises(HTTPException) as exc:
+            await service.close_rifa(_db(), "rifa")
+        assert exc.value.status_code == 400
+
+    async def test_recalculate_resets_previous_winners(self):
+        """Test recalculating clears the previous draw before drawing again."""
+        rifa = MagicMock(estado="cerrada", numero_ganadores=1, categoria_id=None)
+        service = _service(rifa, [MagicMock(estado="vendido")])
+
+        await service.recalculate_rifa(_db(), "rifa")
+
+        service.ganador_repo.delete_by_rifa.assert_awaited_once()
+        assert service.ticket_repo.set_rifa_tickets_state.call_args[0][1:] == ("rifa", "ganador", "vendido")
+
+    async def test_contended_close_exits_at_once(self):
+        """Test a second closer gives up without fencing or scanning tickets."""
+        service = _service(MagicMock(estado="activa", numero_ganadores=1), [], lock=_lock(fencing_token=0))
+
+        with pytest.raises(HTTPException) as exc:
+            await service.close_rifa(_db(), "rifa")
+
+        assert exc.value.status_code == 409
+        service.rifa_repo.fence_closing.assert_not_awaited()
+        service.ticket_repo.get_tickets_by_rifa_and_state.assert_not_awaited()
+
+    async def test_stale_fencing_token_is_rejected(self):
+        """Test a holder whose lease expired is stopped by the token a newer holder recorded."""
+        service = _service(MagicMock(estado="activa", numero_ganadores=1), [], lock=_lock(fencing_token=7))
+        service.rifa_repo.fence_closing.return_value = False
+        db = _db()
+
+        with pytest.raises(HTTPException) as exc:
+            await service.recalculate_rifa(db, "rifa")
+
+        assert exc.value.status_code == 409
+        assert service.rifa_repo.fence_closing.await_args.args[1:] == ("rifa", 7)
+        db.rollback.assert_awaited_once()
+        service.ganador_repo.delete_by_rifa.assert_not_awaited()
+
+    async def test_close_with_results_matches_in_one_query(self):
+        """Test lottery winners are looked up by number at once and inserted in bulk."""
+        rifa = MagicMock(id="rifa", estado="activa")
+        service = _service(rifa, [])
+        service.ticket_repo.get_tickets_by_numbers.return_value = [MagicMock(id="t1", rifa_id="rifa", numero=12345)]
+        prizes = {"Primer Premio": ("12345", 500), "Segundo Premio": ("67890", 300), "Baloto": ("12-34-56", 100)}
+        db = AsyncMock()
+
+        winners = await service.close_with_results(db, rifa, prizes)
+
+        service.ticket_repo.get_tickets_by_numbers.assert_awaited_once_with(db, "rifa", [12345, 67890], ["vendido", "ganador"])
+        service.ganador_repo.insert_winners.assert_awaited_once_with(db, [{"ticket_id": "t1", "rifa_id": "rifa", "monto_ganado": 500}])
+        assert winners == [{"ticket_id": "t1", "numero": 12345, "prize": "Primer Premio", "monto_ganado": 500}]
+        assert rifa.estado == "cerrada"
+        db.commit.assert_awaited_once()
+        service.inventory.drop.assert_awaited_once_with("rifa")
+
+    async def test_failed_close_keeps_inventory(self):
+        """Test the inventory is only dropped once the closing is committed."""
+        service = _service(MagicMock(estado="activa", numero_ganadores=3), [MagicMock()])
+
+        with pytest.raises(HTTPException):
+            await service.close_rifa(_db(), "rifa")
+        service.inventory.drop.assert_not_awaited()
+
+
+class TestTicketNumber:
+    def test_ticket_number_matches_zero_padded_form(self):
+        """Test winning numbers map to the ticket whose 5-digit form they are."""
+        assert ticket_number("00042") == 42
+        assert ticket_number("123456") == 123456
+        assert ticket_number("0042") is None
+        assert ticket_number("1111-2") is None
+
+
+class TestClosingSchedule:
+    def test_token_is_the_utc_fecha_fin(self):
+        """Test the same instant gives the same token whatever its timezone, and another date a new one."""
+        fecha_fin = datetime(2026, 10, 20, 18, 0, tzinfo=timezone.utc)
+        bogota = fecha_fin.astimezone(timezone(timedelta(hours=-5)))
+
+        assert closing_token(bogota) == closing_token(fecha_fin.replace(tzinfo=None)) == "2026-10-20T18:00:00+00:00"
+        assert closing_token(fecha_fin + timedelta(hours=1)) != closing_token(fecha_fin)
+
+    def test_eta_is_capped_for_distant_dates(self):
+        """Test a closing runs at fecha_fin when close, and wakes up earlier when far away."""
+        now = datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)
+
+        with patch("app.services.rifa_service.settings") as settings:
+            settings.rifa_closing_max_eta_seconds = 3000
+            assert closing_eta(now + timedelta(minutes=10), now) == now + timedelta(minutes=10)
+            assert closing_eta(now + timedelta(days=3), now) == now + timedelta(seconds=3000)
@@ -0,0 +1,63 @@
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from redis.exceptions import RedisError
+
+from app.db import session as db_session
+
+
+REPLICA = AsyncMock(name="replica")
+
+
+def _replicas(monkeypatch, redis):
+    """Route reads to a stand-in replica; the same Postgres aliased twice behaves alike."""
+    replica = MagicMock()
+    replica.__aenter__ = AsyncMock(return_value=REPLICA)
+    replica.__aexit__ = AsyncMock(return_value=False)
+    monkeypatch.setattr(db_session, "replica_engines", [MagicMock()])
+    monkeypatch.setattr(db_session, "ReadSessionLocal", lambda: replica)
+    monkeypatch.setattr(db_session, "get_redis", lambda: redis)
+
+
+async def _session(user_id=None):
+    generator = db_session.get_read_db(user_id)
+    session = await generator.__anext__()
+    await generator.aclose()
+    return session
+
+
+@pytest.mark.asyncio
+class TestReadRouting:
+    async def test_reads_go_to_replica(self, monkeypatch):
+        """Test anonymous and idle users read from a replica."""
+        redis = AsyncMock()
+        redis.exists.return_value = 0
+        _replicas(monkeypatch, redis)
+
+        assert await _session() is REPLICA
+        assert await _session("user") is REPLICA
+
+    async def test_recent_writer_reads_from_primary(self, monkeypatch):
+        """Test a user who just bought keeps reading from the primary."""
+        redis = AsyncMock()
+        redis.exists.return_value = 1
+        _replicas(monkeypatch, redis)
+
+        await db_session.mark_recent_write("user")
+        session = await _session("user")
+
+        assert session is not REPLICA
+        assert redis.set.call_args.kwargs["ex"] == db_session.settings.read_your_writes_seconds
+
+    async def test_redis_outage_falls_back_to_primary(self, monkeypatch):
+        """Test reads go to the primary when the stickiness marker cannot be checked."""
+        redis = AsyncMock()
+        redis.exists.side_effect = RedisError("down")
+        _replicas(monkeypatch, redis)
+
+        assert await db_session.has_recent_write("user")
+
+    async def test_no_replicas_means_primary(self):
+        """Test without replicas nothing is marked and reads use the primary."""
+        assert db_session.replica_engines == []
+        assert not await db_session.has_recent_write("user")
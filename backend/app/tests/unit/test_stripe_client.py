@@ -0,0 +1,80 @@
+import httpx
+import pytest
+from unittest.mock import patch
+
+from app.integrations.payments.stripe_client import PaymentError, PaymentUnreachableError, StripeClient, encode_params
+from app.tests.stubs.stripe_stub import state
+
+
+def test_encode_params():
+    """Test nested params are flattened to Stripe's form encoding."""
+    encoded = encode_params({"amount": 2000, "metadata": {"rifa_id": "abc", "quantity": 2}, "skip": None})
+    assert encoded == {"amount": "2000", "metadata[rifa_id]": "abc", "metadata[quantity]": "2"}
+
+
+@pytest.mark.asyncio
+class TestStripeClient:
+    async def test_create_and_confirm(self, stripe_client):
+        """Test creating and confirming a PaymentIntent."""
+        payment_intent = await stripe_client.create_payment_intent(2000, metadata={"rifa_id": "abc"})
+        assert payment_intent["amount"] == 2000
+        assert payment_intent["metadata"] == {"rifa_id": "abc"}
+
+        confirmed = await stripe_client.confirm_payment_intent(payment_intent["id"])
+        assert confirmed["status"] == "succeeded"
+
+    async def test_retries_server_errors(self, stripe_client):
+        """Test 5xx responses are retried with the same idempotency key."""
+        state.fail_next = 2
+
+        with patch("app.integrations.payments.stripe_client.backoff_delay", return_value=0):
+            payment_intent = await stripe_client.create_payment_intent(1000, idempotency_key="retry-key")
+
+        assert state.requests == 3
+        assert len(state.payment_intents) == 1
+        assert payment_intent["id"] in state.payment_intents
+
+    async def test_gives_up_after_max_retries(self, stripe_client):
+        """Test a persistent outage surfaces as PaymentError."""
+        state.fail_next = 10
+
+        with patch("app.integrations.payments.stripe_client.backoff_delay", return_value=0):
+            with pytest.raises(PaymentError) as exc_info:
+                await stripe_client.create_payment_intent(1000)
+
+        assert exc_info.value.status_code == 500
+        assert state.requests == 3
+
+    async def test_card_declined_is_not_retried(self, stripe_client):
+        """Test client errors are raised immediately."""
+        payment_intent = await stripe_client.create_payment_intent(1000)
+        state.decline = True
+        requests_before = state.requests
+
+        with pytest.raises(PaymentError, match="declined") as exc_info:
+            await stripe_client.confirm_payment_intent(payment_intent["id"])
+
+        assert exc_info.value.code == "card_declined"
+        assert state.requests == requests_before + 1
+
+    async def test_timeout_is_reported_as_unreachable(self):
+        """Test exhausted network errors raise PaymentUnreachableError, since the call may have gone through."""
+        def timeout(request):
+            raise httpx.ReadTimeout("read timed out", request=request)
+
+        client = StripeClient(api_key="sk_test_stub", base_url="http://stripe-stub", max_retries=1, transport=httpx.MockTransport(timeout))
+        with patch("app.integrations.payments.stripe_client.backoff_delay", return_value=0):
+            with pytest.raises(PaymentUnreachableError):
+                await client.confirm_payment_intent("pi_test_123")
+        await client.aclose()
+
+    async def test_non_json_error_body(self):
+        """Test an HTML error page from a proxy surfaces as PaymentError with its status code."""
+        gateway = httpx.MockTransport(lambda request: httpx.Response(502, text="<html>Bad Gateway</html>"))
+
+        client = StripeClient(api_key="sk_test_stub", base_url="http://stripe-stub", max_retries=0, transport=gateway)
+        with pytest.raises(PaymentError, match="returned 502") as exc_info:
+            await client.create_payment_intent(1000)
+        await client.aclose()
+
+        assert exc_info.value.status_code == 502
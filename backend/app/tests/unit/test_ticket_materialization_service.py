@@ -0,0 +1,76 @@
+import pytest
+from unittest.mock import AsyncMock, Mock, patch
+
+from app.services import ticket_materialization_service
+from app.services.ticket_materialization_service import TicketMaterializationService
+
+
+@pytest.mark.asyncio
+class TestTicketMaterializationService:
+    def _service(self, rifa):
+        with patch('app.services.ticket_materialization_service.TicketInventoryService'):
+            service = TicketMaterializationService()
+        service.ticket_repo = AsyncMock()
+        service.rifa_repo = AsyncMock()
+        service.counter_repo = AsyncMock()
+        service.inventory = AsyncMock()
+        service.rifa_repo.get_by_id.return_value = rifa
+        service.ticket_repo.materialize_tickets.side_effect = lambda db, rifa_id, first, last, precio: last - first + 1
+        return service
+
+    async def test_large_rifa_is_created_in_chunks(self):
+        """Test tickets are created in set-based chunks with the category price."""
+        rifa = Mock(id="rifa-1", total_boletas=250, categoria_id="cat-1", estado="activa")
+        service = self._service(rifa)
+        db = AsyncMock()
+        db.execute.return_value = Mock(scalar_one_or_none=Mock(return_value=5000))
+
+        with patch.object(ticket_materialization_service, "MATERIALIZE_CHUNK_SIZE", 100):
+            created = await service.materialize(db, "rifa-1")
+
+        assert created == 250
+        ranges = [call.args[2:] for call in service.ticket_repo.materialize_tickets.await_args_list]
+        assert ranges == [(1, 100, 5000), (101, 200, 5000), (201, 250, 5000)]
+        assert db.commit.await_count == 3
+        service.inventory.rebuild.assert_awaited_once_with(db, "rifa-1")
+
+    async def test_rerun_creates_nothing(self):
+        """Test materializing an already complete rifa is a no-op."""
+        rifa = Mock(id="rifa-1", total_boletas=10, categoria_id=None, estado="pendiente")
+        service = self._service(rifa)
+        service.ticket_repo.materialize_tickets.side_effect = None
+        service.ticket_repo.materialize_tickets.return_value = 0
+
+        assert await service.materialize(AsyncMock(), "rifa-1") == 0
+        service.counter_repo.apply_deltas.assert_awaited_once()
+        service.inventory.rebuild.assert_not_awaited()
+
+    async def test_activation_loads_inventory_of_existing_tickets(self):
+        """Test activating a rifa created as pendiente loads its inventory though no ticket is created."""
+        rifa = Mock(id="rifa-1", total_boletas=10, categoria_id=None, estado="activa")
+        service = self._service(rifa)
+        service.ticket_repo.materialize_tickets.side_effect = None
+        service.ticket_repo.materialize_tickets.return_value = 0
+        db = AsyncMock()
+
+        assert await service.materialize(db, "rifa-1") == 0
+        service.inventory.rebuild.assert_awaited_once_with(db, "rifa-1")
+
+    async def test_compact_rifa_creates_no_rows(self):
+        """Test a compact rifa only gets its counters and inventory refreshed."""
+        rifa = Mock(id="rifa-1", total_boletas=1000000, categoria_id=None, estado="activa", almacenamiento="compacto")
+        service = self._service(rifa)
+        db = AsyncMock()
+
+        assert await service.materialize(db, "rifa-1") == 0
+        service.ticket_repo.materialize_tickets.assert_not_awaited()
+        service.counter_repo.recompute.assert_awaited_once_with(db, "rifa-1")
+        db.commit.assert_awaited_once()
+        service.inventory.rebuild.assert_awaited_once_with(db, "rifa-1")
+
+    async def test_missing_rifa(self):
+        """Test materializing an unknown rifa fails."""
+        service = self._service(None)
+
+        with pytest.raises(ValueError, match="Rifa not found"):
+            await service.materialize(AsyncMock(), "missing")
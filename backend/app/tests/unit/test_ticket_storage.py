@@ -0,0 +1,77 @@
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.models.ticket import Ticket
+from app.repositories.ticket_repository import TicketRepository
+
+COMPACT = (100, 5000)  # (total_boletas, valor_boleta)
+
+
+def _result(numbers=(), tickets=(), rowcount=0):
+    result = MagicMock()
+    result.scalars.return_value.all.return_value = list(tickets) or list(numbers)
+    result.all.return_value = list(tickets)
+    result.rowcount = rowcount
+    return result
+
+
+@pytest.mark.asyncio
+class TestCompactTicketStorage:
+    async def test_free_tickets_are_transient(self):
+        """Test free tickets of a compact rifa are built from the free numbers, without rows."""
+        repo = TicketRepository()
+        db = AsyncMock()
+        db.execute.return_value = _result(numbers=[3, 4])
+
+        with patch.object(repo, "_compact_rifa", AsyncMock(return_value=COMPACT)):
+            tickets = await repo.get_available_tickets_with_lock(db, "rifa", 2, skip_locked=True)
+
+        assert [(ticket.numero, ticket.precio, ticket.id) for ticket in tickets] == [(3, 5000, None), (4, 5000, None)]
+
+    async def test_claim_next_retries_numbers_taken_meanwhile(self):
+        """Test numbers inserted by another buyer first are replaced by the next free ones."""
+        repo = TicketRepository()
+        db = AsyncMock()
+        db.execute.side_effect = [_result(numbers=[1, 2]), _result(numbers=[3])]
+        first, second = Ticket(numero=1), Ticket(numero=3)
+        inserted = AsyncMock(side_effect=[[first], [second]])
+
+        with patch.object(repo, "_compact_rifa", AsyncMock(return_value=COMPACT)), \
+                patch.object(repo, "_insert_taken", inserted):
+            tickets = await repo.claim_next_available(db, "rifa", 2, {"estado": "reservado"})
+
+        assert tickets == [first, second]
+        assert inserted.await_args_list[1].args[3] == [3]
+
+    async def test_bulk_hold_conflict_fails_the_batch(self):
+        """Test holding numbers of a compact rifa fails when one was inserted meanwhile."""
+        repo = TicketRepository()
+        db = AsyncMock()
+        db.execute.return_value = _result(rowcount=1)
+        assignments = [{"id": None, "numero": 1, "estado": "reservado"}, {"id": None, "numero": 2, "estado": "reservado"}]
+
+        with patch.object(repo, "_compact_rifa", AsyncMock(return_value=COMPACT)):
+            with pytest.raises(ValueError, match="taken by another purchase"):
+                await repo.bulk_hold_tickets(db, "rifa", assignments)
+
+    async def test_bulk_hold_row_mode_updates_by_id(self):
+        """Test rifas with a row per number are held with an UPDATE by primary key."""
+        repo = TicketRepository()
+        db = AsyncMock()
+
+        with patch.object(repo, "_compact_rifa", AsyncMock(return_value=None)):
+            await repo.bulk_hold_tickets(db, "rifa", [{"id": "t1", "numero": 1, "estado": "reservado"}])
+
+        assert db.execute.await_args.args[1] == [{"id": "t1", "estado": "reservado", "rifa_id": "rifa"}]
+
+    async def test_release_covers_both_storage_modes(self):
+        """Test releasing a transaction deletes compact rows and resets the others."""
+        repo = TicketRepository()
+        db = AsyncMock()
+        db.execute.side_effect = [_result(tickets=[("rifa-a", 1)]), _result(tickets=[("rifa-b", 7)])]
+
+        released = await repo.release_held_tickets(db, "tx")
+
+        assert released == [("rifa-a", 1), ("rifa-b", 7)]
+        statements = [call.args[0] for call in db.execute.await_args_list]
+        assert [statement.is_delete for statement in statements] == [True, False]
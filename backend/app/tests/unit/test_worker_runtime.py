@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from app.workers import runtime
+
+
+@pytest.fixture
+def worker():
+    engine = MagicMock()
+    engine.dispose = AsyncMock()
+    factory = MagicMock()
+    with patch.object(runtime, "create_session_factory", return_value=(engine, factory)) as create, \
+            patch.object(runtime, "close_redis", AsyncMock()):
+        runtime.init_worker_process()
+        yield create, engine, factory
+        runtime.shutdown_worker_process()
+
+
+class TestWorkerRuntime:
+    def test_tasks_share_one_event_loop(self, worker):
+        """Test successive tasks run on the same loop, so pooled connections survive between them."""
+        async def current_loop():
+            return asyncio.get_running_loop()
+
+        assert runtime.run_async(current_loop()) is runtime.run_async(current_loop())
+
+    def test_engine_is_created_once_per_process(self, worker):
+        """Test the worker engine is created at process start and reused by every session."""
+        create, _, factory = worker
+
+        runtime.init_worker_process()
+        runtime.worker_session()
+        runtime.worker_session()
+
+        create.assert_called_once()
+        assert create.call_args.args[1:] == (runtime.settings.worker_db_pool_size, runtime.settings.worker_db_max_overflow)
+        assert factory.call_count == 2
+
+    def test_shutdown_disposes_the_engine(self, worker):
+        """Test a stopping worker process closes its pooled connections and its loop."""
+        _, engine, _ = worker
+        loop = runtime._loop
+
+        runtime.shutdown_worker_process()
+
+        engine.dispose.assert_awaited_once()
+        assert loop.is_closed()
+        assert runtime._loop is None
@@ -0,0 +1,69 @@
+"""
+Async runtime of a Celery worker process.
+
+Tasks are sync functions while repositories and services are async. Running
+each task under asyncio.run would open a new event loop per task and lose
+every pooled asyncpg and Redis connection with it, since they belong to the
+loop that opened them. Instead each worker process owns one event loop and
+one database engine, created at worker_process_init (after the fork, so no
+connection is shared with the parent) and reused by every task it runs.
+
+This supports the prefork (default) and solo pools. Outside a worker (eager
+tasks, scripts), the runtime is created on first use.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from celery.signals import worker_process_init, worker_process_shutdown
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.redis import close_redis
+from app.db.session import create_session_factory
+
+logger = logging.getLogger(__name__)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_engine = None
+_session_factory = None
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs) -> None:
+    global _loop, _engine, _session_factory
+    if _loop is not None:
+        return
+    _loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(_loop)
+    _engine, _session_factory = create_session_factory(
+        "worker", settings.worker_db_pool_size, settings.worker_db_max_overflow
+    )
+
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs) -> None:
+    global _loop, _engine, _session_factory
+    if _loop is None:
+        return
+    try:
+        _loop.run_until_complete(_engine.dispose())
+        _loop.run_until_complete(close_redis())
+    except Exception as e:
+        logger.warning(f"Error closing worker connections: {str(e)}")
+    finally:
+        _loop.close()
+        asyncio.set_event_loop(None)
+        _loop = _engine = _session_factory = None
+
+
+def run_async(coro):
+    """Run an async service call from a sync Celery task on the process event loop."""
+    init_worker_process()
+    return _loop.run_until_complete(coro)
+
+
+def worker_session() -> AsyncSession:
+    """Session on the worker process engine."""
+    init_worker_process()
+    return _session_factory()
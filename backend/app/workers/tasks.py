@@ -1,281 +1,331 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Optional
 import logging
 
-from sqlalchemy.orm import Session
-from celery import shared_task
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from celery import chord, shared_task
 from celery.utils.log import get_task_logger
 
 from app.core.celery_app import celery_app
-from app.db.session import SessionLocal
+from app.core.config import settings
 from app.repositories.rifa_repository import RifaRepository
-from app.repositories.ticket_repository import TicketRepository
-from app.repositories.transaccion_repository import TransaccionRepository
-from app.integrations.loterias.mock_loteria_service import MockLoteriaService
+from app.repositories.rifa_counter_repository import RifaCounterRepository
+from app.integrations.loterias.cached_loteria_service import get_loteria_service
+from app.services.inventory_service import TicketInventoryService
+from app.services.partition_maintenance_service import PartitionMaintenanceService
+from app.services.payout_service import PayoutService
+from app.services.purchase_service import PurchaseService
+from app.services.rifa_lock_service import RifaLockedError
+from app.services.rifa_service import RifaService, closing_eta, closing_token
+from app.services.ticket_materialization_service import TicketMaterializationService
+from app.workers.runtime import run_async, worker_session
 from app.models.rifa import Rifa
-from app.models.ticket import Ticket
-from app.models.ganador import Ganador
-from app.models.transaccion import Transaccion
-import stripe
 
 logger = get_task_logger(__name__)
 
+# Errors of a connection lost midway, worth running the task again for
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, RedisError, ConnectionError)
 
-@shared_task(bind=True, name="app.workers.tasks.close_rifa", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+
+@shared_task(bind=True, name="app.workers.tasks.close_rifa", max_retries=3, default_retry_delay=60)
 def close_rifa(self, rifa_id: Optional[str] = None) -> Dict[str, Any]:
     """
-    Close rifa and determine winners based on lottery results.
-    If rifa_id is None, close all expired rifas.
-    Includes retries and idempotence checks.
+    Close one rifa and determine its winners based on lottery results.
+    Without rifa_id, fan out one task per expired rifa instead (see
+    close_expired_rifas). Lost database or Redis connections are retried;
+    other errors, and those once retries run out, are reported in the
+    results so the chord still gets its summary.
     """
-    db: Session = SessionLocal()
-    try:
-        rifa_repo = RifaRepository()
-        ticket_repo = TicketRepository()
-        loteria_service = MockLoteriaService()
-
-        if rifa_id:
-            rifas_to_close = [rifa_repo.get_by_id(db, rifa_id)]
-        else:
-            # Get all active rifas that have expired
-            expired_rifas = db.query(Rifa).filter(
-                Rifa.estado == "activa",
-                Rifa.fecha_fin <= datetime.utcnow()
-            ).all()
-            rifas_to_close = expired_rifas
-
-        results = {"closed_rifas": [], "errors": []}
-
-        for rifa in rifas_to_close:
-            if not rifa:
-                continue
-
-            # Idempotence check: skip if already closed
-            if rifa.estado == "cerrada":
-                logger.info(f"Rifa {rifa.id} already closed, skipping")
-                continue
+    if rifa_id is None:
+        return dispatch_expired_rifas()
 
+    async def _close():
+        async with worker_session() as db:
+            results = {"closed_rifas": [], "errors": []}
             try:
-                # Get lottery results for the rifa date
-                rifa_date = rifa.fecha_fin.date().isoformat()
-                loteria_results = loteria_service.get_results(rifa_date, str(rifa.loteria_id))
-
-                if not loteria_results:
-                    logger.warning(f"No lottery results found for rifa {rifa.id} on date {rifa_date}")
-                    continue
-
-                # Get all tickets for this rifa
-                tickets = ticket_repo.get_tickets_by_rifa(db, str(rifa.id))
-                winners = []
-
-                # Determine winners based on lottery results and rifa rules
-                for prize_name, winning_number in loteria_results["results"].items():
-                    # Find tickets that match the winning number
-                    matching_tickets = [t for t in tickets if str(t.numero).zfill(5) == winning_number]
-
-                    for ticket in matching_tickets[:rifa.numero_ganadores]:  # Limit by number of winners
-                        winners.append({
-                            "ticket_id": str(ticket.id),
-                            "numero": ticket.numero,
-                            "prize": prize_name,
-                            "monto_ganado": calculate_prize_amount(rifa, prize_name)
-                        })
-
-                # Check for existing winners to ensure idempotence
-                existing_winners = db.query(Ganador).filter(Ganador.ticket_id.in_([w["ticket_id"] for w in winners])).all()
-                existing_ticket_ids = {str(g.ticket_id) for g in existing_winners}
-
-                # Mark winners and update ticket status
-                for winner in winners:
-                    if winner["ticket_id"] in existing_ticket_ids:
-                        logger.info(f"Winner for ticket {winner['ticket_id']} already exists, skipping")
-                        continue
-
-                    ticket = ticket_repo.update_ticket_status(db, winner["ticket_id"], "ganador")
-
-                    # Create winner record
-                    ganador = Ganador(
-                        ticket_id=winner["ticket_id"],
-                        monto_ganado=winner["monto_ganado"]
-                    )
-                    db.add(ganador)
-
-                # Update rifa status
-                rifa.estado = "cerrada"
-                db.commit()
-
-                results["closed_rifas"].append({
-                    "rifa_id": str(rifa.id),
-                    "winners_count": len(winners),
-                    "winners": winners
-                })
-
-                logger.info(f"Successfully closed rifa {rifa.id} with {len(winners)} winners")
-
+                closed = await _close_one(db, rifa_id)
+                if closed:
+                    results["closed_rifas"].append(closed)
             except Exception as e:
-                logger.error(f"Error closing rifa {rifa.id}: {str(e)}")
-                results["errors"].append({
-                    "rifa_id": str(rifa.id),
-                    "error": str(e)
-                })
-                db.rollback()
+                await db.rollback()
+                if isinstance(e, TRANSIENT_ERRORS) and self.request.retries < self.max_retries:
+                    raise
+                # Reported to the summary rather than raised: a chord waits for every rifa
+                logger.error(f"Error closing rifa {rifa_id}: {str(e)}")
+                results["errors"].append({"rifa_id": rifa_id, "error": str(e)})
+            return results
+
+    try:
+        return run_async(_close())
+    except TRANSIENT_ERRORS as e:
+        raise self.retry(exc=e)
+
 
-        return results
+@shared_task(bind=True, name="app.workers.tasks.close_rifa_at")
+def close_rifa_at(self, rifa_id: str, token: str) -> Dict[str, Any]:
+    """
+    Close a rifa at its fecha_fin, as scheduled when the rifa is created or
+    its date changes. `token` is the fecha_fin it was scheduled for (see
+    closing_token): once the date changes, this task finds another token and
+    does nothing. While lottery results are not out it retries along
+    `rifa_closing_retry_delays_seconds`; the periodic sweeps catch later ones.
+    """
+    async def _close():
+        async with worker_session() as db:
+            rifa = await RifaRepository().get_by_id(db, rifa_id)
+            if not rifa or rifa.estado != "activa" or rifa.fecha_fin is None or closing_token(rifa.fecha_fin) != token:
+                return {"rifa_id": rifa_id, "status": "stale"}
+            if datetime.fromisoformat(token) > datetime.now(timezone.utc):
+                return {"rifa_id": rifa_id, "status": "waiting"}
+            closed = await _close_one(db, rifa_id)
+            return {"rifa_id": rifa_id, "status": "closed" if closed else "pending", "closed": closed}
+
+    result = run_async(_close())
+    if result["status"] == "waiting":
+        # Woken before fecha_fin to stay under the broker visibility timeout
+        close_rifa_at.apply_async(args=[rifa_id, token], eta=closing_eta(datetime.fromisoformat(token)))
+    elif result["status"] == "pending":
+        delays = settings.rifa_closing_retry_delays_seconds
+        if self.request.retries < len(delays):
+            raise self.retry(countdown=delays[self.request.retries], max_retries=len(delays))
+        logger.warning(f"No lottery results for rifa {rifa_id} after {len(delays)} retries, left to the periodic sweeps")
+    return result
+
+
+@shared_task(bind=True, name="app.workers.tasks.close_expired_rifas")
+def close_expired_rifas(self) -> Dict[str, Any]:
+    """Safety-net sweep: enqueue the closing of every expired rifa still open, one task each."""
+    return dispatch_expired_rifas()
+
+
+def dispatch_expired_rifas() -> Dict[str, Any]:
+    """
+    Enqueue a close_rifa task per expired rifa as a chord, so they run in
+    parallel across workers and summarize_rifa_closing reports once all are
+    done. Nothing waits on the results.
+    """
+    async def _expired():
+        async with worker_session() as db:
+            expired = await db.execute(select(Rifa.id).where(
+                Rifa.estado == "activa",
+                Rifa.fecha_fin <= datetime.utcnow()
+            ))
+            return [str(expired_id) for expired_id in expired.scalars().all()]
+
+    rifa_ids = run_async(_expired())
+    if not rifa_ids:
+        return {"dispatched": 0}
+
+    result = chord(close_rifa.s(current_id) for current_id in rifa_ids)(summarize_rifa_closing.s())
+    logger.info(f"Dispatched closing of {len(rifa_ids)} expired rifas")
+    return {"dispatched": len(rifa_ids), "summary_task_id": result.id}
+
+
+@shared_task(bind=True, name="app.workers.tasks.summarize_rifa_closing")
+def summarize_rifa_closing(self, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Chord callback of dispatch_expired_rifas: merge the per-rifa results."""
+    summary = {"closed_rifas": [], "errors": []}
+    for result in results:
+        summary["closed_rifas"].extend(result.get("closed_rifas", []))
+        summary["errors"].extend(result.get("errors", []))
+    logger.info(f"Closed {len(summary['closed_rifas'])} rifas, {len(summary['errors'])} errors")
+    return summary
+
+
+async def _close_one(db: AsyncSession, rifa_id: str) -> Optional[Dict[str, Any]]:
+    """Close one rifa against its lottery results. Returns None when there is nothing to do yet."""
+    rifa = await RifaRepository().get_by_id(db, rifa_id)
+    if not rifa:
+        return None
+
+    # Idempotence check: skip if already closed
+    if rifa.estado == "cerrada":
+        logger.info(f"Rifa {rifa.id} already closed, skipping")
+        return None
+
+    # Get lottery results for the rifa date
+    rifa_date = rifa.fecha_fin.date().isoformat()
+    loteria_results = await get_loteria_service().get_results(rifa_date, str(rifa.loteria_id))
+    if not loteria_results:
+        logger.warning(f"No lottery results found for rifa {rifa.id} on date {rifa_date}")
+        return None
+
+    # Winners are resolved in SQL by number; existing winner records are kept
+    prizes = {
+        prize_name: (winning_number, calculate_prize_amount(rifa, prize_name))
+        for prize_name, winning_number in loteria_results["results"].items()
+    }
+    service = RifaService()
+    try:
+        async with service.locked(db, rifa_id, "close"):
+            # Re-checked under the lock: another closer may have finished meanwhile
+            rifa = await RifaRepository().get_by_id(db, rifa_id)
+            if rifa.estado == "cerrada":
+                logger.info(f"Rifa {rifa_id} closed by another task, skipping")
+                return None
+            winners = await service.close_with_results(db, rifa, prizes)
+    except RifaLockedError as e:
+        logger.info(f"Skipping rifa {rifa_id}: {str(e)}")
+        return None
 
-    finally:
-        db.close()
+    logger.info(f"Successfully closed rifa {rifa_id} with {len(winners)} winners")
+    return {"rifa_id": rifa_id, "winners_count": len(winners), "winners": winners}
 
 
 @shared_task(bind=True, name="app.workers.tasks.process_payouts", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
 def process_payouts(self, rifa_id: Optional[str] = None) -> Dict[str, Any]:
     """
-    Process payouts for winners using Stripe.
+    Process payouts for winners using Stripe, in batches (see PayoutService).
     If rifa_id is None, process payouts for all closed rifas with unpaid winners.
     """
-    db: Session = SessionLocal()
-    try:
-        transaccion_repo = TransaccionRepository()
-
-        # Get unpaid winners
-        if rifa_id:
-            winners = db.query(Ganador).join(Ticket).join(Rifa).filter(
-                Rifa.id == rifa_id,
-                Ganador.fecha_pago.is_(None)
-            ).all()
-        else:
-            winners = db.query(Ganador).filter(
-                Ganador.fecha_pago.is_(None)
-            ).all()
-
-        results = {"processed_payments": [], "errors": []}
-
-        for winner in winners:
-            try:
-                # Idempotence check: skip if already paid
-                if winner.fecha_pago is not None:
-                    logger.info(f"Payout for winner {winner.id} already processed, skipping")
-                    continue
-
-                ticket = db.query(Ticket).filter(Ticket.id == winner.ticket_id).first()
-                if not ticket or not ticket.usuario_id:
-                    continue
-
-                # Get user payment method (assuming stored in transaction)
-                transaction = db.query(Transaccion).filter(
-                    Transaccion.id == ticket.transaccion_id
-                ).first()
-
-                if not transaction:
-                    continue
-
-                # Process payout via Stripe
-                payout_amount = winner.monto_ganado
-
-                # Create Stripe payout (simplified - in real implementation, use proper Stripe Connect)
-                # This is a mock implementation
-                payout = {
-                    "id": f"payout_{winner.id}",
-                    "amount": payout_amount,
-                    "status": "succeeded"
-                }
-
-                # Update winner with payout info
-                winner.fecha_pago = datetime.utcnow()
-                winner.referencia_pago = payout["id"]
-
-                # Create payout transaction record
-                payout_transaction = Transaccion(
-                    user_id=ticket.usuario_id,
-                    amount=payout_amount,
-                    currency="COP",
-                    provider="stripe",
-                    provider_ref=payout["id"],
-                    status="succeeded"
-                )
-                db.add(payout_transaction)
-                db.commit()
-
-                results["processed_payments"].append({
-                    "winner_id": str(winner.id),
-                    "amount": payout_amount,
-                    "payout_id": payout["id"]
-                })
-
-                logger.info(f"Successfully processed payout for winner {winner.id}: {payout_amount} COP")
+    async def _pay():
+        async with worker_session() as db:
+            return await PayoutService().process_pending(db, rifa_id)
 
-            except Exception as e:
-                logger.error(f"Error processing payout for winner {winner.id}: {str(e)}")
-                results["errors"].append({
-                    "winner_id": str(winner.id),
-                    "error": str(e)
-                })
-                db.rollback()
-
-        return results
-
-    finally:
-        db.close()
+    results = run_async(_pay())
+    logger.info(
+        f"Processed {results['processed_payments']} payouts ({results['total_amount']} COP) "
+        f"in {results['batches']} batches, {len(results['errors'])} failed batches"
+    )
+    return results
 
 
 @shared_task(bind=True, name="app.workers.tasks.reconcile_loteria")
 def reconcile_loteria(self) -> Dict[str, Any]:
     """
     Periodic task to fetch and reconcile lottery results.
-    Updates any pending rifas that might have results available.
+    Rifas whose results are available get a close_rifa task enqueued.
     """
-    db: Session = SessionLocal()
-    try:
-        loteria_service = MockLoteriaService()
-        rifa_repo = RifaRepository()
+    async def _candidates():
+        async with worker_session() as db:
+            # Get active rifas that might need reconciliation
+            active = await db.execute(select(Rifa.id, Rifa.fecha_fin, Rifa.loteria_id).where(
+                Rifa.estado == "activa",
+                Rifa.fecha_fin <= datetime.utcnow() + timedelta(days=1)  # Within last day
+            ))
+            return active.all()
+
+    # Rifas on the same lottery and date share one cached draw
+    loteria_service = get_loteria_service()
+    results = {"reconciled_rifas": [], "errors": []}
+
+    for rifa_id, fecha_fin, loteria_id in run_async(_candidates()):
+        try:
+            # Check if lottery results are available
+            rifa_date = fecha_fin.date().isoformat()
+            loteria_results = run_async(loteria_service.get_results(rifa_date, str(loteria_id)))
+
+            if loteria_results:
+                # Closing runs in its own task; waiting for it here would hold this worker
+                close_rifa.apply_async(args=[str(rifa_id)])
+            results["reconciled_rifas"].append({
+                "rifa_id": str(rifa_id),
+                "results_available": bool(loteria_results),
+                "closing_dispatched": bool(loteria_results)
+            })
+
+        except Exception as e:
+            logger.error(f"Error reconciling rifa {rifa_id}: {str(e)}")
+            results["errors"].append({
+                "rifa_id": str(rifa_id),
+                "error": str(e)
+            })
+
+    logger.info(f"Successfully reconciled {len(results['reconciled_rifas'])} rifas")
+    return results
+
+
+@shared_task(bind=True, name="app.workers.tasks.check_ticket_inventory")
+def check_ticket_inventory(self, repair: bool = True) -> Dict[str, Any]:
+    """
+    Periodic consistency check of the Redis ticket inventory against Postgres.
+    Inconsistent or missing inventories are rebuilt from the tickets table.
+    """
+    async def _check():
+        async with worker_session() as db:
+            return await TicketInventoryService().check_active(db, repair=repair)
 
-        # Get active rifas that might need reconciliation
-        active_rifas = db.query(Rifa).filter(
-            Rifa.estado == "activa",
-            Rifa.fecha_fin <= datetime.utcnow() + timedelta(days=1)  # Within last day
-        ).all()
+    reports = run_async(_check())
+    inconsistent = [report for report in reports if not report["consistent"]]
+    for report in inconsistent:
+        logger.warning(
+            f"Ticket inventory for rifa {report['rifa_id']} out of sync: "
+            f"{len(report['missing'])} missing, {len(report['extra'])} extra"
+        )
 
-        results = {"reconciled_rifas": [], "errors": []}
+    return {"checked_rifas": len(reports), "inconsistent": inconsistent}
 
-        for rifa in active_rifas:
-            try:
-                # Check if lottery results are available
-                rifa_date = rifa.fecha_fin.date().isoformat()
-                loteria_results = loteria_service.get_results(rifa_date, str(rifa.loteria_id))
-
-                if loteria_results:
-                    # Trigger rifa closing if results are available
-                    close_result = close_rifa.apply(args=[str(rifa.id)]).get()
-
-                    if close_result and "closed_rifas" in close_result:
-                        results["reconciled_rifas"].append({
-                            "rifa_id": str(rifa.id),
-                            "results_available": True,
-                            "closed": True
-                        })
-                    else:
-                        results["reconciled_rifas"].append({
-                            "rifa_id": str(rifa.id),
-                            "results_available": True,
-                            "closed": False
-                        })
-                else:
-                    results["reconciled_rifas"].append({
-                        "rifa_id": str(rifa.id),
-                        "results_available": False
-                    })
 
-            except Exception as e:
-                logger.error(f"Error reconciling rifa {rifa.id}: {str(e)}")
-                results["errors"].append({
-                    "rifa_id": str(rifa.id),
-                    "error": str(e)
-                })
+@shared_task(bind=True, name="app.workers.tasks.release_expired_holds")
+def release_expired_holds(self) -> Dict[str, Any]:
+    """
+    Release tickets held by purchases whose payment never completed
+    (crashed or abandoned requests) and mark their transactions as failed.
+    Holds whose payment was charged anyway are refunded.
+    """
+    async def _release():
+        async with worker_session() as db:
+            return await PurchaseService().release_expired_holds(db)
+
+    results = run_async(_release())
+    if results["released_tickets"]:
+        logger.info(f"Released {results['released_tickets']} expired ticket holds")
+    if results["refunded_transactions"]:
+        logger.warning(f"Refunded {results['refunded_transactions']} payments charged after their hold expired")
+    return results
 
-        logger.info(f"Successfully reconciled {len(results['reconciled_rifas'])} rifas")
-        return results
 
-    finally:
-        db.close()
+@shared_task(bind=True, name="app.workers.tasks.materialize_rifa_tickets", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def materialize_rifa_tickets(self, rifa_id: str) -> Dict[str, Any]:
+    """
+    Create the tickets of a rifa too large to materialize inside the request.
+    Safe to retry: numbers already created are skipped.
+    """
+    async def _materialize():
+        async with worker_session() as db:
+            return await TicketMaterializationService().materialize(db, rifa_id)
+
+    created = run_async(_materialize())
+    logger.info(f"Materialized {created} tickets for rifa {rifa_id}")
+    return {"rifa_id": rifa_id, "created_tickets": created}
+
+
+@shared_task(bind=True, name="app.workers.tasks.repair_rifa_counters")
+def repair_rifa_counters(self) -> Dict[str, Any]:
+    """
+    Recompute rifa_counters from the tickets table. Counters are maintained
+    transactionally, so any drift found here points at a write path that
+    bypasses them.
+    """
+    async def _repair():
+        async with worker_session() as db:
+            return await RifaCounterRepository().repair_all(db)
+
+    drifted = run_async(_repair())
+    for report in drifted:
+        logger.warning(f"Rifa counters for {report['rifa_id']} had drifted: {report['drift']}")
+    return {"drifted": drifted}
+
+
+@shared_task(bind=True, name="app.workers.tasks.maintain_partitions", autoretry_for=(Exception,), retry_kwargs={'max_retries': 3})
+def maintain_partitions(self) -> Dict[str, Any]:
+    """
+    Create the upcoming monthly partitions of transacciones before any row
+    needs them, and detach the months past the retention period.
+    """
+    async def _maintain():
+        async with worker_session() as db:
+            report = await PartitionMaintenanceService().run(db)
+            await db.commit()
+            return report
+
+    report = run_async(_maintain())
+    if report["created"] or report["detached"]:
+        logger.info(f"Partitions created: {report['created']}, detached: {report['detached']}")
+    return report
 
 
 def calculate_prize_amount(rifa: Rifa, prize_name: str) -> int: